@@ -1,26 +1,130 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import serial
+import tkinter.font as tkfont
 import serial.tools.list_ports
 import threading
+import queue
 import time
-import struct
+import os
+import mmap
+
+from bootloader_client import BootloaderClient, APP_START_ADDRESS, FLASH_END, MAX_WRITE_WINDOW
+from bootloader_gang import find_ports, run_gang
+from bootloader_image import load_image
+from bootloader_metrics import save_metrics
+from bootloader_recipe import load_recipe, run_plan
+from bootloader_watch import PortWatcher, PortMatcher, AutoFlasher, describe_port
 
 # 版本信息
 __version__ = "1.3.0"  # 更新版本號
 __author__ = "Marlon"  # 添加作者信息
 
+UI_REFRESH_MS = 33  # 介面刷新週期 (約30幀/秒)
+
+class HexViewer:
+    """虛擬化十六進位檢視器：以mmap打開轉存文件，只繪製可見的行"""
+    
+    BYTES_PER_ROW = 16
+    
+    def __init__(self, parent, path, base_address=0):
+        self.path = path
+        self.base_address = base_address
+        self.top_row = 0
+        self.visible_rows = 32
+        
+        self.file = open(path, 'rb')
+        size = os.path.getsize(path)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.total_rows = max(1, (len(self.data) + self.BYTES_PER_ROW - 1) // self.BYTES_PER_ROW)
+        
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"{os.path.basename(path)} - {len(self.data)} 字節 @ 0x{base_address:08X}")
+        self.window.geometry("720x520")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        self.text = tk.Text(self.window, font=("Courier New", 10), wrap=tk.NONE)
+        self.scrollbar = ttk.Scrollbar(self.window, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.text.bind("<Configure>", self.on_resize)
+        self.text.bind("<MouseWheel>", self.on_mousewheel)
+        self.text.bind("<Button-4>", lambda e: self.scroll_to(self.top_row - 3))
+        self.text.bind("<Button-5>", lambda e: self.scroll_to(self.top_row + 3))
+        self.render()
+        
+    def format_row(self, row):
+        """格式化一行: 地址、十六進位與ASCII"""
+        offset = row * self.BYTES_PER_ROW
+        chunk = self.data[offset:offset + self.BYTES_PER_ROW]
+        hex_part = " ".join(f"{b:02X}" for b in chunk).ljust(self.BYTES_PER_ROW * 3 - 1)
+        ascii_part = "".join(chr(b) if 32 <= b < 127 else "." for b in chunk)
+        return f"0x{self.base_address + offset:08X}: {hex_part}  {ascii_part}"
+        
+    def render(self):
+        """只繪製目前可見的行"""
+        last_row = min(self.top_row + self.visible_rows, self.total_rows)
+        lines = [self.format_row(row) for row in range(self.top_row, last_row)]
+        self.text.config(state=tk.NORMAL)
+        self.text.delete(1.0, tk.END)
+        self.text.insert(tk.END, "\n".join(lines))
+        self.text.config(state=tk.DISABLED)
+        self.scrollbar.set(self.top_row / self.total_rows, last_row / self.total_rows)
+        
+    def scroll_to(self, row):
+        row = max(0, min(row, self.total_rows - self.visible_rows))
+        if row != self.top_row:
+            self.top_row = row
+            self.render()
+            
+    def on_scroll(self, action, value, unit=None):
+        """捲軸回調 (moveto / scroll)"""
+        if action == "moveto":
+            self.scroll_to(int(float(value) * self.total_rows))
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_to(self.top_row + int(value) * step)
+            
+    def on_mousewheel(self, event):
+        self.scroll_to(self.top_row - int(event.delta / 120) * 3)
+        
+    def on_resize(self, event):
+        line_height = max(1, tkfont.Font(font=self.text.cget("font")).metrics("linespace"))
+        rows = max(1, event.height // line_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.render()
+            
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+        self.window.destroy()
+
+
 class BootloaderGUI:
     def __init__(self, root):
         self.root = root
         self.root.title(f"STM32 UART Bootloader Tool v{__version__} - by {__author__}")  # 在標題中顯示版本號和作者
         self.root.geometry("800x600")
         
-        self.serial_port = None
-        self.connected = False
+        # 工作線程不直接操作Tk：日誌與介面更新放入佇列，由主線程定時刷新
+        self.ui_queue = queue.Queue()
+        self.pending_progress = None  # 只保留最新的進度值
+        self.transfer_times = {}  # (文件, 窗口, 壓縮, 差異, 介面日誌) -> 最近一次的傳輸耗時，比較日誌開關用
+        self.held_logs = {}  # 線程ID -> 暫存的日誌行 (關閉傳輸日誌時只暫存該傳輸線程的日誌)
+        
+        # 協議引擎 (所有串口操作都經由它完成)
+        self.client = BootloaderClient(log=self.log_message, progress=self.set_progress)
         
         self.setup_ui()
         self.refresh_ports()
+        self.process_ui_queue()
+        
+        # 背景監視串口插拔：自動更新串口列表，勾選「插入即燒錄」時插入符合的設備即燒錄
+        self.auto_flasher = None
+        self.port_watcher = PortWatcher(self.on_port_arrive, self.on_port_leave)
+        self.port_watcher.start()
         
     def setup_ui(self):
         # 主框架
@@ -36,13 +140,23 @@ class BootloaderGUI:
         self.port_combo.grid(row=0, column=1, padx=5)
         
         ttk.Label(port_frame, text="波特率:").grid(row=0, column=2, padx=5)
-        self.baud_combo = ttk.Combobox(port_frame, values=['115200', '57600', '38400', '19200', '9600'])
+        self.baud_combo = ttk.Combobox(port_frame, values=['115200', '57600', '38400', '19200', '9600', '230400', '460800', '921600'])
         self.baud_combo.set('115200')
         self.baud_combo.grid(row=0, column=3, padx=5)
         
         ttk.Button(port_frame, text="刷新", command=self.refresh_ports).grid(row=0, column=4, padx=5)
         self.connect_btn = ttk.Button(port_frame, text="連接", command=self.toggle_connection)
         self.connect_btn.grid(row=0, column=5, padx=5)
+        ttk.Button(port_frame, text="提速", command=self.escalate_baud).grid(row=0, column=6, padx=5)
+        
+        # 批量燒錄 (依VID:PID選取所有符合的串口)
+        ttk.Label(port_frame, text="批量 VID:PID:").grid(row=1, column=0, padx=5, pady=(5, 0))
+        self.gang_filter_var = tk.StringVar(value="0483:5740")
+        ttk.Entry(port_frame, textvariable=self.gang_filter_var, width=15).grid(row=1, column=1, padx=5, pady=(5, 0))
+        ttk.Button(port_frame, text="批量燒錄", command=self.gang_flash).grid(row=1, column=2, padx=5, pady=(5, 0))
+        self.auto_flash_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(port_frame, text="插入即燒錄", variable=self.auto_flash_var,
+                        command=self.toggle_auto_flash).grid(row=1, column=3, padx=5, pady=(5, 0))
         
         # 設備信息區域
         info_frame = ttk.LabelFrame(main_frame, text="設備信息", padding="5")
@@ -86,8 +200,44 @@ class BootloaderGUI:
         ttk.Button(btn_frame, text="寫入", command=self.write_flash).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="讀取", command=self.read_flash).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="跳轉執行", command=self.jump_to_app).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="轉存到文件", command=self.dump_flash).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="檢視轉存", command=self.open_hex_viewer).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="執行配方", command=self.run_recipe).pack(side=tk.LEFT, padx=5)
+
+        # 寫入選項
+        option_frame = ttk.Frame(operation_frame)
+        option_frame.grid(row=3, column=0, columnspan=4, sticky=tk.W)
+
+        self.pipeline_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="管線寫入", variable=self.pipeline_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(option_frame, text="窗口:").pack(side=tk.LEFT)
+        self.window_var = tk.StringVar(value="4")
+        ttk.Spinbox(option_frame, from_=1, to=MAX_WRITE_WINDOW, textvariable=self.window_var, width=4).pack(side=tk.LEFT, padx=5)
+
+        self.blank_check_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(option_frame, text="跳過空白扇區", variable=self.blank_check_var).pack(side=tk.LEFT, padx=5)
+
+        self.delta_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="差異燒錄", variable=self.delta_var).pack(side=tk.LEFT, padx=5)
+        self.delta_source_var = tk.StringVar(value="回讀")
+        ttk.Combobox(option_frame, textvariable=self.delta_source_var, values=["回讀", "快取"],
+                     width=6, state="readonly").pack(side=tk.LEFT, padx=5)
+
+        self.compress_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="壓縮傳輸", variable=self.compress_var).pack(side=tk.LEFT, padx=5)
+
+        self.verify_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(option_frame, text="寫入後驗證", variable=self.verify_var).pack(side=tk.LEFT, padx=5)
+
+        self.resume_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="斷點續傳", variable=self.resume_var).pack(side=tk.LEFT, padx=5)
+
+        # 關閉時傳輸期間的日誌先暫存，結束後一次輸出 (用來量測介面日誌對傳輸時間的影響)
+        self.ui_log_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(option_frame, text="傳輸日誌", variable=self.ui_log_var).pack(side=tk.LEFT, padx=5)
         # 在 setup_ui 函數的 info_frame 部分添加
         ttk.Button(info_frame, text="重新連接", command=self.reconnect_bootloader).grid(row=0, column=5, padx=5)
+        ttk.Button(info_frame, text="匯出統計", command=self.export_metrics).grid(row=0, column=6, padx=5)
         
         # 進度條
         self.progress = ttk.Progressbar(main_frame, mode='determinate')
@@ -133,14 +283,57 @@ class BootloaderGUI:
  
         
     def log_message(self, message):
-        """添加訊息到狀態窗口"""
+        """添加訊息到狀態窗口 (任何線程皆可調用，不會阻塞)"""
         timestamp = time.strftime("%H:%M:%S")
-        self.status_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.status_text.see(tk.END)
-        self.root.update()
+        line = f"[{timestamp}] {message}\n"
+        held = self.held_logs.get(threading.get_ident())
+        if held is not None:
+            held.append(line)
+        else:
+            self.ui_queue.put(line)
         
-    def refresh_ports(self):
-        """刷新串口列表 (確保映射正確)"""
+    def set_progress(self, value):
+        """更新進度條 (合併更新，只顯示最新值)"""
+        self.pending_progress = value
+        
+    def run_in_ui(self, func, *args):
+        """在主線程執行介面操作 (供工作線程使用)"""
+        self.ui_queue.put((func, args))
+        
+    def process_ui_queue(self):
+        """主線程定時取出佇列：日誌一次插入，進度只刷新最新值"""
+        lines = []
+        try:
+            while True:
+                item = self.ui_queue.get_nowait()
+                if isinstance(item, str):
+                    lines.append(item)
+                    continue
+                    
+                # 保持順序：先輸出之前的日誌再執行介面操作
+                if lines:
+                    self.status_text.insert(tk.END, "".join(lines))
+                    lines = []
+                func, args = item
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"介面更新錯誤: {e}")
+        except queue.Empty:
+            pass
+            
+        if lines:
+            self.status_text.insert(tk.END, "".join(lines))
+            self.status_text.see(tk.END)
+            
+        progress, self.pending_progress = self.pending_progress, None
+        if progress is not None:
+            self.progress['value'] = progress
+            
+        self.root.after(UI_REFRESH_MS, self.process_ui_queue)
+        
+    def refresh_ports(self, quiet=False):
+        """刷新串口列表 (確保映射正確)；quiet 為True時 (插拔事件觸發) 不輸出映射並保留目前的選擇"""
         ports_info = []
         port_values = []
         
@@ -179,6 +372,11 @@ class BootloaderGUI:
         # 建立映射關係
         self.port_mapping = dict(zip(ports_info, port_values))
         
+        if quiet:
+            if self.port_combo.get() not in ports_info:
+                self.port_combo.set(ports_info[0] if ports_info else "")
+            return
+            
         # 調試信息
         self.log_message(f"串口映射關係:")
         for display, actual in self.port_mapping.items():
@@ -188,6 +386,19 @@ class BootloaderGUI:
             self.port_combo.set(ports_info[0])
             
         self.log_message(f"找到 {len(ports_info)} 個串口設備")
+        
+    def on_port_arrive(self, port):
+        """串口插入 (監視線程)"""
+        self.log_message(f"串口插入: {describe_port(port)}")
+        self.run_in_ui(self.refresh_ports, True)
+        flasher = self.auto_flasher
+        if flasher:
+            flasher.on_arrive(port)
+            
+    def on_port_leave(self, device):
+        """串口移除 (監視線程)"""
+        self.log_message(f"串口移除: {device}")
+        self.run_in_ui(self.refresh_ports, True)
             
     def clear_device_info(self):
         """清空設備信息"""
@@ -195,665 +406,508 @@ class BootloaderGUI:
         self.version_var.set("未知")
         self.log_message("設備信息已清空")
 
+    def get_selected_port(self):
+        """從下拉選單的顯示文本取得實際串口名稱"""
+        # 獲取選中的顯示文本
+        selected_display = self.port_combo.get()
+        
+        # 正確提取COM口名稱
+        if hasattr(self, 'port_mapping') and selected_display in self.port_mapping:
+            return self.port_mapping[selected_display]
+            
+        # 使用正則表達式提取COM口
+        import re
+        com_match = re.match(r'(COM\d+)', selected_display)
+        if com_match:
+            return com_match.group(1)
+            
+        # 備用方法
+        if ' - ' in selected_display:
+            return selected_display.split(' - ')[0].strip()
+        elif '(' in selected_display:
+            return selected_display.split('(')[0].strip()
+        else:
+            return selected_display.strip()
+
     def toggle_connection(self):
         """切換連接狀態"""
-        if not self.connected:
+        if not self.client.connected:
             try:
-                # 獲取選中的顯示文本
-                selected_display = self.port_combo.get()
-                
-                # 正確提取COM口名稱
-                if hasattr(self, 'port_mapping') and selected_display in self.port_mapping:
-                    port = self.port_mapping[selected_display]
-                else:
-                    # 使用正則表達式提取COM口
-                    import re
-                    com_match = re.match(r'(COM\d+)', selected_display)
-                    if com_match:
-                        port = com_match.group(1)
-                    else:
-                        # 備用方法
-                        if ' - ' in selected_display:
-                            port = selected_display.split(' - ')[0].strip()
-                        elif '(' in selected_display:
-                            port = selected_display.split('(')[0].strip()
-                        else:
-                            port = selected_display.strip()
-                
+                port = self.get_selected_port()
                 baud = int(self.baud_combo.get())
-                self.serial_port = serial.Serial(port, baud, timeout=1)
-                self.connected = True
+                self.client.connect(port, baud)
                 self.connect_btn.config(text="斷開")
-                self.log_message(f"已連接到 {port} @ {baud}")
-                self.log_message(f"設備: {selected_display}")
+                self.log_message(f"設備: {self.port_combo.get()}")
             except Exception as e:
                 messagebox.showerror("錯誤", f"連接失敗: {str(e)}")
         else:
-            if self.serial_port:
-                self.serial_port.close()
-            self.connected = False
+            self.client.disconnect()
             self.connect_btn.config(text="連接")
-            self.log_message("已斷開連接")
             
             # 清空設備信息
             self.clear_device_info()
             
-    def send_command(self, command, data=None):
-        """發送命令到Bootloader"""
-        if not self.connected:
-            messagebox.showerror("錯誤", "請先連接串口")
-            return None
+    def escalate_baud(self):
+        """與Bootloader協商更高的波特率"""
+        if not self.ensure_connected():
+            return
             
-        try:
-            # 發送命令
-            self.serial_port.write(bytes([command]))
-            
-            # 等待ACK
-            response = self.serial_port.read(1)
-            if len(response) == 0 or response[0] != 0x79:
-                self.log_message(f"命令 0x{command:02X} 未收到ACK")
-                return None
-                
-            # 發送數據(如果有)
-            if data:
-                self.serial_port.write(data)
+        def escalate_thread():
+            try:
+                baud = self.client.escalate_baud()
+                self.run_in_ui(self.baud_combo.set, str(baud))
+            except Exception as e:
+                self.log_message(f"提速錯誤: {str(e)}")
                 
-            return True
-            
-        except Exception as e:
-            self.log_message(f"發送命令錯誤: {str(e)}")
-            return None
+        threading.Thread(target=escalate_thread, daemon=True).start()
+        
+    def ensure_connected(self):
+        """檢查是否已連接串口"""
+        if not self.client.connected:
+            messagebox.showerror("錯誤", "請先連接串口")
+            return False
+        return True
             
     def read_chip_id(self):
         """讀取芯片ID (增強版)"""
-        try:
-            # 先檢查連接狀態
-            if not self.check_bootloader_alive():
-                self.log_message("Bootloader連接已斷開，嘗試重新連接...")
-                if not self.reconnect_bootloader():
-                    return
-                    
-            self.get_custom_chip_id()
+        if not self.ensure_connected():
+            return
+        target = self.get_reconnect_target()
             
-        except Exception as e:
-            self.log_message(f"讀取芯片ID錯誤: {str(e)}")
-            self.serial_port.write(b'\xFF\xFF')  # 擦除所有扇區
+        def chip_id_thread():
+            try:
+                # 閒置或出錯後才檢查連接狀態
+                if not self.client.ensure_alive(reconnect=False):
+                    self.log_message("Bootloader連接已斷開，嘗試重新連接...")
+                    if not self.do_reconnect(target):
+                        return
+                        
+                # 本次連接已讀取過時使用快取
+                chip_id = self.client.get_chip_id()
+                if chip_id is not None:
+                    self.run_in_ui(self.chip_id_var.set, f"0x{chip_id:08X} ({self.client.get_chip_name(chip_id)})")
+                
+            except Exception as e:
+                self.log_message(f"讀取芯片ID錯誤: {str(e)}")
+                self.client.serial_port.write(b'\xFF\xFF')  # 擦除所有扇區
+                
+        threading.Thread(target=chip_id_thread, daemon=True).start()
                 
     def read_version(self):
         """讀取版本 (增強版)"""
+        if not self.ensure_connected():
+            return
+        target = self.get_reconnect_target()
+            
+        def version_thread():
+            try:
+                # 閒置或出錯後才檢查連接狀態
+                if not self.client.ensure_alive(reconnect=False):
+                    self.log_message("Bootloader連接已斷開，嘗試重新連接...")
+                    if not self.do_reconnect(target):
+                        return
+                        
+                version_str = self.client.get_version()
+                if version_str is not None:
+                    self.run_in_ui(self.version_var.set, version_str)  # 設置版本顯示
+            
+            except Exception as e:
+                self.log_message(f"讀取版本錯誤: {str(e)}")
+                
+        threading.Thread(target=version_thread, daemon=True).start()
+                
+    def get_reconnect_target(self):
+        """在主線程讀取目前選中的串口與波特率"""
         try:
-            # 先檢查連接狀態
-            if not self.check_bootloader_alive():
-                self.log_message("Bootloader連接已斷開，嘗試重新連接...")
-                if not self.reconnect_bootloader():
-                    return
-                    
-            self.get_custom_version()
+            return self.get_selected_port(), int(self.baud_combo.get())
+        except ValueError:
+            return self.get_selected_port(), None
+            
+    def do_reconnect(self, target):
+        """重新連接 (在工作線程中執行)"""
+        port, baud = target
+        self.log_message(f"選中的串口: {port}")
+        if self.client.reconnect_bootloader(port, baud):
+            self.run_in_ui(self.connect_btn.config, {"text": "斷開"})
+            return True
+        return False
+        
+    def reconnect_bootloader(self):
+        """重新連接Bootloader (使用目前選中的串口與波特率)"""
+        target = self.get_reconnect_target()
+        threading.Thread(target=self.do_reconnect, args=(target,), daemon=True).start()
         
-        except Exception as e:
-            self.log_message(f"讀取版本錯誤: {str(e)}")
-                
     def browse_file(self):
         """瀏覽文件"""
         filename = filedialog.askopenfilename(
             title="選擇固件文件",
-            filetypes=[("Binary files", "*.bin"), ("Hex files", "*.hex"), ("All files", "*.*")]
+            filetypes=[("Firmware files", "*.bin *.hex *.srec *.s19 *.s28 *.s37 *.elf"),
+                       ("Binary files", "*.bin"), ("Hex files", "*.hex"),
+                       ("S-record files", "*.srec *.s19 *.s28 *.s37"), ("ELF files", "*.elf"), ("All files", "*.*")]
         )
         if filename:
             self.file_path_var.set(filename)
             
+    def parse_address(self):
+        """解析地址欄位"""
+        address_str = self.address_var.get()
+        return int(address_str, 16) if address_str.startswith('0x') else int(address_str)
+        
+    def get_write_window(self):
+        """讀取管線寫入窗口 (0 = 停等模式)"""
+        if not self.pipeline_var.get():
+            return 0
+        try:
+            return min(MAX_WRITE_WINDOW, max(1, int(self.window_var.get())))
+        except ValueError:
+            return 4
+            
     def erase_flash(self):
-        """擦除Flash"""
+        """擦除Flash (只擦除文件涉及的扇區)"""
+        if not self.ensure_connected():
+            return
+            
+        # 在主線程讀取表單
+        file_path = self.file_path_var.get()
+        if file_path and os.path.isfile(file_path):
+            try:
+                address = self.parse_address()
+            except ValueError:
+                messagebox.showerror("錯誤", "地址格式錯誤")
+                return
+        else:
+            # 沒有選擇文件：擦除整個應用程序區域
+            file_path = None
+        blank_check = self.blank_check_var.get()
+            
         def erase_thread():
             try:
-                self.log_message("開始擦除Flash...")
-                self.progress['value'] = 0
-
-                # 發送擦除命令
-                if self.send_command(0x44):  # CMD_ERASE_MEMORY
-                    # 發送擦除扇區數量 (擦除所有應用程序區域)
-                    num_sectors = 6  # 擦除扇區2-7
-                    checksum = 0xFF ^ num_sectors
-                    data = bytes([num_sectors, checksum])
-
-                    self.serial_port.write(data)
-
-                    # 🔧 帶進度顯示的等待擦除完成
-                    self.log_message("等待擦除完成...")
-                    
-                    # 預估總時間 (6個扇區 * 2秒/扇區 = 12秒)
-                    estimated_time = num_sectors * 2  # 12秒
-                    check_interval = 0.1  # 每100ms檢查一次
-                    max_wait_time = 20.0  # 最大等待20秒
-                    
-                    start_time = time.time()
-                    
-                    # 設置短超時，循環檢查
-                    old_timeout = self.serial_port.timeout
-                    self.serial_port.timeout = check_interval
-                    
-                    try:
-                        while True:
-                            elapsed_time = time.time() - start_time
-                            
-                            # 更新進度條
-                            progress = min(90, (elapsed_time / estimated_time) * 90)
-                            self.progress['value'] = progress
-                            
-                            # 檢查是否收到回應
-                            response = self.serial_port.read(1)
-                            if len(response) == 1 and response[0] == 0x79:
-                                self.log_message("Flash擦除完成")
-                                self.progress['value'] = 100
-                                break
-                            
-                            # 檢查超時
-                            if elapsed_time > max_wait_time:
-                                self.log_message(f"Flash擦除超時 ({max_wait_time}秒)")
-                                return
-                            
-                            # 顯示進度
-                            if int(elapsed_time) % 2 == 0:  # 每2秒更新一次訊息
-                                self.log_message(f"擦除進行中... ({elapsed_time:.1f}s)")
-                            
-                            time.sleep(0.1)  # 避免CPU佔用過高
-                            
-                    finally:
-                        # 恢復原始超時設置
-                        self.serial_port.timeout = old_timeout
-                        
+                if file_path:
+                    # 只擦除文件各段涉及的扇區
+                    self.client.erase_segments(load_image(file_path, address), blank_check)
                 else:
-                    self.log_message("發送擦除命令失敗")
-                    return
-
+                    self.client.erase_range(APP_START_ADDRESS, FLASH_END - APP_START_ADDRESS, blank_check)
             except Exception as e:
                 self.log_message(f"擦除錯誤: {str(e)}")
 
         threading.Thread(target=erase_thread, daemon=True).start()
-
-
-    def get_custom_version(self):
-        """獲取自定義Bootloader版本 (增強版)"""
-        try:
-            # 清空緩衝區
-            self.serial_port.reset_input_buffer()
-            
-            # 發送GET_VERSION命令 (0x01)
-            self.serial_port.write(bytes([0x01]))
-            self.log_message("發送GET_VERSION命令: 0x01")
-            
-            # 等待ACK (增加重試機制)
-            for retry in range(3):
-                response = self.serial_port.read(1)
-                if len(response) == 1 and response[0] == 0x79:
-                    break
-                elif retry < 2:
-                    self.log_message(f"重試獲取版本 {retry + 1}/3")
-                    time.sleep(0.1)
-                    self.serial_port.write(bytes([0x01]))
-                else:
-                    self.log_message(f"版本命令ACK失敗: {response.hex() if response else 'None'}")
-                    return False
-                    
-            self.log_message("版本命令收到ACK")
-            
-            # 讀取版本號
-            version = self.serial_port.read(1)
-            if len(version) == 1:
-                # 修正這裡：正確定義 version_str
-                version_num = version[0]
-                version_str = f"v{version_num/16:.1f}"  # 這裡定義 version_str
-                self.log_message(f"Bootloader版本: {version_str}")
-                self.version_var.set(version_str)  # 設置版本顯示
-                
-                # 等待最終ACK
-                final_ack = self.serial_port.read(1)
-                if len(final_ack) == 1 and final_ack[0] == 0x79:
-                    self.log_message("版本讀取完成")
-                    return True
-                else:
-                    self.log_message(f"最終ACK失敗: {final_ack.hex() if final_ack else 'None'}")
-                    return False
-            else:
-                self.log_message("版本號讀取失敗")
-                return False
-                
-        except Exception as e:
-            self.log_message(f"獲取版本錯誤: {str(e)}")
-            return False
-
-
-    def get_custom_chip_id(self):
-        """獲取自定義Bootloader芯片ID (增強版)"""
-        try:
-            # 清空緩衝區
-            self.serial_port.reset_input_buffer()
-            
-            # 發送GET_ID命令 (0x02)
-            self.serial_port.write(bytes([0x02]))
-            self.log_message("發送GET_ID命令: 0x02")
-            
-            # 等待ACK (增加重試機制)
-            for retry in range(3):
-                response = self.serial_port.read(1)
-                if len(response) == 1 and response[0] == 0x79:
-                    break
-                elif retry < 2:
-                    self.log_message(f"重試獲取芯片ID {retry + 1}/3")
-                    time.sleep(0.1)
-                    self.serial_port.write(bytes([0x02]))
-                else:
-                    self.log_message(f"芯片ID命令ACK失敗: {response.hex() if response else 'None'}")
-                    return False
-                    
-            self.log_message("芯片ID命令收到ACK")
-            
-            # 讀取4字節芯片ID
-            chip_id_bytes = self.serial_port.read(4)
-            if len(chip_id_bytes) != 4:
-                self.log_message(f"芯片ID讀取失敗，只收到 {len(chip_id_bytes)} 字節")
-                return False
-                
-            # 組合芯片ID (大端序)
-            chip_id = (chip_id_bytes[0] << 24) | (chip_id_bytes[1] << 16) | \
-                    (chip_id_bytes[2] << 8) | chip_id_bytes[3]
-                    
-            self.log_message(f"芯片ID: 0x{chip_id:08X}")
-            
-            # 根據芯片ID顯示芯片型號
-            chip_name = self.get_chip_name(chip_id)
-            self.log_message(f"芯片型號: {chip_name}")
-            self.chip_id_var.set(f"0x{chip_id:08X} ({chip_name})")
-            
-            # 等待最終ACK
-            final_ack = self.serial_port.read(1)
-            if len(final_ack) == 1 and final_ack[0] == 0x79:
-                self.log_message("芯片ID讀取完成")
-                return True
-            else:
-                self.log_message(f"最終ACK失敗: {final_ack.hex() if final_ack else 'None'}")
-                return False
-                
-        except Exception as e:
-            self.log_message(f"獲取芯片ID錯誤: {str(e)}")
-            return False
-
-    def get_chip_name(self, chip_id):
-        """根據芯片ID返回芯片名稱"""
-        chip_dict = {
-            0x0413: "STM32F405/407/415/417",
-            0x0419: "STM32F42x/43x", 
-            0x0431: "STM32F411",
-            0x0441: "STM32F412",
-            0x0463: "STM32F413/423",
-            0x0434: "STM32F469/479",
-            0x0421: "STM32F446",
-            0x0423: "STM32F401xB/C",
-            0x0433: "STM32F401xD/E",
-            # 添加更多芯片ID
-        }
-        
-        return chip_dict.get(chip_id, f"未知芯片")
-
-
-    def check_bootloader_alive(self):
-        """檢查Bootloader是否還活著"""
-        try:
-            if not self.connected or not self.serial_port:
-                return False
-                
-            # 發送簡單的版本查詢命令來檢查連接
-            self.serial_port.reset_input_buffer()
-            self.serial_port.write(bytes([0x01]))  # GET_VERSION
-            
-            # 等待ACK，超時時間短一些
-            response = self.serial_port.read(1)
-            if len(response) == 1 and response[0] == 0x79:
-                # 讀取版本號並丟棄
-                self.serial_port.read(1)
-                # 讀取最終ACK並丟棄
-                self.serial_port.read(1)
-                return True
-            else:
-                return False
-                
-        except Exception:
-            return False
         
-    def reconnect_bootloader(self):
-        """重新連接Bootloader (增強版)"""
-        try:
-            self.log_message("嘗試重新連接Bootloader...")
-            
-            # 關閉現有連接
-            if self.serial_port and self.serial_port.is_open:
-                self.serial_port.close()
-                self.log_message("已關閉現有連接")
-                
-            time.sleep(0.5)
-            
-            # 獲取實際的COM口名稱
-            selected_display = self.port_combo.get()
-            self.log_message(f"選中的顯示文本: {selected_display}")
-            
-            # 提取實際的COM口名稱
-            port = None
-            
-            # 方法1：從映射中獲取
-            if hasattr(self, 'port_mapping') and selected_display in self.port_mapping:
-                port = self.port_mapping[selected_display]
-                self.log_message(f"從映射獲取串口: {port}")
-            else:
-                # 方法2：解析顯示文本
-                import re
-                # 使用正則表達式匹配COM口
-                com_match = re.match(r'(COM\d+)', selected_display)
-                if com_match:
-                    port = com_match.group(1)
-                    self.log_message(f"從文本解析串口: {port}")
-                else:
-                    # 方法3：手動分割
-                    if ' - ' in selected_display:
-                        port = selected_display.split(' - ')[0].strip()
-                    elif '(' in selected_display:
-                        port = selected_display.split('(')[0].strip()
-                    else:
-                        port = selected_display.strip()
-                    self.log_message(f"手動分割獲取串口: {port}")
-            
-            if not port:
-                raise Exception("無法解析串口名稱")
-                
-            # 驗證串口名稱格式
-            if not port.startswith('COM'):
-                raise Exception(f"無效的串口名稱: {port}")
-                
-            self.log_message(f"準備連接串口: {port}")
+    def write_flash(self):
+        """寫入Flash"""
+        if not self.ensure_connected():
+            return
             
-            baud = int(self.baud_combo.get())
-            self.serial_port = serial.Serial(port, baud, timeout=1)
+        # 在主線程讀取表單
+        file_path = self.file_path_var.get()
+        if not file_path:
+            messagebox.showerror("錯誤", "請選擇要寫入的文件")
+            return
             
-            self.log_message(f"串口已開啟: {port} @ {baud}")
+        try:
+            address = self.parse_address()
+        except ValueError:
+            messagebox.showerror("錯誤", "地址格式錯誤")
+            return
+            
+        window = self.get_write_window()
+        delta = None
+        if self.delta_var.get():
+            delta = "cache" if self.delta_source_var.get() == "快取" else "readback"
+        verify = self.verify_var.get()
+        compress = self.compress_var.get()
+        resume = self.resume_var.get()
+        ui_log = self.ui_log_var.get()
             
-            # 測試連接
-            if self.check_bootloader_alive():
-                self.log_message("重新連接成功")
-                return True
-            else:
-                self.log_message("Bootloader 測試失敗")
-                return False
-                
-        except Exception as e:
-            self.log_message(f"重新連接錯誤: {str(e)}")
-            return False
-                
-    def write_flash(self):
-        """寫入Flash"""
         def write_thread():
             try:
-                file_path = self.file_path_var.get()
-                if not file_path:
-                    messagebox.showerror("錯誤", "請選擇要寫入的文件")
-                    return
-                    
-                address_str = self.address_var.get()
-                try:
-                    address = int(address_str, 16) if address_str.startswith('0x') else int(address_str)
-                except ValueError:
-                    messagebox.showerror("錯誤", "地址格式錯誤")
-                    return
-                    
-                # 讀取文件
-                with open(file_path, 'rb') as f:
-                    data = f.read()
-                    
-                self.log_message(f"開始寫入 {len(data)} 字節到地址 0x{address:08X}")
-                
-                # 分塊寫入 (每次最多256字節)
-                chunk_size = 256
-                total_chunks = (len(data) + chunk_size - 1) // chunk_size
-                
-                for i in range(total_chunks):
-                    start_idx = i * chunk_size
-                    end_idx = min(start_idx + chunk_size, len(data))
-                    chunk = data[start_idx:end_idx]
-                    chunk_addr = address + start_idx
-                    
-                    if self.write_memory_chunk(chunk_addr, chunk):
-                        progress = (i + 1) * 100 // total_chunks
-                        self.progress['value'] = progress
-                        self.log_message(f"寫入進度: {progress}% ({i+1}/{total_chunks})")
-                    else:
-                        self.log_message(f"寫入失敗在地址 0x{chunk_addr:08X}")
-                        return
-                        
-                self.log_message("Flash寫入完成")
+                # 讀取文件 (HEX/S-record/ELF 使用文件內的地址)
+                segments = load_image(file_path, address)
+                ok = self.timed_transfer(lambda: self.client.write_segments(
+                    segments, window=window, delta=delta, compress=compress, resume=resume),
+                    (file_path, window, compress, delta), ui_log)
+                if ok and verify:
+                    # Bootloader支援時比對CRC，否則管線回讀比對；第一個不一致的地址即停止
+                    self.client.verify_segments(segments, window=window or 4)
                 
             except Exception as e:
                 self.log_message(f"寫入錯誤: {str(e)}")
                 
         threading.Thread(target=write_thread, daemon=True).start()
+        
+    def timed_transfer(self, transfer, key, ui_log):
+        """執行傳輸並記錄耗時；ui_log 為False時傳輸期間的日誌暫存，結束後一次輸出
 
-    def write_memory_chunk(self, address, data):
-        """寫入單個記憶體塊"""
+        同一文件與設定在日誌開、關時各傳輸過一次後，輸出兩者的耗時比較。
+        """
+        thread_id = threading.get_ident()
+        if not ui_log:
+            self.held_logs[thread_id] = []  # 只暫存本線程的日誌，其他工作線程照常輸出
+        start = time.perf_counter()
         try:
-            # 發送寫入命令
-            if not self.send_command(0x31):  # CMD_WRITE_MEMORY
-                return False
-                
-            # 發送地址
-            addr_bytes = struct.pack('>I', address)  # 大端序
-            addr_checksum = 0
-            for b in addr_bytes:
-                addr_checksum ^= b
-                
-            self.serial_port.write(addr_bytes + bytes([addr_checksum]))
+            ok = transfer()
+        finally:
+            elapsed = time.perf_counter() - start
+            held = self.held_logs.pop(thread_id, None)
+            if held:
+                self.ui_queue.put("".join(held))
+
+        if not ok:
+            return ok
+        self.transfer_times[key + (ui_log,)] = elapsed
+        self.log_message(f"傳輸耗時 {elapsed:.2f}s (介面日誌: {'開' if ui_log else '關'})")
+        on, off = self.transfer_times.get(key + (True,)), self.transfer_times.get(key + (False,))
+        if on is not None and off is not None:
+            self.log_message(f"介面日誌 開 {on:.2f}s / 關 {off:.2f}s (日誌使傳輸時間增加 {(on - off) * 100 / off:.1f}%)")
+        return ok
+
+    def gang_flash(self):
+        """在所有符合VID:PID的串口上並行執行 擦除/寫入/驗證/跳轉"""
+        # 在主線程讀取表單
+        file_path = self.file_path_var.get()
+        if not file_path:
+            messagebox.showerror("錯誤", "請選擇要寫入的文件")
+            return
             
-            # 等待ACK
-            response = self.serial_port.read(1)
-            if len(response) == 0 or response[0] != 0x79:
-                return False
-                
-            # 發送數據長度和數據
-            length = len(data) - 1  # N = 數據字節數 - 1
-            data_to_send = bytes([length]) + data
-            
-            # 計算校驗和
-            checksum = 0
-            for b in data_to_send:
-                checksum ^= b
-                
-            self.serial_port.write(data_to_send + bytes([checksum]))
+        try:
+            address = self.parse_address()
+            ports = find_ports(self.gang_filter_var.get().strip() or None)
+            baud = int(self.baud_combo.get())
+        except ValueError:
+            messagebox.showerror("錯誤", "地址、波特率或VID:PID格式錯誤")
+            return
             
-            # 等待最終ACK
-            response = self.serial_port.read(1)
-            return len(response) == 1 and response[0] == 0x79
+        # 已由本程序打開的串口不參與批量燒錄
+        if self.client.connected:
+            ports = [port for port in ports if port != self.client.port]
             
-        except Exception as e:
-            self.log_message(f"寫入塊錯誤: {str(e)}")
-            return False
-        
-    def read_memory(self, address, length):
-        """讀取記憶體 - 可重用的函數"""
-        try:
-            max_read_size = 256  # STM32 bootloader最大一次讀取256字節
-            all_data = bytearray()
-            remaining = length
-            current_addr = address
-            
-            while remaining > 0:
-                # 計算本次讀取大小
-                read_size = min(remaining, max_read_size)
-                
-                # 發送讀取命令
-                if not self.send_command(0x11):  # CMD_READ_MEMORY
-                    raise Exception(f"讀取命令失敗 @ 0x{current_addr:08X}")
-                    
-                # 發送地址
-                addr_bytes = struct.pack('>I', current_addr)
-                addr_checksum = 0
-                for b in addr_bytes:
-                    addr_checksum ^= b
-                    
-                self.serial_port.write(addr_bytes + bytes([addr_checksum]))
-                
-                # 等待ACK
-                ack = self.serial_port.read(1)
-                if len(ack) == 0 or ack[0] != 0x79:
-                    raise Exception(f"地址ACK失敗 @ 0x{current_addr:08X}")
-                    
-                # 發送長度 (N-1格式)
-                length_byte = read_size - 1
-                checksum = 0xFF ^ length_byte
-                self.serial_port.write(bytes([length_byte, checksum]))
-                
-                # 等待ACK
-                ack = self.serial_port.read(1)
-                if len(ack) == 0 or ack[0] != 0x79:
-                    raise Exception(f"長度ACK失敗 @ 0x{current_addr:08X}")
-                    
-                # 讀取數據
-                data = self.serial_port.read(read_size)
-                if len(data) != read_size:
-                    raise Exception(f"數據讀取不完整 @ 0x{current_addr:08X}")
+        window = self.get_write_window()
+        blank_check = self.blank_check_var.get()
+        compress = self.compress_var.get()
+            
+        def gang_thread():
+            try:
+                segments = load_image(file_path, address)
+                run_gang(ports, baud, segments, window=window,
+                         blank_check=blank_check, log=self.log_message, compress=compress)
                 
-                all_data.extend(data)
-                current_addr += read_size
-                remaining -= read_size
+            except Exception as e:
+                self.log_message(f"批量燒錄錯誤: {str(e)}")
                 
-            return all_data
-            
+        threading.Thread(target=gang_thread, daemon=True).start()
+        
+    def run_recipe(self):
+        """選擇配方文件，在目前的連接上執行其中所有映像的擦除/寫入/驗證/跳轉"""
+        if not self.ensure_connected():
+            return
+
+        path = filedialog.askopenfilename(
+            title="選擇燒錄配方",
+            filetypes=[("Recipe files", "*.json"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            plan = load_recipe(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("錯誤", f"配方錯誤: {str(e)}")
+            return
+
+        def recipe_thread():
+            try:
+                for line in plan.describe():
+                    self.log_message(line)
+                run_plan(self.client, plan)
+            except Exception as e:
+                self.log_message(f"執行配方錯誤: {str(e)}")
+
+        threading.Thread(target=recipe_thread, daemon=True).start()
+
+    def toggle_auto_flash(self):
+        """開啟時以目前的文件與選項建立自動燒錄任務，之後插入符合VID:PID的設備即執行"""
+        if not self.auto_flash_var.get():
+            self.auto_flasher = None
+            self.log_message("已停止插入即燒錄")
+            return
+            
+        file_path = self.file_path_var.get()
+        try:
+            if not file_path:
+                raise ValueError("請選擇要寫入的文件")
+            segments = load_image(file_path, self.parse_address())
+            matcher = PortMatcher(self.gang_filter_var.get().strip() or None)
+            baud = int(self.baud_combo.get())
         except Exception as e:
-            self.log_message(f"讀取錯誤: {str(e)}")
-            return None
+            self.auto_flash_var.set(False)
+            messagebox.showerror("錯誤", f"無法開始插入即燒錄: {str(e)}")
+            return
+            
+        steps = ["erase", "write"] + (["verify"] if self.verify_var.get() else []) + ["go"]
+        self.auto_flasher = AutoFlasher(segments, matcher, baud, steps, log=self.log_message,
+                                        window=self.get_write_window(),
+                                        blank_check=self.blank_check_var.get(),
+                                        compress=self.compress_var.get())
+        self.log_message(f"插入即燒錄: {os.path.basename(file_path)} (步驟: {', '.join(steps)})，請插入設備")
+        
+    def log_hex_dump(self, address, data):
+        """將數據轉換為更易讀的格式：每個字節後面加逗號和空格，每16個字節換行"""
+        bytes_per_line = 16
+        
+        for i in range(0, len(data), bytes_per_line):
+            chunk = data[i:i+bytes_per_line]
+            line = ", ".join([f"{b:02X}" for b in chunk])
+            self.log_message(f"0x{address + i:08X}: {line}")
             
     def read_flash(self):
         """讀取Flash"""
+        if not self.ensure_connected():
+            return
+            
         try:
             # 獲取地址
-            address_str = self.address_var.get()
-            address = int(address_str, 16) if address_str.startswith('0x') else int(address_str)
+            address = self.parse_address()
+        except ValueError:
+            messagebox.showerror("錯誤", "地址格式錯誤")
+            return
             
-            # 獲取長度
-            length_str = self.length_var.get()
+        # 獲取長度
+        length_str = self.length_var.get()
+        try:
+            length = int(length_str, 16) if length_str.startswith('0x') else int(length_str)
+            # 確保長度不超過STM32 bootloader的限制
+            if length > 256:
+                self.log_message(f"警告: 長度 {length} 超過單次讀取限制，將分多次讀取")
+        except ValueError:
+            self.log_message(f"長度格式錯誤: {length_str}，使用預設值0x100")
+            length = 0x100
+            
+        def read_thread():
             try:
-                length = int(length_str, 16) if length_str.startswith('0x') else int(length_str)
-                # 確保長度不超過STM32 bootloader的限制
+                self.log_message(f"開始從地址 0x{address:08X} 讀取 {length} 字節...")
+                
+                # 如果長度超過256，使用read_memory函數分段讀取
                 if length > 256:
-                    self.log_message(f"警告: 長度 {length} 超過單次讀取限制，將分多次讀取")
-            except ValueError:
-                self.log_message(f"長度格式錯誤: {length_str}，使用預設值0x100")
-                length = 0x100
-            
-            self.log_message(f"開始從地址 0x{address:08X} 讀取 {length} 字節...")
-            
-            # 如果長度超過256，使用read_memory函數分段讀取
-            if length > 256:
-                data = self.read_memory(address, length)
-                if data:
-                    # 將數據轉換為更易讀的格式並顯示
-                    bytes_per_line = 16
-                    
-                    for i in range(0, len(data), bytes_per_line):
-                        chunk = data[i:i+bytes_per_line]
-                        line = ", ".join([f"{b:02X}" for b in chunk])
-                        self.log_message(f"0x{address + i*bytes_per_line:08X}: {line}")
-                        
-                    self.log_message(f"讀取完成，共 {len(data)} 字節")
-                else:
-                    self.log_message("讀取失敗")
-            else:
-                # 對於小於256字節的數據，使用單次讀取
-                if self.read_memory_chunk(address, length - 1):  # STM32 bootloader使用N-1格式
-                    self.log_message(f"從地址 0x{address:08X} 讀取 {length} 字節完成")
+                    data = self.client.read_memory(address, length)
+                    if data:
+                        self.log_hex_dump(address, data)
+                        self.log_message(f"讀取完成，共 {len(data)} 字節")
+                    else:
+                        self.log_message("讀取失敗")
                 else:
-                    self.log_message("讀取失敗")
+                    # 對於小於256字節的數據，使用單次讀取
+                    data = self.client.read_memory_chunk(address, length - 1)  # STM32 bootloader使用N-1格式
+                    if data:
+                        self.log_hex_dump(address, data)
+                        self.log_message(f"從地址 0x{address:08X} 讀取 {length} 字節完成")
+                    else:
+                        self.log_message("讀取失敗")
+                    
+            except Exception as e:
+                self.log_message(f"讀取錯誤: {str(e)}")
                 
-        except Exception as e:
-            self.log_message(f"讀取錯誤: {str(e)}")
+        threading.Thread(target=read_thread, daemon=True).start()
 
-    def read_memory_chunk(self, address, length):
-        """讀取單個記憶體塊"""
+    def dump_flash(self):
+        """將地址/長度指定的範圍邊讀邊寫入文件"""
+        if not self.ensure_connected():
+            return
+            
         try:
-            # 發送讀取命令
-            if not self.send_command(0x11):  # CMD_READ_MEMORY
-                return False
-                
-            # 發送地址
-            addr_bytes = struct.pack('>I', address)  # 大端序
-            addr_checksum = 0
-            for b in addr_bytes:
-                addr_checksum ^= b
-                
-            self.serial_port.write(addr_bytes + bytes([addr_checksum]))
+            address = self.parse_address()
+            length_str = self.length_var.get()
+            length = int(length_str, 16) if length_str.startswith('0x') else int(length_str)
+        except ValueError:
+            messagebox.showerror("錯誤", "地址或長度格式錯誤")
+            return
+            
+        path = filedialog.asksaveasfilename(
+            title="轉存記憶體",
+            defaultextension=".bin",
+            filetypes=[("Binary files", "*.bin"), ("Hex files", "*.hex"), ("S-record files", "*.srec"), ("All files", "*.*")]
+        )
+        if not path:
+            return
             
-            # 等待ACK
-            response = self.serial_port.read(1)
-            if len(response) == 0 or response[0] != 0x79:
-                return False
-                
-            # 發送長度
-            length_checksum = 0xFF ^ length
-            self.serial_port.write(bytes([length, length_checksum]))
-            
-            # 等待ACK
-            response = self.serial_port.read(1)
-            if len(response) == 0 or response[0] != 0x79:
-                return False
-                
-            # 讀取數據
-            data = self.serial_port.read(length + 1)
-            if len(data) == length + 1:
-                # 將數據轉換為更易讀的格式：每個字節後面加逗號和空格，每16個字節換行
-                bytes_per_line = 16
-                
-                for i in range(0, len(data), bytes_per_line):
-                    chunk = data[i:i+bytes_per_line]
-                    line = ", ".join([f"{b:02X}" for b in chunk])
-                    self.log_message(f"0x{address + i*bytes_per_line:08X}: {line}")
-                    
-                return True
-            else:
-                return False
+        def dump_thread():
+            if self.client.dump_memory(address, length, path) and path.lower().endswith('.bin'):
+                self.run_in_ui(self.open_hex_viewer, path)
                 
+        threading.Thread(target=dump_thread, daemon=True).start()
+        
+    def export_metrics(self):
+        """保存本次連接的命令統計 (.json 或 Prometheus文字格式 .prom)"""
+        path = filedialog.asksaveasfilename(
+            title="匯出命令統計",
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("Prometheus text", "*.prom"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+            
+        try:
+            save_metrics(self.client.metrics, path)
+            self.log_message(f"命令統計: {self.client.metrics.summary()}")
+            self.log_message(f"已匯出命令統計到 {path}")
         except Exception as e:
-            self.log_message(f"讀取塊錯誤: {str(e)}")
-            return False
-
-    # APP起始地址
-    APP_START_ADDRESS = 0x08008000
+            self.log_message(f"匯出統計錯誤: {str(e)}")
+            
+    def open_hex_viewer(self, path=None):
+        """以十六進位檢視器打開二進位轉存文件 (基地址取自地址欄位)"""
+        if path is None:
+            path = filedialog.askopenfilename(
+                title="選擇轉存文件",
+                filetypes=[("Binary files", "*.bin"), ("All files", "*.*")]
+            )
+            if not path:
+                return
                 
+        try:
+            base_address = self.parse_address()
+        except ValueError:
+            base_address = 0
+            
+        try:
+            HexViewer(self.root, path, base_address)
+        except OSError as e:
+            messagebox.showerror("錯誤", f"無法打開文件: {str(e)}")
+            
     def jump_to_app(self):
         """跳轉到應用程序"""
-        try:
-            self.log_message("正在跳轉到APP...")
+        if not self.ensure_connected():
+            return
+            
+        def jump_thread():
+            if self.client.jump_to_app(APP_START_ADDRESS):
+                self.log_message("請檢查串口輸出是否有APP啟動訊息...")
+                
+        threading.Thread(target=jump_thread, daemon=True).start()
 
-            # 發送Go命令
-            if not self.send_command(0x21):  # CMD_GO
-                self.log_message("發送Go命令失敗")
-                return
+class LogHarness(BootloaderGUI):
+    """只有進度條與狀態訊息框的最小介面，供 bootloader_bench.py --ui 量測兩種日誌路徑
 
-            # 發送APP起始地址 (大端序)
-            addr_bytes = [
-                (self.APP_START_ADDRESS >> 24) & 0xFF,
-                (self.APP_START_ADDRESS >> 16) & 0xFF,
-                (self.APP_START_ADDRESS >> 8) & 0xFF,
-                self.APP_START_ADDRESS & 0xFF
-            ]
+    log_message / set_progress / process_ui_queue 與主介面相同 (佇列，由主線程定時刷新)；
+    sync_log / sync_progress 是改用佇列之前的做法: 每條日誌直接插入並調用 root.update()。
+    """
 
-            # 計算校驗和
-            checksum = 0
-            for byte in addr_bytes:
-                checksum ^= byte
+    def __init__(self, root):
+        self.root = root
+        self.ui_queue = queue.Queue()
+        self.pending_progress = None
+        self.held_logs = {}
+        self.progress = ttk.Progressbar(root, mode='determinate')
+        self.progress.pack(fill=tk.X, padx=10, pady=5)
+        self.status_text = scrolledtext.ScrolledText(root, height=15, width=80)
+        self.status_text.pack(fill=tk.BOTH, expand=True)
 
-            # 發送地址和校驗和
-            self.serial_port.write(bytes(addr_bytes + [checksum]))
+    def sync_log(self, message):
+        """舊版日誌: 插入、捲動並 root.update() (只能在主線程調用)"""
+        timestamp = time.strftime("%H:%M:%S")
+        self.status_text.insert(tk.END, f"[{timestamp}] {message}\n")
+        self.status_text.see(tk.END)
+        self.root.update()
 
-            self.log_message("跳轉命令發送成功！")
-            self.log_message("請檢查串口輸出是否有APP啟動訊息...")
+    def sync_progress(self, value):
+        self.progress['value'] = value
 
-        except Exception as e:
-            self.log_message(f"跳轉失敗: {str(e)}")
 
 if __name__ == "__main__":
     root = tk.Tk()
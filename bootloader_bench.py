@@ -0,0 +1,337 @@
+"""傳輸性能基準測試：量測擦除/寫入/讀取/驗證的吞吐量與延遲分位數
+
+預設連接進程內模擬器 (見 bootloader_sim.py)，也可指定實際串口。
+延遲樣本: 擦除為每個扇區，停等寫入為每個幀，讀取為每個256字節請求，
+驗證 (回讀比對) 為管線讀取中相鄰兩塊的到達間隔，verify/crc 為每個CRC命令的往返時間
+(Bootloader不支援CRC命令時沒有這一行)；管線寫入只統計吞吐量。
+--encode 只執行幀編碼的微基準測試 (每秒編碼的幀數)，不需要串口。
+--ui 比較Tk介面的兩種日誌路徑下同一寫入的耗時 (需要圖形環境): 舊版每條日誌 root.update()，
+與目前的佇列 + 主線程定時刷新。
+
+用法示例:
+    python bootloader_bench.py
+    python bootloader_bench.py --size 0x10000 --windows 0,4,8 --runs 3
+    python bootloader_bench.py -p "sim://bench?byte_time=0.00001&erase_time=0.05"
+    python bootloader_bench.py -p /dev/ttyUSB0 --json result.json
+    python bootloader_bench.py -p /dev/ttyUSB0 --trace bench.trace
+    python bootloader_bench.py --encode
+    python bootloader_bench.py --ui --size 0x20000
+"""
+import argparse
+import json
+import random
+import struct
+import sys
+import threading
+import time
+
+from bootloader_client import BootloaderClient, APP_START_ADDRESS, FLASH_SECTORS, CMD_CRC
+from bootloader_frames import FrameEncoder, prepare_frame
+from bootloader_metrics import percentile, format_table
+
+
+class BenchStats:
+    """累計一種操作的字節數、耗時與延遲樣本"""
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.latencies = []
+
+    def add(self, nbytes, elapsed):
+        self.bytes += nbytes
+        self.elapsed += elapsed
+
+    def summary(self):
+        result = {
+            "name": self.name,
+            "bytes": self.bytes,
+            "elapsed": round(self.elapsed, 6),
+            "bytes_per_s": round(self.bytes / self.elapsed) if self.elapsed else None,
+            "samples": len(self.latencies),
+        }
+        for pct in (50, 90, 99, 100):
+            key = "max_ms" if pct == 100 else f"p{pct}_ms"
+            result[key] = round(percentile(self.latencies, pct) * 1000, 3) if self.latencies else None
+        return result
+
+
+def instrument(client, samples):
+    """以實例屬性包裝客戶端方法，記錄每個幀/塊的延遲到 samples[方法名]"""
+    write_frame = client.write_frame
+    iter_read_memory = client.iter_read_memory
+    iter_read_pipelined = client.iter_read_pipelined
+    crc_memory = client.crc_memory
+
+    def timed_write(frame):
+        start = time.perf_counter()
+        ok = write_frame(frame)
+        samples["write"].append(time.perf_counter() - start)
+        return ok
+
+    def timed_crc(address, length):
+        start = time.perf_counter()
+        crc = crc_memory(address, length)
+        samples["verify/crc"].append(time.perf_counter() - start)
+        return crc
+
+    def timed_iter(name, generator):
+        last = time.perf_counter()
+        for item in generator:
+            now = time.perf_counter()
+            samples[name].append(now - last)
+            yield item
+            last = time.perf_counter()
+
+    client.write_frame = timed_write
+    client.iter_read_memory = lambda *args: timed_iter("read", iter_read_memory(*args))
+    client.iter_read_pipelined = lambda *args: timed_iter("verify", iter_read_pipelined(*args))
+    client.crc_memory = timed_crc
+
+
+def run_bench(client, address, size, windows=(0, 4), runs=1, read_window=4, seed=0):
+    """執行基準測試，返回各操作的統計摘要列表 (失敗返回None)"""
+    data = bytes(random.Random(seed).getrandbits(8) for _ in range(size))
+    sectors = client.get_sectors_for_range(address, size)
+    samples = {"write": [], "read": [], "verify": [], "verify/crc": []}
+    instrument(client, samples)
+
+    stats = {"erase": BenchStats("erase")}
+    for window in windows:
+        name = "write" if window == 0 else f"write/w{window}"
+        stats[name] = BenchStats(name)
+    stats["read"] = BenchStats("read")
+    stats["verify"] = BenchStats("verify")
+    stats["verify/crc"] = BenchStats("verify/crc")
+
+    for _ in range(runs):
+        for window in windows:
+            for sector in sectors:
+                start = time.perf_counter()
+                if not client.erase_sectors([sector]):
+                    return None
+                elapsed = time.perf_counter() - start
+                stats["erase"].add(FLASH_SECTORS[sector][1], elapsed)
+                stats["erase"].latencies.append(elapsed)
+
+            write_stats = stats["write" if window == 0 else f"write/w{window}"]
+            samples["write"].clear()
+            start = time.perf_counter()
+            if not client.write_image(address, data, window=window):
+                return None
+            write_stats.add(size, time.perf_counter() - start)
+            write_stats.latencies += samples["write"]
+
+            samples["verify"].clear()
+            start = time.perf_counter()
+            if not client.verify_segments([(address, data)], read_window, readback=True):
+                return None
+            stats["verify"].add(size, time.perf_counter() - start)
+            stats["verify"].latencies += samples["verify"]
+
+            if client.session.supports(CMD_CRC) is not False:
+                samples["verify/crc"].clear()
+                start = time.perf_counter()
+                result = client.verify_crc([(address, data)], read_window)
+                if result is False:
+                    return None
+                if result:
+                    stats["verify/crc"].add(size, time.perf_counter() - start)
+                    stats["verify/crc"].latencies += samples["verify/crc"]
+
+        start = time.perf_counter()
+        if client.read_memory(address, size) is None:
+            return None
+        stats["read"].add(size, time.perf_counter() - start)
+
+    stats["read"].latencies = samples["read"]
+    if not stats["verify/crc"].bytes:
+        del stats["verify/crc"]
+    return [s.summary() for s in stats.values()]
+
+
+def run_ui_bench(client, address, size, window=0, seed=0):
+    """以同一寫入比較Tk介面的日誌路徑，返回各路徑的統計摘要列表 (失敗返回None)
+
+    sync: 寫入在主線程執行，每條日誌插入後 root.update() (改用佇列之前的做法)；
+    queue: 寫入在工作線程執行，日誌放入佇列，主線程每 UI_REFRESH_MS 刷新一次。
+    耗時只計寫入 (不含擦除)，lines 為寫入期間輸出的日誌行數。
+    """
+    import tkinter as tk  # 只在量測介面時載入
+    from bootloader_0 import LogHarness, UI_REFRESH_MS
+
+    data = bytes(random.Random(seed).getrandbits(8) for _ in range(size))
+    root = tk.Tk()
+    root.title("bootloader_bench --ui")
+    harness = LogHarness(root)
+    lines = [0]
+
+    def counted(log):
+        def log_line(message):
+            lines[0] += 1
+            log(message)
+        return log_line
+
+    saved = client.log, client.progress
+    results = []
+    try:
+        for name, log, progress in (("ui/sync", harness.sync_log, harness.sync_progress),
+                                    ("ui/queue", harness.log_message, harness.set_progress)):
+            client.log, client.progress = harness.log_message, harness.set_progress
+            if not client.erase_range(address, size, blank_check=False):
+                return None
+            client.log, client.progress = counted(log), progress
+            lines[0] = 0
+            outcome = {}
+
+            def write():
+                start = time.perf_counter()
+                outcome["ok"] = client.write_image(address, data, window=window)
+                outcome["elapsed"] = time.perf_counter() - start
+
+            if name == "ui/sync":
+                write()
+            else:
+                worker = threading.Thread(target=write, daemon=True)
+                worker.start()
+
+                def wait_worker():
+                    if worker.is_alive():
+                        root.after(UI_REFRESH_MS, wait_worker)
+                    else:
+                        root.quit()
+
+                harness.process_ui_queue()
+                wait_worker()
+                root.mainloop()
+            root.update()
+
+            if not outcome.get("ok"):
+                return None
+            stats = BenchStats(name)
+            stats.add(size, outcome["elapsed"])
+            result = stats.summary()
+            result["lines"] = lines[0]
+            results.append(result)
+    finally:
+        client.log, client.progress = saved
+        root.destroy()
+    return results
+
+
+def legacy_write_frame(address, data):
+    """逐字節計算校驗和並拼接的寫入幀 (編碼器之前的做法，作為對照)"""
+    addr_bytes = struct.pack('>I', address)
+    addr_checksum = 0
+    for b in addr_bytes:
+        addr_checksum ^= b
+    data_to_send = bytes([len(data) - 1]) + data
+    checksum = 0
+    for b in data_to_send:
+        checksum ^= b
+    return bytes([0x31]) + addr_bytes + bytes([addr_checksum]) + data_to_send + bytes([checksum])
+
+
+def run_encode_bench(count=20000, frame_size=256, seed=0):
+    """幀編碼微基準測試，返回各編碼方式每秒編碼的幀數"""
+    rng = random.Random(seed)
+    frames = [(APP_START_ADDRESS + i * frame_size, bytes(rng.getrandbits(8) for _ in range(frame_size)))
+              for i in range(64)]
+    prepared = [prepare_frame(address, data) for address, data in frames]
+    encoder = FrameEncoder()
+    sink = bytearray(frame_size + 2)  # 模擬串口寫出時的一次複製
+
+    def write_packets(address, data):
+        sink[:5] = encoder.address_packet(address)
+        sink[:frame_size + 2] = encoder.data_packet(data)
+
+    cases = [
+        ("legacy", lambda i: legacy_write_frame(*frames[i])),
+        ("encoder/write", lambda i: write_packets(*frames[i])),
+        ("encoder/cached", lambda i: encoder.write_frame(prepared[i])),
+        ("encoder/read", lambda i: encoder.read_request(frames[i][0], frame_size)),
+        ("prepare", lambda i: prepare_frame(*frames[i])),
+    ]
+    results = []
+    for name, encode in cases:
+        start = time.perf_counter()
+        for n in range(count):
+            encode(n & 63)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        results.append({"name": name, "frames": count, "elapsed": round(elapsed, 6),
+                        "frames_per_s": round(count / elapsed),
+                        "bytes_per_s": round(count * frame_size / elapsed)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="STM32 UART Bootloader 傳輸性能基準測試")
+    parser.add_argument('-p', '--port', default="sim://bench", help="串口名稱或模擬器URL (預設 sim://bench)")
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    parser.add_argument('--fast', action='store_true', help="連接後協商更高的波特率")
+    parser.add_argument('--address', type=lambda text: int(text, 0), default=APP_START_ADDRESS)
+    parser.add_argument('--size', type=lambda text: int(text, 0), default=0x4000, help="測試數據大小 (字節)")
+    parser.add_argument('--windows', default="0,4", help="逗號分隔的寫入窗口 (0 = 停等模式)")
+    parser.add_argument('--read-window', type=int, default=4, help="驗證時的管線讀取窗口")
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help="測試數據的隨機種子")
+    parser.add_argument('--json', help="另存結果為JSON文件")
+    parser.add_argument('--trace', help="把線路收發錄製到文件 (見 bootloader_trace.py)")
+    parser.add_argument('--encode', action='store_true', help="只執行幀編碼微基準測試")
+    parser.add_argument('--ui', action='store_true', help="比較Tk介面兩種日誌路徑下的寫入耗時 (需要圖形環境)")
+    parser.add_argument('--frames', type=int, default=20000, help="微基準測試編碼的幀數")
+    parser.add_argument('-v', '--verbose', action='store_true', help="顯示客戶端日誌")
+    args = parser.parse_args(argv)
+
+    if args.encode:
+        results = run_encode_bench(args.frames, seed=args.seed)
+        print(f"幀編碼 {args.frames} 幀 x 256 字節")
+        print(format_table(results, ("name", "frames", "frames_per_s", "bytes_per_s")))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({"frames": args.frames, "results": results}, f, indent=2)
+        return 0
+
+    windows = [int(w) for w in args.windows.split(',') if w.strip()]
+    client = BootloaderClient(log=None if args.verbose else (lambda message: None))
+
+    try:
+        client.connect(args.port, args.baud, trace=args.trace)
+    except Exception as e:
+        print(f"連接失敗: {e}", file=sys.stderr)
+        return 2
+
+    try:
+        if args.fast:
+            client.escalate_baud()
+        if not client.check_app_range(args.address, args.size):
+            return 1
+        if args.ui:
+            results = run_ui_bench(client, args.address, args.size, windows[0] if windows else 0, args.seed)
+        else:
+            results = run_bench(client, args.address, args.size, windows, args.runs, args.read_window, args.seed)
+        baud = client.baud
+        metrics = client.metrics.to_dict()
+    finally:
+        client.disconnect()
+
+    if results is None:
+        print("基準測試失敗 (使用 -v 查看詳細日誌)", file=sys.stderr)
+        return 1
+
+    if args.ui:
+        print(f"{args.port} @ {baud}, {args.size} 字節, 介面日誌路徑")
+        print(format_table(results, ("name", "bytes", "elapsed", "bytes_per_s", "lines")))
+    else:
+        print(f"{args.port} @ {baud}, {args.size} 字節 x {args.runs} 輪")
+        print(format_table(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"port": args.port, "baud": baud, "size": args.size, "runs": args.runs,
+                       "results": results, "metrics": metrics}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
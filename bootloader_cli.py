@@ -0,0 +1,186 @@
+"""STM32 UART Bootloader 命令列工具 (無GUI，供產線燒錄站使用)
+
+用法示例:
+    python bootloader_cli.py -p /dev/ttyUSB0 connect
+    python bootloader_cli.py -p COM3 erase --file app.bin
+    python bootloader_cli.py -p COM3 write app.bin --address 0x08008000 --window 4
+    python bootloader_cli.py -p COM3 write app.hex --delta readback --verify
+    python bootloader_cli.py -p COM3 write app.bin --compress
+    python bootloader_cli.py -p COM3 write app.hex --frame-cache
+    python bootloader_cli.py -p COM3 write app.hex --resume
+    python bootloader_cli.py -p COM3 verify app.bin
+    python bootloader_cli.py -p COM3 read --address 0x08008000 --length 0x400 -o dump.bin
+    python bootloader_cli.py -p COM3 go
+    python bootloader_cli.py -p COM3 recipe board.json
+    python bootloader_cli.py -p COM3 --metrics session.prom write app.bin --window 4
+    python bootloader_cli.py -p COM3 --trace session.trace write app.bin
+"""
+import argparse
+import sys
+
+from bootloader_client import BootloaderClient, APP_START_ADDRESS, FLASH_END, MAX_WRITE_WINDOW
+from bootloader_frames import FRAME_CACHE_DIR
+from bootloader_image import load_image
+from bootloader_metrics import save_metrics
+from bootloader_recipe import load_recipe, run_plan
+
+
+def parse_int(text):
+    """解析十進位或0x開頭的十六進位數字"""
+    return int(text, 0)
+
+
+def cmd_connect(client, args):
+    """握手並顯示Bootloader版本與芯片ID"""
+    return client.get_custom_version() is not None and client.get_custom_chip_id() is not None
+
+
+def cmd_id(client, args):
+    chip_id = client.get_custom_chip_id()
+    if chip_id is None:
+        return False
+    print(f"0x{chip_id:08X} ({client.get_chip_name(chip_id)})")
+    return True
+
+
+def cmd_erase(client, args):
+    blank_check = not args.no_blank_check
+    if args.file:
+        return client.erase_segments(load_image(args.file, args.address), blank_check)
+    if args.length is not None:
+        address, length = args.address, args.length
+    else:
+        # 沒有指定範圍：擦除整個應用程序區域
+        address, length = APP_START_ADDRESS, FLASH_END - APP_START_ADDRESS
+    return client.erase_range(address, length, blank_check)
+
+
+def cmd_write(client, args):
+    segments = load_image(args.file, args.address)
+    if args.frame_cache:
+        client.frame_cache.directory = FRAME_CACHE_DIR
+    if not client.write_segments(segments, window=args.window, delta=args.delta, compress=args.compress,
+                                 resume=args.resume):
+        return False
+    return not args.verify or client.verify_segments(segments, args.read_window, args.readback)
+
+
+def cmd_verify(client, args):
+    return client.verify_segments(load_image(args.file, args.address), args.read_window, args.readback)
+
+
+def cmd_read(client, args):
+    data = client.read_memory(args.address, args.length)
+    if data is None:
+        return False
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(data)
+        client.log_message(f"已保存 {len(data)} 字節到 {args.output}")
+    else:
+        for i in range(0, len(data), 16):
+            print(f"0x{args.address + i:08X}: {data[i:i + 16].hex(' ').upper()}")
+    return True
+
+
+def cmd_go(client, args):
+    return client.jump_to_app(args.address)
+
+
+def cmd_recipe(client, args):
+    """執行配方文件中的所有映像與步驟 (見 bootloader_recipe.py)"""
+    try:
+        plan = load_recipe(args.file)
+    except (OSError, ValueError) as e:
+        client.log_message(f"配方錯誤: {e}")
+        return False
+    for line in plan.describe():
+        client.log_message(line)
+    return run_plan(client, plan)["ok"]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="STM32 UART Bootloader 命令列工具")
+    parser.add_argument('-p', '--port', required=True, help="串口名稱 (例如 COM3 或 /dev/ttyUSB0)")
+    parser.add_argument('-b', '--baud', type=int, default=115200, help="波特率 (預設 115200)")
+    parser.add_argument('--fast', action='store_true', help="連接後協商更高的波特率")
+    parser.add_argument('--max-baud', type=int, help="協商的最高波特率")
+    parser.add_argument('--metrics', help="結束時保存命令統計 (.prom 為Prometheus格式，其他為JSON)")
+    parser.add_argument('--trace', help="把線路收發錄製到文件 (以 bootloader_trace.py 解碼或重放)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('connect', help="握手並讀取版本與芯片ID")
+    p.set_defaults(func=cmd_connect)
+
+    p = sub.add_parser('id', help="讀取芯片ID")
+    p.set_defaults(func=cmd_id)
+
+    p = sub.add_parser('erase', help="擦除文件或範圍涉及的扇區")
+    p.add_argument('--file', help="依文件內容決定擦除範圍")
+    p.add_argument('--address', type=parse_int, default=APP_START_ADDRESS)
+    p.add_argument('--length', type=parse_int)
+    p.add_argument('--no-blank-check', action='store_true', help="不跳過空白扇區")
+    p.set_defaults(func=cmd_erase)
+
+    p = sub.add_parser('write', help="寫入固件文件 (bin/hex/srec/elf)")
+    p.add_argument('file')
+    p.add_argument('--address', type=parse_int, default=APP_START_ADDRESS, help="二進位文件的載入地址")
+    p.add_argument('--window', type=int, default=0, choices=range(MAX_WRITE_WINDOW + 1), metavar="N",
+                   help=f"管線寫入窗口 (0 = 停等模式，最大 {MAX_WRITE_WINDOW})")
+    p.add_argument('--delta', choices=['readback', 'cache'], help="差異燒錄的比對來源")
+    p.add_argument('--compress', action='store_true', help="壓縮傳輸 (Bootloader不支援時自動回退)")
+    p.add_argument('--frame-cache', action='store_true', help=f"把組裝好的寫入幀快取到 {FRAME_CACHE_DIR}")
+    p.add_argument('--resume', action='store_true', help="從寫入日誌記錄的中斷位置續傳")
+    p.add_argument('--verify', action='store_true', help="寫入後驗證 (Bootloader支援時比對CRC，否則回讀比對)")
+    p.add_argument('--readback', action='store_true', help="驗證時一律回讀比對")
+    p.add_argument('--read-window', type=int, default=4, help="回讀驗證時的管線讀取窗口")
+    p.set_defaults(func=cmd_write)
+
+    p = sub.add_parser('verify', help="比對文件 (Bootloader支援時比對CRC，否則回讀比對)")
+    p.add_argument('file')
+    p.add_argument('--address', type=parse_int, default=APP_START_ADDRESS)
+    p.add_argument('--readback', action='store_true', help="一律回讀比對")
+    p.add_argument('--read-window', type=int, default=4, help="管線讀取窗口 (1 = 停等模式)")
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser('read', help="讀取記憶體")
+    p.add_argument('--address', type=parse_int, default=APP_START_ADDRESS)
+    p.add_argument('--length', type=parse_int, default=0x100)
+    p.add_argument('-o', '--output', help="保存到二進位文件 (預設以十六進位打印)")
+    p.set_defaults(func=cmd_read)
+
+    p = sub.add_parser('go', help="跳轉到應用程序")
+    p.add_argument('--address', type=parse_int, default=APP_START_ADDRESS)
+    p.set_defaults(func=cmd_go)
+
+    p = sub.add_parser('recipe', help="執行產線燒錄配方 (多個映像、擦除、驗證、跳轉)")
+    p.add_argument('file', help="配方文件 (JSON)")
+    p.set_defaults(func=cmd_recipe)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    client = BootloaderClient()
+
+    try:
+        client.connect(args.port, args.baud, trace=args.trace)
+    except Exception as e:
+        print(f"連接失敗: {e}", file=sys.stderr)
+        return 2
+
+    try:
+        if args.fast:
+            client.escalate_baud(args.max_baud)
+        ok = args.func(client, args)
+    finally:
+        if args.metrics:
+            client.log_message(f"命令統計: {client.metrics.summary()}")
+            save_metrics(client.metrics, args.metrics)
+        client.disconnect()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
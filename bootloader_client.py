@@ -0,0 +1,2084 @@
+"""STM32 UART Bootloader 協議引擎 (不依賴任何GUI模組)"""
+import serial
+import serial.tools.list_ports
+import time
+import struct
+import os
+import json
+import hashlib
+import math
+import threading
+
+from bootloader_codec import compress_block
+from bootloader_frames import FRAME_CACHE, FrameEncoder, image_key, stm32_crc32, xor_checksum
+from bootloader_image import open_writer, split_frames, join_frames
+from bootloader_metrics import SessionMetrics, MeteredSerial, RttEstimator, RTO_INITIAL, classify_response
+
+# STM32F411 Flash扇區佈局 (起始地址, 大小)
+FLASH_SECTORS = [
+    (0x08000000, 0x4000),   # 扇區0  16KB (Bootloader)
+    (0x08004000, 0x4000),   # 扇區1  16KB (Bootloader)
+    (0x08008000, 0x4000),   # 扇區2  16KB
+    (0x0800C000, 0x4000),   # 扇區3  16KB
+    (0x08010000, 0x10000),  # 扇區4  64KB
+    (0x08020000, 0x20000),  # 扇區5 128KB
+    (0x08040000, 0x20000),  # 扇區6 128KB
+    (0x08060000, 0x20000),  # 扇區7 128KB
+]
+APP_FIRST_SECTOR = 2  # 應用程序起始扇區 (扇區0-1為Bootloader)
+FLASH_END = FLASH_SECTORS[-1][0] + FLASH_SECTORS[-1][1]
+
+# APP起始地址
+APP_START_ADDRESS = FLASH_SECTORS[APP_FIRST_SECTOR][0]
+
+# 96位芯片唯一ID (每塊芯片不同，GET_ID 返回的只是型號ID)
+DEVICE_UID_ADDRESS = 0x1FFF7A10
+DEVICE_UID_LENGTH = 12
+
+# 差異燒錄快取文件 (記錄每塊板最後燒錄內容的扇區摘要，以芯片唯一ID區分)
+DELTA_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".f411_bootloader_delta.json")
+
+# 波特率記錄文件 (每個串口適配器VID:PID最佳的穩定波特率)
+BAUD_MEMORY_FILE = os.path.join(os.path.expanduser("~"), ".f411_bootloader_baud.json")
+
+# 擦除時間記錄文件 (每塊板各扇區實測的擦除時間)
+ERASE_TIMING_FILE = os.path.join(os.path.expanduser("~"), ".f411_bootloader_erase.json")
+
+# 沒有實測記錄時的預估擦除時間 (秒，依扇區大小)
+ERASE_TIME_DEFAULTS = {0x4000: 0.5, 0x10000: 1.1, 0x20000: 2.0}
+ERASE_TIME_ALPHA = 0.5          # 新測量值的權重 (指數移動平均)
+ERASE_PROGRESS_INTERVAL = 0.25  # 等待擦除ACK時更新進度的間隔 (秒)
+ERASE_BUDGET_FACTOR = 2.0       # 擦除超時 = 預估時間 x 此倍數 + ERASE_BUDGET_MARGIN
+ERASE_BUDGET_MARGIN = 1.0       # (秒)
+
+# 寫入日誌文件 (以 芯片鍵值:映像雜湊 記錄已確認寫入的位置，供中斷後續傳)
+JOURNAL_FILE = os.path.join(os.path.expanduser("~"), ".f411_bootloader_journal.json")
+JOURNAL_FLUSH_INTERVAL = 0.5   # 寫入期間保存日誌的最短間隔 (秒)
+JOURNAL_VERIFY_FRAMES = 4      # 續傳前回讀比對的已確認幀數
+JOURNAL_MAX_AGE = 7 * 24 * 3600  # 超過此時間的日誌記錄會被清除 (秒)
+JOURNAL_LOCK = threading.Lock()  # 批量燒錄的各線程共用同一組記錄文件 (日誌、差異快取、波特率、擦除時間)
+
+# 可協商的波特率 (由低到高)
+BAUD_RATES = [115200, 230400, 460800, 921600, 1000000, 1500000, 2000000]
+BAUD_ERROR_LIMIT = 3       # 提速後累計幾次鏈路錯誤就降速
+BAUD_REVERT_TIMEOUT = 0.5  # Bootloader在新波特率下等不到命令時自動回退的時間 (秒)
+
+# 區塊級錯誤恢復: NACK或回應不完整時重新同步後只重試失敗的區塊
+CHUNK_RETRIES = 3          # 每個區塊最多重試次數
+RETRY_BACKOFF = 0.002      # 第一次重試前的等待 (秒)，之後每次加倍
+RETRY_BACKOFF_MAX = 0.05
+RESYNC_FILL = 0x408        # 重新同步時送出的0xFF填充字節數 (大於最長的命令幀)
+
+# 管線寫入窗口上限: Bootloader在幀中途回應NACK時，該幀其餘的字節與之後在途的幀會被當作命令解析
+# (數據中的0x44/0x21可能被當作擦除/跳轉)，限制在途的字節數 (約 8 x 263 字節)
+MAX_WRITE_WINDOW = 8
+
+# 以此開頭的串口名稱連接到進程內的軟體模擬器 (見 bootloader_sim.py)
+SIM_URL_PREFIX = "sim://"
+
+ACK = 0x79
+CMD_SET_BAUD = 0xA0  # 自定義命令: 變更波特率
+
+# 自定義命令: 壓縮寫入 (見 bootloader_codec.py)
+# 0xA1 -> ACK, 4字節地址 + 校驗和 -> ACK,
+# 原始長度-1 (2字節) + 壓縮長度-1 (2字節) + 壓縮數據 + 校驗和 -> 解壓並編程後ACK
+# (表頭的任一長度超過 COMPRESSED_BLOCK_SIZE 時，Bootloader收到表頭即回應NACK，不再等待數據)
+CMD_WRITE_COMPRESSED = 0xA1
+COMPRESSED_BLOCK_SIZE = 1024  # Bootloader解壓緩衝區大小
+
+# 自定義命令: Flash區間CRC (以STM32硬體CRC單元計算，主機端見 stm32_crc32)
+# 0xA2 -> ACK, 4字節地址 + 校驗和 -> ACK, 4字節長度 (大端序) + 校驗和
+# -> 計算完成後 ACK + 4字節CRC (大端序) + 校驗和
+# 舊版Bootloader對命令回應NACK，驗證改用回讀比對
+CMD_CRC = 0xA2
+CRC_TIME_PER_BYTE = 5e-8  # 等待CRC結果時按區間長度另加的超時 (秒/字節，約20MB/s)
+CRC_MIN_REGION = 256      # CRC不符時二分縮小到此大小再回讀定位
+
+SESSION_IDLE_TIMEOUT = 5.0  # 超過此時間沒有成功的交易才重新確認Bootloader存活 (秒)
+
+# 自適應超時: 等待回應的超時 = 估計的回應時間 (見 RttEstimator) + 線路傳輸時間
+TIMEOUT_STEP = 0.01  # 超時向上取整到此粒度，避免每次交易都重新設定串口
+LINK_OPCODES = (0x01, 0x02, 0x11)  # 回應不含Flash操作的命令，用來估計鏈路延遲
+
+
+class DeviceSession:
+    """一次連接期間快取的設備身份 (芯片ID、版本、各命令是否支援) 與鏈路狀態"""
+
+    def __init__(self):
+        self.chip_id = None
+        self.version = None
+        self.uid = None        # 芯片唯一ID (讀取失敗時為空字節串)
+        self.extended_erase = None  # 是否支援擴展擦除格式 (None 表示尚未確認)
+        self.commands = {}     # 命令 -> 是否支援 (沒有記錄表示尚未確認)
+        self.last_ack = None   # 最後一次成功交易的時間 (perf_counter)
+        self.failed = False    # 最後一次交易是否失敗
+
+    def note_result(self, result):
+        if result == "ack":
+            self.last_ack = time.perf_counter()
+            self.failed = False
+        else:
+            self.failed = True
+
+    def is_fresh(self, idle_timeout=SESSION_IDLE_TIMEOUT):
+        """最近有成功的交易且之後沒有出錯，不需要額外的存活檢查"""
+        return (not self.failed and self.last_ack is not None
+                and time.perf_counter() - self.last_ack < idle_timeout)
+
+    def supports(self, command):
+        """返回 True/False，None 表示尚未確認"""
+        return self.commands.get(command)
+
+    def forget_identity(self):
+        """設備可能已更換或重啟時清除快取的身份"""
+        self.chip_id = None
+        self.version = None
+        self.uid = None
+        self.extended_erase = None
+        self.commands.clear()
+
+
+def open_port(port, baud, timeout=1):
+    """打開串口或進程內模擬器 (失敗時拋出 serial.SerialException)"""
+    if port.startswith(SIM_URL_PREFIX):
+        from bootloader_sim import open_simulator  # 只在使用模擬器時載入
+        return open_simulator(port, baud, timeout)
+    return serial.Serial(port, baud, timeout=timeout)
+
+
+def format_version(version):
+    return f"v{version / 16:.1f}"
+
+
+def save_state_file(path, data):
+    """寫入臨時文件後替換記錄文件，避免其他線程或進程讀到半個文件 (調用者需持有 JOURNAL_LOCK)"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class BootloaderClient:
+    """Bootloader客戶端：負責串口連接與所有協議命令
+
+    log 與 progress 為可選的回調函數，分別接收日誌字串與進度值 (0-100)。
+    """
+
+    def __init__(self, log=None, progress=None):
+        self.log = log
+        self.progress = progress
+
+        self.serial_port = None
+        self.connected = False
+        self.port = None
+        self.baud = None
+        self.base_baud = None  # 連接時的安全波特率
+        self.link_errors = 0   # 目前波特率下累計的鏈路錯誤
+        self.write_rates = {}  # 各寫入模式最近一次的速率 (字節/秒)
+        self.session = DeviceSession()  # 快取的設備身份與鏈路狀態
+        self.erased_sectors = set()  # 擦除後尚未寫入的扇區
+        self.callback_time = 0.0  # 累計花在日誌/進度回調上的時間 (秒)
+        self.metrics = SessionMetrics()  # 本次連接的命令統計
+        self.last_response = b''  # send_command 最後收到的回應
+        self.last_result = None   # 最後一次交易的結果 (ack/nack/timeout/error)
+        self.journal = None  # 寫入中的日誌狀態 {"key", "written_end", "saved_at"}
+        self.frame_cache = FRAME_CACHE   # 組裝好的寫入幀快取 (進程內共用)
+        self.encoder = FrameEncoder()    # 命令幀在預先分配的緩衝區中組裝
+        self.link_rtt = RttEstimator()   # 鏈路延遲 (命令ACK、地址ACK等即時回應)
+        self.rtt = {}                    # 命令 -> 最終回應 (含編程時間) 的估計
+
+    def log_message(self, message):
+        """輸出日誌 (沒有回調時打印到終端)"""
+        start = time.perf_counter()
+        if self.log:
+            self.log(message)
+        else:
+            print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+        self.callback_time += time.perf_counter() - start
+
+    def set_progress(self, value):
+        """更新進度"""
+        start = time.perf_counter()
+        if self.progress:
+            self.progress(value)
+        self.callback_time += time.perf_counter() - start
+
+    def connect(self, port, baud, timeout=1, trace=None):
+        """打開串口 (失敗時拋出 serial.SerialException)
+
+        trace 為文件路徑時，把線路上的每次收發錄製到該文件 (見 bootloader_trace.py)。
+        """
+        self.metrics = SessionMetrics(port, baud)
+        serial_port = open_port(port, baud, timeout)
+        if trace:
+            from bootloader_trace import TraceWriter, TracingSerial  # 只在錄製時載入
+            serial_port = TracingSerial(serial_port, TraceWriter(trace, port, baud))
+        self.serial_port = MeteredSerial(serial_port, self.metrics)
+        self.port = port
+        self.baud = baud
+        self.base_baud = baud
+        self.link_errors = 0
+        self.session = DeviceSession()
+        self.link_rtt = RttEstimator()
+        self.rtt = {}
+        self.connected = True
+        self.erased_sectors.clear()
+        self.log_message(f"已連接到 {port} @ {baud}")
+
+    def disconnect(self):
+        """關閉串口並清空設備信息"""
+        if self.serial_port:
+            self.serial_port.close()
+        self.connected = False
+        self.session = DeviceSession()
+        self.erased_sectors.clear()
+        self.log_message("已斷開連接")
+
+    def send_command(self, command, data=None):
+        """發送命令到Bootloader"""
+        if not self.connected:
+            self.log_message("請先連接串口")
+            return None
+
+        try:
+            # 發送命令
+            self.serial_port.write(bytes([command]))
+
+            # 等待ACK
+            self.set_timeout(2)
+            response = self.serial_port.read(1)
+            self.last_response = response
+            if len(response) == 0 or response[0] != ACK:
+                self.log_message(f"命令 0x{command:02X} 未收到ACK")
+                return None
+
+            # 發送數據(如果有)
+            if data:
+                self.serial_port.write(data)
+
+            return True
+
+        except Exception as e:
+            self.log_message(f"發送命令錯誤: {str(e)}")
+            return None
+
+    def begin_command(self):
+        """開始一次命令交易，返回統計用的起點"""
+        return time.perf_counter(), self.metrics.bytes_sent, self.metrics.bytes_received
+
+    def end_command(self, opcode, mark, result, payload=0, retries=0):
+        """結束命令交易並記錄RTT、收發字節數與結果 (ack/nack/timeout/error)"""
+        start, sent, received = mark
+        self.record_transaction(opcode, time.perf_counter() - start, self.metrics.bytes_sent - sent,
+                                self.metrics.bytes_received - received, result, payload, retries)
+
+    def record_transaction(self, opcode, rtt, sent, received, result, payload=0, retries=0, sample=True):
+        """記錄一次交易到統計，並更新會話的鏈路狀態
+
+        sample 為False時 (管線模式的RTT包含排隊時間) 由調用者另外以 note_response_time 更新超時估計。
+        """
+        self.metrics.record(opcode, rtt, sent, received, result, payload, retries)
+        self.session.note_result(result)
+        self.last_result = result
+        if sample:
+            self.note_response_time(opcode, rtt, sent + received, result)
+
+    def note_response_time(self, opcode, elapsed, nbytes, result):
+        """以一次交易更新超時估計: 扣除 nbytes 字節的線路時間，剩下的是設備處理時間與適配器延遲
+
+        擦除另有預算 (見 erase_sectors)，不參與估計。
+        """
+        if opcode == 0x44:
+            return
+        estimator = self.rtt.get(opcode)
+        if estimator is None:
+            estimator = self.rtt[opcode] = RttEstimator()
+        if result == "ack":
+            response_time = max(0.0, elapsed - self.wire_time(nbytes))
+            estimator.add(response_time)
+            if opcode in LINK_OPCODES:
+                self.link_rtt.add(response_time)
+        elif result == "timeout":
+            estimator.back_off()
+            self.link_rtt.back_off()
+
+    def wire_time(self, nbytes):
+        """nbytes 字節在目前波特率下的線路時間 (秒，8N1每字節10位)"""
+        return nbytes * 10 / self.baud
+
+    def get_timeout(self, nbytes=1, opcode=None, extra=0.0):
+        """等待回應的超時: opcode 的回應時間估計 (None 為鏈路延遲) + nbytes 字節的線路時間 + extra
+
+        還沒有測量值的命令使用 RTO_INITIAL (例如第一次壓縮寫入需要解壓與編程)。
+        """
+        estimator = self.link_rtt if opcode is None else self.rtt.get(opcode)
+        rto = estimator.timeout() if estimator else RTO_INITIAL
+        return rto + self.wire_time(nbytes) + extra
+
+    def set_timeout(self, nbytes=1, opcode=None, extra=0.0):
+        """依估計設定串口讀取超時 (取整後與目前相同時不重新設定)"""
+        timeout = round(math.ceil(self.get_timeout(nbytes, opcode, extra) / TIMEOUT_STEP) * TIMEOUT_STEP, 3)
+        if self.serial_port.timeout != timeout:
+            self.serial_port.timeout = timeout
+
+    def get_custom_version(self):
+        """獲取自定義Bootloader版本，返回版本字串 (失敗返回None)"""
+        mark = self.begin_command()
+        result = "error"
+        retry = 0
+        try:
+            # 清空緩衝區
+            self.serial_port.reset_input_buffer()
+
+            # 發送GET_VERSION命令 (0x01)
+            self.serial_port.write(bytes([0x01]))
+            self.log_message("發送GET_VERSION命令: 0x01")
+
+            # 等待ACK (增加重試機制)
+            for retry in range(3):
+                self.set_timeout(2)
+                response = self.serial_port.read(1)
+                if len(response) == 1 and response[0] == ACK:
+                    break
+                elif retry < 2:
+                    self.log_message(f"重試獲取版本 {retry + 1}/3")
+                    time.sleep(0.1)
+                    self.serial_port.write(bytes([0x01]))
+                else:
+                    self.log_message(f"版本命令ACK失敗: {response.hex() if response else 'None'}")
+                    result = classify_response(response)
+                    return None
+
+            self.log_message("版本命令收到ACK")
+
+            # 讀取版本號 (與最終ACK一起送出)
+            self.set_timeout(2)
+            version = self.serial_port.read(1)
+            if len(version) == 1:
+                version_num = version[0]
+                version_str = format_version(version_num)
+                self.log_message(f"Bootloader版本: {version_str}")
+
+                # 等待最終ACK
+                final_ack = self.serial_port.read(1)
+                result = classify_response(final_ack)
+                if result == "ack":
+                    self.log_message("版本讀取完成")
+                    self.session.version = version_num
+                    return version_str
+                else:
+                    self.log_message(f"最終ACK失敗: {final_ack.hex() if final_ack else 'None'}")
+                    return None
+            else:
+                self.log_message("版本號讀取失敗")
+                result = "timeout"
+                return None
+
+        except Exception as e:
+            self.log_message(f"獲取版本錯誤: {str(e)}")
+            return None
+
+        finally:
+            self.end_command(0x01, mark, result, retries=retry)
+
+    def get_custom_chip_id(self):
+        """獲取自定義Bootloader芯片ID，返回ID數值 (失敗返回None)"""
+        mark = self.begin_command()
+        result = "error"
+        retry = 0
+        try:
+            # 清空緩衝區
+            self.serial_port.reset_input_buffer()
+
+            # 發送GET_ID命令 (0x02)
+            self.serial_port.write(bytes([0x02]))
+            self.log_message("發送GET_ID命令: 0x02")
+
+            # 等待ACK (增加重試機制)
+            for retry in range(3):
+                self.set_timeout(2)
+                response = self.serial_port.read(1)
+                if len(response) == 1 and response[0] == ACK:
+                    break
+                elif retry < 2:
+                    self.log_message(f"重試獲取芯片ID {retry + 1}/3")
+                    time.sleep(0.1)
+                    self.serial_port.write(bytes([0x02]))
+                else:
+                    self.log_message(f"芯片ID命令ACK失敗: {response.hex() if response else 'None'}")
+                    result = classify_response(response)
+                    return None
+
+            self.log_message("芯片ID命令收到ACK")
+
+            # 讀取4字節芯片ID
+            self.set_timeout(5)
+            chip_id_bytes = self.serial_port.read(4)
+            if len(chip_id_bytes) != 4:
+                self.log_message(f"芯片ID讀取失敗，只收到 {len(chip_id_bytes)} 字節")
+                result = "timeout"
+                return None
+
+            # 組合芯片ID (大端序)
+            chip_id = (chip_id_bytes[0] << 24) | (chip_id_bytes[1] << 16) | \
+                    (chip_id_bytes[2] << 8) | chip_id_bytes[3]
+
+            self.log_message(f"芯片ID: 0x{chip_id:08X}")
+            self.log_message(f"芯片型號: {self.get_chip_name(chip_id)}")
+
+            # 等待最終ACK
+            final_ack = self.serial_port.read(1)
+            result = classify_response(final_ack)
+            if result == "ack":
+                self.log_message("芯片ID讀取完成")
+                self.session.chip_id = chip_id
+                return chip_id
+            else:
+                self.log_message(f"最終ACK失敗: {final_ack.hex() if final_ack else 'None'}")
+                return None
+
+        except Exception as e:
+            self.log_message(f"獲取芯片ID錯誤: {str(e)}")
+            return None
+
+        finally:
+            self.end_command(0x02, mark, result, retries=retry)
+
+    def get_chip_name(self, chip_id):
+        """根據芯片ID返回芯片名稱"""
+        chip_dict = {
+            0x0413: "STM32F405/407/415/417",
+            0x0419: "STM32F42x/43x",
+            0x0431: "STM32F411",
+            0x0441: "STM32F412",
+            0x0463: "STM32F413/423",
+            0x0434: "STM32F469/479",
+            0x0421: "STM32F446",
+            0x0423: "STM32F401xB/C",
+            0x0433: "STM32F401xD/E",
+            # 添加更多芯片ID
+        }
+
+        return chip_dict.get(chip_id, f"未知芯片")
+
+    def check_bootloader_alive(self):
+        """檢查Bootloader是否還活著 (版本號與快取不同時視為設備已更換)"""
+        try:
+            if not self.connected or not self.serial_port:
+                return False
+
+            # 發送簡單的版本查詢命令來檢查連接
+            self.serial_port.reset_input_buffer()
+            mark = self.begin_command()
+            self.serial_port.write(bytes([0x01]))  # GET_VERSION
+
+            # 等待ACK，超時依實測的鏈路延遲 (鏈路中斷時幾十毫秒內返回)
+            self.set_timeout(2)
+            response = self.serial_port.read(1)
+            if len(response) == 1 and response[0] == ACK:
+                version = self.serial_port.read(1)
+                final_ack = self.serial_port.read(1)
+                result = classify_response(final_ack) if version else "timeout"
+                self.end_command(0x01, mark, result)
+                if result != "ack":
+                    return False
+                if self.session.version is not None and self.session.version != version[0]:
+                    self.log_message("Bootloader版本改變，設備可能已更換，清除快取的設備信息")
+                    self.session.forget_identity()
+                self.session.version = version[0]
+                return True
+            else:
+                self.end_command(0x01, mark, classify_response(response))
+                return False
+
+        except Exception:
+            return False
+
+    def ensure_alive(self, reconnect=True):
+        """只在閒置超過 SESSION_IDLE_TIMEOUT 或上次交易失敗後才檢查存活
+
+        檢查失敗且 reconnect 為True時，重新同步或重新連接。
+        """
+        if not self.connected:
+            self.log_message("請先連接串口")
+            return False
+        if self.session.is_fresh() or self.check_bootloader_alive():
+            return True
+        if not reconnect:
+            return False
+        self.log_message("Bootloader無回應")
+        return self.reconnect_bootloader()
+
+    def get_chip_id(self, refresh=False):
+        """返回芯片ID，本次連接已讀取過時使用快取 (refresh 為True時重新讀取)"""
+        if not self.ensure_alive():
+            return None
+        if refresh or self.session.chip_id is None:
+            return self.get_custom_chip_id()
+        return self.session.chip_id
+
+    def get_version(self, refresh=False):
+        """返回Bootloader版本字串，本次連接已讀取過時使用快取"""
+        if not self.ensure_alive():
+            return None
+        if refresh or self.session.version is None:
+            return self.get_custom_version()
+        return format_version(self.session.version)
+
+    def resync(self):
+        """不重新打開串口恢復通訊: 清空殘留後在目前波特率握手，
+        不成功再回到連接時的波特率 (Bootloader重啟後使用該速率)
+        """
+        try:
+            self.drain_input()
+            if self.check_bootloader_alive():
+                return True
+            if self.baud == self.base_baud:
+                return False
+
+            self.log_message(f"波特率 {self.baud} 無回應，改用 {self.base_baud}")
+            self.serial_port.baudrate = self.base_baud
+            self.baud = self.metrics.baud = self.base_baud
+            self.link_errors = 0
+            self.drain_input()
+            if self.check_bootloader_alive():
+                # 回到初始波特率才有回應: Bootloader已重啟，可能是另一塊板
+                self.session.forget_identity()
+                return True
+            return False
+
+        except Exception as e:
+            self.log_message(f"重新同步錯誤: {str(e)}")
+            return False
+
+    def reconnect_bootloader(self, port=None, baud=None):
+        """重新連接Bootloader (預設沿用上次的串口與波特率)
+
+        串口相同且仍可使用時只重新同步，不關閉串口；否則重新打開。
+        """
+        try:
+            self.log_message("嘗試重新連接Bootloader...")
+
+            port = port or self.port
+            if (self.connected and port == self.port and self.serial_port.is_open
+                    and (baud is None or baud in (self.baud, self.base_baud))):
+                if self.resync():
+                    self.log_message("重新同步成功")
+                    return True
+                self.log_message("重新同步失敗，重新打開串口")
+
+            # 關閉現有連接
+            if self.serial_port and self.serial_port.is_open:
+                self.serial_port.close()
+                self.log_message("已關閉現有連接")
+
+            time.sleep(0.5)
+
+            baud = baud or self.baud
+            if not port:
+                raise Exception("無法解析串口名稱")
+
+            self.log_message(f"準備連接串口: {port}")
+            self.connect(port, baud)
+
+            # 測試連接
+            if self.check_bootloader_alive():
+                self.log_message("重新連接成功")
+                return True
+            else:
+                self.log_message("Bootloader 測試失敗")
+                return False
+
+        except Exception as e:
+            self.log_message(f"重新連接錯誤: {str(e)}")
+            return False
+
+    def get_adapter_key(self):
+        """返回目前串口適配器的識別字串 (優先使用VID:PID)"""
+        for port in serial.tools.list_ports.comports():
+            if port.device == self.port and port.vid is not None:
+                return f"{port.vid:04X}:{port.pid:04X}"
+        return self.port
+
+    def load_baud_memory(self):
+        """讀取各適配器最佳波特率記錄"""
+        try:
+            with open(BAUD_MEMORY_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def remember_baud(self, baud):
+        """記錄目前適配器最佳的穩定波特率"""
+        adapter_key = self.get_adapter_key()
+        try:
+            with JOURNAL_LOCK:
+                memory = self.load_baud_memory()
+                memory[adapter_key] = baud
+                save_state_file(BAUD_MEMORY_FILE, memory)
+        except OSError as e:
+            self.log_message(f"保存波特率記錄失敗: {str(e)}")
+
+    def set_baud_rate(self, baud):
+        """請求Bootloader切換波特率，並在新波特率下握手確認
+
+        協議: 0xA0 -> ACK, 4字節波特率 (大端序) + 校驗和 -> ACK (舊波特率)，
+        之後雙方切換。Bootloader在 BAUD_REVERT_TIMEOUT 內收不到有效命令會退回原波特率。
+        返回 True 成功、False 失敗 (已回到原波特率)、None 表示Bootloader不支援。
+        """
+        old_baud = self.baud
+        mark = self.begin_command()
+        if not self.send_command(CMD_SET_BAUD):
+            result = classify_response(self.last_response)
+            self.end_command(CMD_SET_BAUD, mark, result)
+            if result == "nack":
+                self.session.commands[CMD_SET_BAUD] = False
+            return None
+        self.session.commands[CMD_SET_BAUD] = True
+
+        self.serial_port.write(self.encoder.address_packet(baud))  # 格式同地址包: 4字節大端序 + 校驗和
+
+        self.set_timeout(6)
+        response = self.serial_port.read(1)
+        self.end_command(CMD_SET_BAUD, mark, classify_response(response))
+        if len(response) == 0 or response[0] != ACK:
+            self.log_message(f"Bootloader拒絕波特率 {baud}")
+            return False
+
+        self.serial_port.baudrate = baud
+        self.baud = self.metrics.baud = baud
+        time.sleep(0.02)
+        if self.check_bootloader_alive():
+            self.link_errors = 0
+            self.log_message(f"波特率已切換到 {baud}")
+            return True
+
+        # 新波特率握手失敗：等待Bootloader自動回退
+        self.log_message(f"波特率 {baud} 握手失敗，回退到 {old_baud}")
+        self.serial_port.baudrate = old_baud
+        self.baud = self.metrics.baud = old_baud
+        time.sleep(BAUD_REVERT_TIMEOUT)
+        self.serial_port.reset_input_buffer()
+        return False
+
+    def probe_throughput(self, length=1024):
+        """以兩次回讀同一區域測試鏈路，返回讀取速率 (字節/秒)，失敗返回None (不重試，任何錯誤都算失敗)"""
+        start_time = time.time()
+        first = self.read_memory(APP_START_ADDRESS, length, retries=0)
+        second = self.read_memory(APP_START_ADDRESS, length, retries=0)
+        elapsed = max(time.time() - start_time, 1e-6)
+        if first is None or second is None or first != second:
+            return None
+        return 2 * length / elapsed
+
+    def escalate_baud(self, max_baud=None):
+        """逐級提高波特率並以探測傳輸確認，停在最快的穩定速率並記錄下來"""
+        candidates = [b for b in BAUD_RATES if b > self.baud and (max_baud is None or b <= max_baud)]
+        if not candidates or self.session.supports(CMD_SET_BAUD) is False:
+            return self.baud
+
+        # 先嘗試上次記錄的速率
+        remembered = self.load_baud_memory().get(self.get_adapter_key())
+        if remembered in candidates:
+            result = self.set_baud_rate(remembered)
+            if result is None:
+                self.log_message("Bootloader不支援變更波特率")
+                return self.baud
+            if result and self.probe_throughput() is not None:
+                self.log_message(f"使用記錄的波特率 {remembered}")
+                return self.baud
+            if result:
+                self.set_baud_rate(self.base_baud)
+
+        best_baud = self.baud
+        best_rate = self.probe_throughput()
+        if best_rate is None:
+            self.log_message("目前鏈路不穩定，不提速")
+            return self.baud
+        self.log_message(f"波特率 {best_baud}: {best_rate:.0f} 字節/秒")
+
+        for baud in candidates:
+            if baud <= self.baud:
+                continue
+            result = self.set_baud_rate(baud)
+            if result is None:
+                self.log_message("Bootloader不支援變更波特率")
+                break
+            if not result:
+                break
+
+            rate = self.probe_throughput()
+            if rate is None:
+                self.log_message(f"波特率 {baud} 探測傳輸失敗")
+                break
+            self.log_message(f"波特率 {baud}: {rate:.0f} 字節/秒")
+            if rate > best_rate:
+                best_baud, best_rate = baud, rate
+
+        if self.baud != best_baud:
+            self.set_baud_rate(best_baud)
+
+        self.log_message(f"選用波特率 {self.baud}")
+        self.remember_baud(self.baud)
+        return self.baud
+
+    def step_down_baud(self):
+        """鏈路錯誤過多時降一級波特率，返回是否已降速"""
+        lower = [b for b in BAUD_RATES if self.base_baud <= b < self.baud]
+        if not lower:
+            return False
+
+        self.drain_input()
+        target = lower[-1]
+        self.log_message(f"鏈路錯誤過多，波特率從 {self.baud} 降到 {target}")
+        if self.set_baud_rate(target):
+            self.remember_baud(target)
+            return True
+        return False
+
+    def note_link_error(self):
+        """記錄一次鏈路錯誤，提速後錯誤達到上限時自動降速"""
+        self.link_errors += 1
+        if self.baud > self.base_baud and self.link_errors >= BAUD_ERROR_LIMIT:
+            return self.step_down_baud()
+        return False
+
+    def get_sectors_for_range(self, address, length):
+        """返回地址範圍 [address, address+length) 涉及的扇區編號"""
+        sectors = []
+        end = address + length
+        for index, (sector_start, sector_size) in enumerate(FLASH_SECTORS):
+            if sector_start < end and address < sector_start + sector_size:
+                sectors.append(index)
+        return sectors
+
+    def get_sector_segments(self, address, length):
+        """將地址範圍按扇區切分，返回 [(扇區, 段起始地址, 段結束地址)]"""
+        segments = []
+        for sector in self.get_sectors_for_range(address, length):
+            sector_start, sector_size = FLASH_SECTORS[sector]
+            segments.append((sector, max(address, sector_start), min(address + length, sector_start + sector_size)))
+        return segments
+
+    def check_app_range(self, address, length):
+        """檢查範圍是否位於應用程序區域內"""
+        if length <= 0 or address < APP_START_ADDRESS or address + length > FLASH_END:
+            self.log_message(f"範圍 0x{address:08X}-0x{address + length - 1:08X} 超出應用程序區域")
+            return False
+        return True
+
+    def is_range_blank(self, address, length, window=4):
+        """空白檢查：整個範圍都是0xFF才視為已擦除 (讀取失敗時視為不空白)
+
+        Bootloader支援CRC命令時比對區間CRC與全0xFF的CRC (一次往返)，
+        否則管線讀取整個範圍，遇到第一個非0xFF的塊即停止。
+        """
+        if self.session.supports(CMD_CRC) is not False:
+            crc = self.retry_chunk(CMD_CRC, lambda: self.crc_memory(address, length), address)
+            if crc is not None:
+                return crc == stm32_crc32(b'\xFF' * length)
+            if self.session.supports(CMD_CRC) is not False:
+                return False
+
+        frames = [(start, min(256, address + length - start)) for start in range(address, address + length, 256)]
+        reads = self.iter_read_pipelined(frames, window)
+        try:
+            for _, data in reads:
+                if data.count(0xFF) != len(data):
+                    return False
+        except Exception as e:
+            self.log_message(f"空白檢查讀取失敗: {str(e)}")
+            return False
+        finally:
+            reads.close()
+        return True
+
+    def load_erase_timing(self):
+        """讀取各芯片的扇區擦除時間記錄"""
+        try:
+            with open(ERASE_TIMING_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def estimate_erase_time(self, sectors, records):
+        """依實測記錄 (沒有時用預設值) 返回每個扇區的預估擦除時間"""
+        return {sector: records.get(str(sector), ERASE_TIME_DEFAULTS[FLASH_SECTORS[sector][1]])
+                for sector in sectors}
+
+    def learn_erase_time(self, chip_key, sectors, elapsed):
+        """把實測的擦除時間按預估比例分攤到各扇區，並以移動平均更新記錄"""
+        try:
+            with JOURNAL_LOCK:
+                timing = self.load_erase_timing()
+                records = timing.setdefault(chip_key, {})
+                estimates = self.estimate_erase_time(sectors, records)
+                total = sum(estimates.values())
+                for sector, estimate in estimates.items():
+                    measured = elapsed * estimate / total
+                    if str(sector) in records:
+                        measured = records[str(sector)] * (1 - ERASE_TIME_ALPHA) + measured * ERASE_TIME_ALPHA
+                    records[str(sector)] = round(measured, 4)
+                save_state_file(ERASE_TIMING_FILE, timing)
+        except OSError as e:
+            self.log_message(f"保存擦除時間記錄失敗: {str(e)}")
+
+    def erase_sectors(self, sectors, expendable=()):
+        """擦除指定扇區並等待完成
+
+        不是從扇區2起連續的扇區使用擴展格式；Bootloader以NACK拒絕擴展格式時，
+        改用原有格式從扇區2起連續擦除到最後一個扇區 (原有格式無法單獨擦除扇區2以外的扇區)。
+        因此多擦除的扇區必須是 expendable 中的扇區 (調用者之後會重寫) 或已經空白，
+        否則不擦除並返回False。實際擦除的扇區記錄在 erased_sectors。
+        """
+        sectors = sorted(sectors)
+        prefix = list(range(APP_FIRST_SECTOR, sectors[-1] + 1))
+        if sectors == prefix:
+            return self.send_erase(sectors) == "ack"
+
+        if self.session.extended_erase is not False:
+            result = self.send_erase(sectors)
+            if result == "ack":
+                self.session.extended_erase = True
+            if result != "nack":
+                return result == "ack"
+            if self.session.extended_erase is None:
+                self.session.extended_erase = False
+            # 舊版Bootloader收到2字節就回應NACK，擴展格式其餘的字節被當作命令解析 (例如扇區號2是GET_ID)，
+            # 先清空這些字節的回應並重新同步，之後的空白檢查與擦除才不會讀到殘留的回應
+            if not self.recover_link(0):
+                self.log_message("重新同步失敗，Bootloader無回應")
+                return False
+            self.log_message("擴展擦除格式被拒絕，改用原有格式從扇區2起連續擦除")
+
+        extra = [sector for sector in prefix if sector not in sectors and sector not in expendable]
+        occupied = [sector for sector in extra if not self.is_range_blank(*FLASH_SECTORS[sector])]
+        if occupied:
+            self.log_message(f"原有擦除格式會一併擦除扇區 {', '.join(map(str, occupied))} (非空白)，"
+                             f"無法只擦除扇區 {', '.join(map(str, sectors))}")
+            return False
+        return self.send_erase(prefix) == "ack"
+
+    def send_erase(self, sectors):
+        """發送一次擦除命令並等待完成，返回 "ack" / "nack" / "timeout" / "error"
+
+        sectors 從扇區2起連續時使用原有格式，否則使用擴展格式。
+        """
+        num_sectors = len(sectors)
+        chip_key = self.get_chip_key() or "unknown"
+        estimates = self.estimate_erase_time(sectors, self.load_erase_timing().get(chip_key, {}))
+
+        # 不論擦除是否完成，這些扇區的差異快取記錄都不再可信
+        self.update_delta_cache(None, invalidate=True, sectors=sectors)
+        mark = self.begin_command()
+
+        # 發送擦除命令
+        if not self.send_command(0x44):  # CMD_ERASE_MEMORY
+            self.log_message("發送擦除命令失敗")
+            result = classify_response(self.last_response)
+            self.end_command(0x44, mark, result)
+            return result
+
+        # 從扇區2起連續時使用原有格式 (擦除扇區2起的N個扇區)，否則使用擴展格式 (同AN3155擴展擦除)
+        extended = sectors != list(range(APP_FIRST_SECTOR, APP_FIRST_SECTOR + num_sectors))
+        data = self.encoder.erase_packet(sectors, extended)
+        self.serial_port.write(data)
+
+        # 預估時間來自該芯片各扇區的實測記錄；擦除的超時預算與命令回應的超時分開計算
+        estimated_time = sum(estimates.values())
+        max_wait_time = estimated_time * ERASE_BUDGET_FACTOR + ERASE_BUDGET_MARGIN + self.get_timeout(len(data) + 1)
+        self.log_message(f"等待擦除完成 (預估 {estimated_time:.1f}s)...")
+
+        start_time = time.perf_counter()
+        last_logged = 0
+        old_timeout = self.serial_port.timeout
+
+        try:
+            while True:
+                elapsed_time = time.perf_counter() - start_time
+
+                # 更新進度條
+                progress = min(90, (elapsed_time / estimated_time) * 90)
+                self.set_progress(progress)
+
+                # 阻塞等待回應: ACK一到立即返回，超時只用來定期更新進度
+                self.serial_port.timeout = max(0.01, min(ERASE_PROGRESS_INTERVAL, max_wait_time - elapsed_time))
+                response = self.serial_port.read(1)
+                if len(response) == 1 and response[0] == ACK:
+                    elapsed_time = time.perf_counter() - start_time
+                    self.end_command(0x44, mark, "ack")
+                    self.log_message(f"Flash擦除完成 ({elapsed_time:.2f}s)")
+                    self.set_progress(100)
+                    self.erased_sectors.update(sectors)
+                    self.learn_erase_time(chip_key, sectors, elapsed_time)
+                    return "ack"
+                elif len(response) == 1:
+                    self.end_command(0x44, mark, "nack")
+                    self.log_message(f"擦除命令被拒絕: 0x{response[0]:02X}")
+                    return "nack"
+
+                # 檢查超時
+                elapsed_time = time.perf_counter() - start_time
+                if elapsed_time >= max_wait_time:
+                    self.end_command(0x44, mark, "timeout")
+                    self.log_message(f"Flash擦除超時 ({max_wait_time:.0f}秒)")
+                    return "timeout"
+
+                # 每秒最多顯示一次
+                if int(elapsed_time) > last_logged:
+                    last_logged = int(elapsed_time)
+                    self.log_message(f"擦除進行中... ({elapsed_time:.1f}s / 預估 {estimated_time:.1f}s)")
+
+        finally:
+            # 恢復原始超時設置
+            self.serial_port.timeout = old_timeout
+
+    def get_sector_pieces(self, segments):
+        """將段列表按扇區切分，返回 {扇區: [(地址, 數據)]} (按地址排序)"""
+        pieces = {}
+        for address, data in segments:
+            for sector, seg_start, seg_end in self.get_sector_segments(address, len(data)):
+                pieces.setdefault(sector, []).append((seg_start, data[seg_start - address:seg_end - address]))
+        return dict(sorted(pieces.items()))
+
+    def check_segments(self, segments):
+        """檢查所有段是否位於應用程序區域內"""
+        if not segments:
+            self.log_message("映像沒有任何數據")
+            return False
+        return all(self.check_app_range(address, len(data)) for address, data in segments)
+
+    def erase_range(self, address, length, blank_check=True):
+        """擦除範圍涉及的扇區 (可跳過已經空白的扇區)"""
+        return self.erase_ranges([(address, length)], blank_check)
+
+    def erase_segments(self, segments, blank_check=True):
+        """擦除段列表涉及的扇區 (段之間的空隙所在扇區不會被擦除)"""
+        return self.erase_ranges([(address, len(data)) for address, data in segments], blank_check)
+
+    def erase_ranges(self, ranges, blank_check=True):
+        """擦除多個 (地址, 長度) 範圍涉及的扇區"""
+        self.log_message("開始擦除Flash...")
+        self.set_progress(0)
+
+        if not ranges:
+            self.log_message("沒有需要擦除的範圍")
+            return False
+        for address, length in ranges:
+            if not self.check_app_range(address, length):
+                return False
+
+        sector_ranges = {}
+        for address, length in ranges:
+            self.log_message(f"範圍 0x{address:08X}-0x{address + length - 1:08X} 涉及扇區: "
+                             f"{', '.join(map(str, self.get_sectors_for_range(address, length)))}")
+            for sector, seg_start, seg_end in self.get_sector_segments(address, length):
+                sector_ranges.setdefault(sector, []).append((seg_start, seg_end))
+        sectors = sorted(sector_ranges)
+
+        # 跳過已經是空白的扇區
+        if blank_check:
+            blank_sectors = []
+            for sector in sectors:
+                if all(self.is_range_blank(check_start, check_end - check_start)
+                       for check_start, check_end in sector_ranges[sector]):
+                    blank_sectors.append(sector)
+            if blank_sectors:
+                self.log_message(f"跳過空白扇區: {', '.join(map(str, blank_sectors))}")
+                self.erased_sectors.update(blank_sectors)
+                self.update_delta_cache(None, invalidate=True, sectors=blank_sectors)
+                sectors = [s for s in sectors if s not in blank_sectors]
+
+        if not sectors:
+            self.log_message("所有扇區已是空白，無需擦除")
+            self.set_progress(100)
+            return True
+
+        self.log_message(f"擦除扇區: {', '.join(map(str, sectors))}")
+        return self.erase_sectors(sectors)
+
+    def write_image(self, address, data, window=0, delta=None, compress=False, resume=False):
+        """寫入連續的映像 (見 write_segments)"""
+        return self.write_segments([(address, data)], window, delta, compress, resume)
+
+    def write_segments(self, segments, window=0, delta=None, compress=False, resume=False):
+        """寫入稀疏映像 [(地址, 數據)]
+
+        每段按256字節對齊邊界切成幀，段之間的空隙不填充也不寫入。
+        window 大於0時使用管線寫入；delta 為 "readback" 或 "cache" 時
+        只擦除並重寫內容不同的扇區；compress 為 True 時優先使用壓縮寫入
+        (Bootloader不支援時自動改用0x31)。
+        寫入進度記錄在日誌文件中；resume 為 True 時從上次中斷的位置續傳。
+        """
+        total_size = sum(len(data) for _, data in segments)
+        if len(segments) == 1:
+            self.log_message(f"開始寫入 {total_size} 字節到地址 0x{segments[0][0]:08X}")
+        else:
+            self.log_message(f"開始寫入 {total_size} 字節 ({len(segments)} 個段)")
+            for address, data in segments:
+                self.log_message(f"  段 0x{address:08X}-0x{address + len(data) - 1:08X} ({len(data)} 字節)")
+
+        if not self.check_segments(segments):
+            return False
+        sector_pieces = self.get_sector_pieces(segments)
+
+        if delta:
+            # 差異燒錄: 只擦除並重寫內容不同的扇區
+            rewrite = self.plan_delta(segments, delta)
+            if rewrite is None:
+                return False
+            if not rewrite:
+                self.log_message("芯片內容與文件相同，無需燒錄")
+                self.update_delta_cache(segments)
+                return True
+            if not self.erase_sectors(rewrite, expendable=sector_pieces):
+                self.log_message("差異燒錄擦除失敗")
+                return False
+            # 改用原有擦除格式時可能一併擦除了保留的扇區，這些扇區也需要重寫
+            extra = [sector for sector in sector_pieces if sector not in rewrite and sector in self.erased_sectors]
+            if extra:
+                self.log_message(f"扇區 {', '.join(map(str, extra))} 已被一併擦除，一起重寫")
+                rewrite = sorted(rewrite + extra)
+
+            frames = split_frames([piece for sector in rewrite for piece in sector_pieces[sector]])
+        else:
+            frames = split_frames(segments)
+        journal_key = self.get_journal_key(frames)
+        frames = self.prepare_frames(frames)
+
+        if resume and delta:
+            self.log_message("差異燒錄不使用續傳")
+        elif resume:
+            entry = self.load_journal().get(journal_key) if journal_key else None
+            if entry is None:
+                self.log_message("沒有這個映像的寫入日誌，從頭寫入")
+            else:
+                frames = self.plan_resume(frames, entry["written_end"])
+                if frames is None:
+                    return False
+                if not frames:
+                    self.log_message("映像已全部寫入")
+                    self.finish_journal(journal_key, True)
+                    return True
+
+        # 已擦除的區域跳過全0xFF的幀
+        frames, skipped_frames, skipped_bytes = self.skip_blank_frames(frames)
+        self.erased_sectors.difference_update(sector_pieces)
+
+        total_chunks = len(frames)
+        total_bytes = sum(len(frame.data) for frame in frames)
+
+        start_time = time.time()
+        start_callback_time = self.callback_time
+        start_retries = self.metrics.total_retries()
+        self.begin_journal(journal_key)
+        written = False
+        try:
+            if compress and self.session.supports(CMD_WRITE_COMPRESSED) is not False:
+                if not self.write_compressed([(frame.address, frame.data) for frame in frames]):
+                    return False
+                mode = '壓縮' if self.session.supports(CMD_WRITE_COMPRESSED) else '停等'
+                mode_desc = mode
+            elif window > 0:
+                mode = '管線'
+                mode_desc = f"管線(窗口{window})"
+                if not self.write_memory_pipelined(frames, window):
+                    return False
+            else:
+                mode = '停等'
+                mode_desc = mode
+                for i, frame in enumerate(frames):
+                    if self.write_frame(frame):
+                        self.note_written(frame.address + len(frame.data))
+                        progress = (i + 1) * 100 // total_chunks
+                        self.set_progress(progress)
+                        self.log_message(f"寫入進度: {progress}% ({i+1}/{total_chunks})")
+                    else:
+                        self.log_message(f"寫入失敗在地址 0x{frame.address:08X}")
+                        return False
+
+            written = True
+        finally:
+            self.finish_journal(journal_key, written)
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        callback_time = self.callback_time - start_callback_time
+        rate = total_bytes / elapsed
+        self.write_rates[mode] = rate
+        self.log_message("Flash寫入完成")
+
+        # 差異燒錄記錄新內容；一般寫入無法確定結果，清除相關記錄
+        if delta:
+            self.update_delta_cache(segments)
+        else:
+            self.update_delta_cache(segments, invalidate=True)
+        self.log_message(f"寫入模式: {mode_desc}, 耗時 {elapsed:.2f}s, 速率 {rate:.0f} 字節/秒")
+        self.log_message(f"其中日誌/進度回調耗時 {callback_time:.3f}s ({callback_time * 100 / elapsed:.1f}%)")
+        if skipped_frames or skipped_bytes:
+            self.log_message(f"跳過 {skipped_frames} 個空白幀，共省略 {skipped_bytes} 字節")
+        retries = self.metrics.total_retries() - start_retries
+        if retries:
+            self.log_message(f"區塊重試 {retries} 次")
+
+        # 兩種模式都有數據時，報告相對速度
+        if '管線' in self.write_rates and '停等' in self.write_rates:
+            ratio = self.write_rates['管線'] / self.write_rates['停等']
+            self.log_message(f"管線 {self.write_rates['管線']:.0f} B/s vs 停等 {self.write_rates['停等']:.0f} B/s (x{ratio:.2f})")
+
+        return True
+
+    def prepare_frames(self, frames):
+        """組裝寫入幀，同一映像重複燒錄時直接取用快取"""
+        start = time.perf_counter()
+        prepared, source = self.frame_cache.prepare(frames)
+        elapsed = time.perf_counter() - start
+        if source:
+            self.log_message(f"使用{'記憶體' if source == 'memory' else '磁碟'}中的幀快取 "
+                             f"({len(prepared)} 幀，{elapsed * 1000:.1f}ms)")
+        else:
+            self.log_message(f"組裝 {len(prepared)} 個寫入幀，耗時 {elapsed * 1000:.1f}ms")
+        return prepared
+
+    def skip_blank_frames(self, frames):
+        """剔除落在已擦除扇區內的全0xFF幀，並截去幀尾的0xFF填充 (截斷長度已在組裝時算好)
+
+        返回 (剩餘幀列表, 跳過的幀數, 省略的字節數)
+        """
+        result = []
+        skipped_frames = 0
+        skipped_bytes = 0
+
+        for frame in frames:
+            sectors = self.get_sectors_for_range(frame.address, len(frame.data))
+            if not self.erased_sectors.issuperset(sectors):
+                result.append(frame)
+                continue
+
+            if frame.blank_length == 0:
+                skipped_frames += 1
+                skipped_bytes += len(frame.data)
+                continue
+
+            trimmed = frame.trimmed()
+            skipped_bytes += len(frame.data) - len(trimmed.data)
+            result.append(trimmed)
+
+        return result, skipped_frames, skipped_bytes
+
+    def get_device_uid(self):
+        """返回96位芯片唯一ID，本次連接已讀取過時使用快取 (讀取失敗返回None)"""
+        if not self.ensure_alive():
+            return None
+        if self.session.uid is None:
+            uid = self.retry_chunk(0x11, lambda: self.read_memory_chunk(DEVICE_UID_ADDRESS, DEVICE_UID_LENGTH - 1),
+                                   DEVICE_UID_ADDRESS, retries=1)
+            if uid is None:
+                self.log_message("無法讀取芯片唯一ID")
+                self.session.uid = b''
+            else:
+                self.session.uid = bytes(uid)
+                self.log_message(f"芯片唯一ID: {self.session.uid.hex().upper()}")
+        return self.session.uid or None
+
+    def get_chip_key(self):
+        """返回區分每塊板的鍵值 (芯片ID + 唯一ID)，供差異快取、擦除時間與寫入日誌使用
+
+        讀不到唯一ID時返回None，不能把同型號的其他板當成同一塊。
+        """
+        chip_id = self.get_chip_id()
+        if chip_id is None:
+            return None
+        uid = self.get_device_uid()
+        if uid is None:
+            return None
+        return f"{chip_id:08X}-{uid.hex().upper()}"
+
+    def load_delta_cache(self):
+        """讀取差異燒錄快取"""
+        try:
+            with open(DELTA_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def digest_pieces(self, pieces):
+        """計算扇區內各段的摘要 (單段時只對數據取雜湊，與舊記錄相容)"""
+        if len(pieces) == 1:
+            return hashlib.sha256(pieces[0][1]).hexdigest()
+        digest = hashlib.sha256()
+        for address, data in pieces:
+            digest.update(struct.pack('>II', address, len(data)))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def update_delta_cache(self, segments, invalidate=False, sectors=None):
+        """記錄 (或清除) 每個扇區最後燒錄內容的摘要
+
+        invalidate 為True時清除段列表涉及的扇區，或直接清除 sectors 列出的扇區 (擦除時)。
+        """
+        if invalidate and not os.path.exists(DELTA_CACHE_FILE):
+            return
+        chip_key = self.get_chip_key()
+        if chip_key is None:
+            return
+
+        if sectors is not None:
+            entries = {str(sector): None for sector in sectors}
+        else:
+            entries = {str(sector): None if invalidate else {
+                "address": pieces[0][0],
+                "length": sum(len(data) for _, data in pieces),
+                "sha256": self.digest_pieces(pieces),
+            } for sector, pieces in self.get_sector_pieces(segments).items()}
+        try:
+            with JOURNAL_LOCK:
+                cache = self.load_delta_cache()
+                records = cache.setdefault(chip_key, {})
+                for sector, entry in entries.items():
+                    if entry is None:
+                        records.pop(sector, None)
+                    else:
+                        records[sector] = entry
+                save_state_file(DELTA_CACHE_FILE, cache)
+        except OSError as e:
+            self.log_message(f"保存差異快取失敗: {str(e)}")
+
+    def plan_delta(self, segments, source="readback"):
+        """比對文件與芯片內容，返回需要擦除並重寫的扇區列表
+
+        source 為 "cache" 時使用這塊板最後燒錄的摘要比對: 摘要不同的扇區直接重寫，
+        摘要相同的扇區仍需在芯片上確認 (見 match_device，快取之後可能被擦除或改寫)；
+        沒有記錄時回讀。為 "readback" 時經 read_memory 讀取實際內容比對。
+        """
+        if not self.check_segments(segments):
+            return None
+
+        records = {}
+        if source == "cache":
+            chip_key = self.get_chip_key()
+            if chip_key is None:
+                self.log_message("無法識別這塊板，改用回讀比對")
+            else:
+                records = self.load_delta_cache().get(chip_key, {})
+
+        keep, rewrite = [], []
+        for sector, pieces in self.get_sector_pieces(segments).items():
+            length = sum(len(data) for _, data in pieces)
+            record = records.get(str(sector))
+
+            if record and record["address"] == pieces[0][0] and record["length"] == length:
+                same = record["sha256"] == self.digest_pieces(pieces)
+                if same:
+                    same = self.match_device(sector, pieces)
+                    if same is None:
+                        return None
+            else:
+                same = True
+                for seg_start, segment in pieces:
+                    self.log_message(f"回讀扇區 {sector} (0x{seg_start:08X}, {len(segment)} 字節)...")
+                    current = self.read_memory(seg_start, len(segment))
+                    if current is None:
+                        self.log_message(f"回讀扇區 {sector} 失敗")
+                        return None
+                    if bytes(current) != segment:
+                        same = False
+                        break
+
+            (keep if same else rewrite).append(sector)
+
+        self.log_message(f"差異燒錄計劃: 保留扇區 [{', '.join(map(str, keep))}], "
+                         f"擦除並重寫扇區 [{', '.join(map(str, rewrite))}]")
+        return rewrite
+
+    def match_device(self, sector, pieces):
+        """確認扇區內各段在芯片上的內容與數據相同，返回 True/False (通訊失敗返回None)
+
+        Bootloader支援CRC命令時每段只需一次往返，否則回讀比對。
+        """
+        for seg_start, segment in pieces:
+            if self.session.supports(CMD_CRC) is not False:
+                crc = self.retry_chunk(CMD_CRC, lambda: self.crc_memory(seg_start, len(segment)), seg_start)
+                if crc is not None:
+                    if crc != stm32_crc32(segment):
+                        self.log_message(f"扇區 {sector} 的CRC與快取記錄不符 (芯片內容已改變)")
+                        return False
+                    continue
+                if self.session.supports(CMD_CRC) is not False:
+                    self.log_message(f"確認扇區 {sector} 失敗: 0x{seg_start:08X} 的CRC命令無回應")
+                    return None
+
+            self.log_message(f"回讀確認扇區 {sector} (0x{seg_start:08X}, {len(segment)} 字節)...")
+            current = self.read_memory(seg_start, len(segment))
+            if current is None:
+                self.log_message(f"回讀扇區 {sector} 失敗")
+                return None
+            if bytes(current) != segment:
+                self.log_message(f"扇區 {sector} 的內容與快取記錄不符 (芯片內容已改變)")
+                return False
+        return True
+
+    def write_frame(self, frame):
+        """發送一個組裝好的寫入幀 (停等模式，失敗時重新同步後重試該幀)"""
+        return self.retry_chunk(0x31, lambda: self.write_memory_chunk(frame.address, frame.data, frame), frame.address)
+
+    def recover_link(self, retry, drain=True):
+        """區塊失敗後恢復協議同步，返回Bootloader是否已回到命令狀態
+
+        先依重試次數退避等待；drain 為True時 (超時、丟字節或管線中仍有在途請求)
+        等線路安靜清空殘留回應，再以GET_VERSION確認同步。單純的NACK之後
+        Bootloader已回到命令狀態，只清空輸入緩衝區。
+
+        確認失敗時Bootloader可能停在某個命令幀的中途 (例如命令ACK丟失後仍在等地址)，
+        送出0xFF填充讓它把該幀收完: 地址、長度與波特率幀的校驗必然失敗而回應NACK，
+        寫入幀即使校驗通過也只寫入0xFF (不改變Flash)；多出的填充字節作為未知命令被NACK。
+        """
+        time.sleep(min(RETRY_BACKOFF * 2 ** retry, RETRY_BACKOFF_MAX))
+        if not drain:
+            self.serial_port.reset_input_buffer()
+            return True
+        self.drain_input(self.get_timeout())
+        if self.check_bootloader_alive():
+            return True
+
+        self.serial_port.write(b'\xFF' * RESYNC_FILL)
+        self.drain_input(self.get_timeout(RESYNC_FILL))
+        return self.check_bootloader_alive()
+
+    def retry_chunk(self, opcode, attempt, address, retries=CHUNK_RETRIES):
+        """執行單個區塊的操作 attempt() (返回None或False表示失敗)，失敗時恢復同步後只重試該區塊
+
+        每次失敗都算一次鏈路錯誤 (提速後可能因此降速)；Bootloader確認不支援該命令，
+        或重新同步後仍無回應 (鏈路中斷) 時不再重試。返回最後一次 attempt() 的結果。
+        """
+        for retry in range(retries + 1):
+            if retry:
+                self.metrics.add_retry(opcode)
+                if not self.recover_link(retry - 1, drain=self.last_result != "nack"):
+                    self.log_message("重新同步失敗，Bootloader無回應")
+                    break
+            value = attempt()
+            if value is not None and value is not False:
+                return value
+            if retry == retries or self.session.supports(opcode) is False:
+                break
+            reason = {"nack": "NACK", "timeout": "超時"}.get(self.last_result, "錯誤")
+            self.log_message(f"區塊 0x{address:08X} {reason}，重新同步後重試 ({retry + 1}/{retries})")
+            self.note_link_error()
+        return value
+
+    def get_journal_key(self, frames):
+        """寫入日誌的鍵值: 芯片鍵值 (見 get_chip_key) + 映像雜湊 (包含各幀地址)，無法識別這塊板時返回None"""
+        chip_key = self.get_chip_key()
+        if chip_key is None:
+            return None
+        return f"{chip_key}:{image_key(frames)}"
+
+    def load_journal(self):
+        """讀取寫入日誌"""
+        try:
+            with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_journal_entry(self, key, written_end):
+        """更新一筆日誌記錄 (written_end 為None時刪除)，同時清除過期的記錄"""
+        now = time.time()
+        with JOURNAL_LOCK:
+            journal = self.load_journal()
+            if written_end is not None:
+                journal[key] = {"written_end": written_end, "updated": now}
+            elif journal.pop(key, None) is None:
+                return
+            journal = {k: v for k, v in journal.items() if now - v.get("updated", 0) < JOURNAL_MAX_AGE}
+            try:
+                save_state_file(JOURNAL_FILE, journal)
+            except OSError as e:
+                self.log_message(f"保存寫入日誌失敗: {str(e)}")
+
+    def begin_journal(self, key):
+        self.journal = {"key": key, "written_end": None, "saved_at": time.perf_counter()} if key else None
+
+    def note_written(self, end_address):
+        """記錄已確認寫入到 end_address (不含)，距上次保存超過 JOURNAL_FLUSH_INTERVAL 才寫入文件"""
+        journal = self.journal
+        if journal is None:
+            return
+        journal["written_end"] = end_address
+        now = time.perf_counter()
+        if now - journal["saved_at"] >= JOURNAL_FLUSH_INTERVAL:
+            journal["saved_at"] = now
+            self.save_journal_entry(journal["key"], end_address)
+
+    def finish_journal(self, key, ok):
+        """寫入完成時刪除日誌記錄；失敗時保存最後確認的位置"""
+        journal, self.journal = self.journal, None
+        if key is None:
+            return
+        if ok:
+            self.save_journal_entry(key, None)
+        elif journal and journal["written_end"] is not None:
+            self.save_journal_entry(key, journal["written_end"])
+            self.log_message(f"已記錄寫入進度 (到 0x{journal['written_end']:08X})，可使用續傳繼續")
+
+    def plan_resume(self, frames, written_end):
+        """續傳: 回讀日誌中最後幾個已確認的幀，再往後找出第一個未寫入的幀
+
+        日誌保存有間隔，之後已寫入但未記錄的幀會在回讀時跳過；
+        遇到寫了一半的幀則擦除其扇區並從該扇區的第一個幀重寫。
+        返回剩餘要寫入的幀 (無法續傳時返回None)。
+        """
+        done = sum(1 for frame in frames if frame.address < written_end)
+        check = frames[max(0, done - JOURNAL_VERIFY_FRAMES):done]
+        rest = frames[done:]
+        self.log_message(f"續傳: 日誌記錄已寫入到 0x{written_end:08X}，回讀確認 {len(check)} 個幀")
+
+        candidates = check + rest
+        first = len(candidates)  # 第一個未寫入的幀
+        partial = False
+        reads = self.iter_read_pipelined([(frame.address, len(frame.data)) for frame in candidates])
+        try:
+            for i, ((chunk_addr, actual), frame) in enumerate(zip(reads, candidates)):
+                if actual == frame.data:
+                    continue
+                if i < len(check):
+                    self.log_message(f"芯片內容與寫入日誌不符 @ 0x{chunk_addr:08X}，無法續傳，請擦除後重新寫入")
+                    return None
+                first = i
+                partial = actual.count(0xFF) != len(actual)
+                break
+
+        except Exception as e:
+            self.log_message(f"續傳回讀失敗: {str(e)}")
+            return None
+
+        finally:
+            reads.close()  # 先清空在途的讀取請求再擦除
+
+        remaining = candidates[first:]
+        if partial:
+            # 寫了一半: 擦除該扇區，從扇區內的第一個幀重寫
+            sector = self.get_sectors_for_range(remaining[0].address, 1)[0]
+            self.log_message(f"地址 0x{remaining[0].address:08X} 只寫入了一部分，重新擦除扇區 {sector}")
+            if not self.erase_sectors([sector]):
+                return None
+            remaining = [frame for frame in frames if frame.address >= FLASH_SECTORS[sector][0]]
+
+        if remaining:
+            self.log_message(f"從 0x{remaining[0].address:08X} 繼續寫入 (剩餘 {len(remaining)}/{len(frames)} 個幀)")
+        return remaining
+
+    def write_memory_chunk(self, address, data, frame=None):
+        """寫入單個記憶體塊 (frame 為組裝好的幀時直接發送其中的數據包)"""
+        mark = self.begin_command()
+        result = "error"
+        try:
+            # 發送寫入命令
+            if not self.send_command(0x31):  # CMD_WRITE_MEMORY
+                result = classify_response(self.last_response)
+                return False
+
+            # 發送地址
+            self.serial_port.write(frame.address_packet if frame else self.encoder.address_packet(address))
+
+            # 等待ACK
+            self.set_timeout(6)
+            response = self.serial_port.read(1)
+            if len(response) == 0 or response[0] != ACK:
+                result = classify_response(response)
+                return False
+
+            # 發送數據長度、數據和校驗和
+            packet = frame.data_packet if frame else self.encoder.data_packet(data)
+            self.serial_port.write(packet)
+
+            # 等待最終ACK (包含編程時間)
+            self.set_timeout(len(packet) + 1, 0x31)
+            response = self.serial_port.read(1)
+            result = classify_response(response)
+            return result == "ack"
+
+        except Exception as e:
+            self.log_message(f"寫入塊錯誤: {str(e)}")
+            return False
+
+        finally:
+            self.end_command(0x31, mark, result, payload=len(data) if result == "ack" else 0)
+
+    def write_compressed_block(self, address, data, payload):
+        """以壓縮寫入命令寫入一個塊，返回 True/False，None 表示Bootloader不支援該命令"""
+        mark = self.begin_command()
+        result = "error"
+        try:
+            if not self.send_command(CMD_WRITE_COMPRESSED):
+                result = classify_response(self.last_response)
+                if result == "nack":
+                    self.session.commands[CMD_WRITE_COMPRESSED] = False
+                    return None
+                return False
+
+            self.serial_port.write(self.encoder.address_packet(address))
+
+            self.set_timeout(6)
+            response = self.serial_port.read(1)
+            if len(response) == 0 or response[0] != ACK:
+                result = classify_response(response)
+                return False
+
+            packet = self.encoder.compressed_packet(len(data), payload)
+            self.serial_port.write(packet)
+
+            # Bootloader解壓並編程後才回應
+            self.set_timeout(len(packet) + 1, CMD_WRITE_COMPRESSED)
+            response = self.serial_port.read(1)
+            result = classify_response(response)
+            return result == "ack"
+
+        except Exception as e:
+            self.log_message(f"壓縮寫入塊錯誤: {str(e)}")
+            return False
+
+        finally:
+            self.end_command(CMD_WRITE_COMPRESSED, mark, result, payload=len(data) if result == "ack" else 0)
+
+    def write_compressed(self, frames):
+        """把幀合併成塊後壓縮寫入
+
+        壓縮後沒有變小的塊改用0x31寫入；Bootloader拒絕壓縮命令時記錄為不支援，
+        該塊及之後的塊全部改用0x31。
+        """
+        compress_start = time.perf_counter()
+        blocks = [(address, block, compress_block(block))
+                  for address, block in join_frames(frames, COMPRESSED_BLOCK_SIZE)]
+        compress_time = time.perf_counter() - compress_start
+
+        raw_bytes = sum(len(block) for _, block, _ in blocks)
+        wire_bytes = 0
+        last_progress = -1
+        start_time = time.perf_counter()
+
+        for i, (address, block, payload) in enumerate(blocks):
+            ok = None
+            if self.session.supports(CMD_WRITE_COMPRESSED) is not False and len(payload) + 4 < len(block):
+                ok = self.retry_chunk(CMD_WRITE_COMPRESSED,
+                                      lambda: self.write_compressed_block(address, block, payload), address)
+                if ok is None and self.session.supports(CMD_WRITE_COMPRESSED) is False:
+                    self.log_message("Bootloader不支援壓縮寫入，改用0x31寫入")
+                elif ok is None:
+                    ok = False
+                elif ok:
+                    self.session.commands[CMD_WRITE_COMPRESSED] = True
+                    wire_bytes += len(payload) + 4
+
+            if ok is None:
+                # 不壓縮: 按256字節幀寫入
+                ok = all(self.retry_chunk(0x31, lambda: self.write_memory_chunk(chunk_addr, chunk), chunk_addr)
+                         for chunk_addr, chunk in split_frames([(address, block)]))
+                wire_bytes += len(block)
+
+            if not ok:
+                self.log_message(f"寫入失敗在地址 0x{address:08X}")
+                return False
+            self.note_written(address + len(block))
+
+            progress = (i + 1) * 100 // len(blocks)
+            if progress != last_progress:
+                last_progress = progress
+                self.set_progress(progress)
+                self.log_message(f"寫入進度: {progress}% ({i + 1}/{len(blocks)})")
+
+        elapsed = max(time.perf_counter() - start_time, 1e-6)
+        if raw_bytes:
+            self.log_message(f"壓縮傳輸: {raw_bytes} -> {wire_bytes} 字節 (壓縮比 x{raw_bytes / wire_bytes:.2f})，"
+                             f"壓縮耗時 {compress_time:.2f}s，有效速率 {raw_bytes / elapsed:.0f} 字節/秒")
+        return True
+
+    def drain_input(self, quiet_time=0.05):
+        """丟棄殘留的回應，直到線路安靜 quiet_time 秒"""
+        old_timeout = self.serial_port.timeout
+        self.serial_port.timeout = quiet_time
+        try:
+            while self.serial_port.read(256):
+                pass
+        finally:
+            self.serial_port.timeout = old_timeout
+
+    def write_memory_pipelined(self, frames, window=4, max_retries=CHUNK_RETRIES):
+        """滑動窗口寫入組裝好的幀：保持 window 個幀在途中，依序比對ACK流
+
+        每幀會收到3個ACK (命令、地址、數據)。已有回應到達時先處理再送出新的幀，
+        收到NACK或超時時不再送出，清空殘留回應並重新同步 (見 recover_link)，從第一個未確認的幀重新發送。
+        提前結束 (重試用盡或出錯) 時同樣重新同步，不把在途幀的ACK留給下一個命令。
+        注意: 數據校驗失敗的NACK之後在途的都是完整的幀 (會以相同數據寫入，重送時不改變Flash)；
+        幀中途的NACK則會讓該幀其餘的字節被當作命令解析，因此窗口限制在 MAX_WRITE_WINDOW 以內。
+        統計的RTT為幀送出到最後一個ACK，包含在窗口中排隊的時間；
+        超時估計則使用上一幀確認後到本幀確認的時間 (不含排隊)。
+        """
+        if window > MAX_WRITE_WINDOW:
+            self.log_message(f"管線寫入窗口 {window} 超過上限，改用 {MAX_WRITE_WINDOW}")
+            window = MAX_WRITE_WINDOW
+        total = len(frames)
+        acked = 0       # 第一個未完全確認的幀
+        next_idx = 0    # 下一個要發送的幀
+        ack_count = 0   # 目前幀已收到的ACK數
+        retries = 0
+        last_progress = -1
+        sent_at = {}    # 幀序號 -> 送出時間
+        last_done = 0.0  # 上一幀完全確認的時間
+        frame_bytes = max((len(frame.data) for frame in frames), default=0) + 8
+
+        try:
+            self.serial_port.reset_input_buffer()
+
+            while acked < total:
+                # 填滿窗口 (已有回應到達時先處理，其中可能是NACK)
+                while next_idx < total and next_idx - acked < window and not self.serial_port.in_waiting:
+                    sent_at[next_idx] = time.perf_counter()
+                    self.serial_port.write(self.encoder.write_frame(frames[next_idx]))
+                    next_idx += 1
+
+                self.set_timeout(frame_bytes + 3, 0x31)
+                response = self.serial_port.read(1)
+                if len(response) == 1 and response[0] == ACK:
+                    ack_count += 1
+                    if ack_count == 3:
+                        chunk = frames[acked].data
+                        now = time.perf_counter()
+                        start = sent_at.pop(acked)
+                        self.record_transaction(0x31, now - start, len(chunk) + 8, 3,
+                                                "ack", len(chunk), retries, sample=False)
+                        self.note_response_time(0x31, now - max(start, last_done), len(chunk) + 11, "ack")
+                        last_done = now
+                        ack_count = 0
+                        acked += 1
+                        retries = 0
+                        self.note_written(frames[acked - 1].address + len(chunk))
+                        progress = acked * 100 // total
+                        if progress != last_progress:
+                            last_progress = progress
+                            self.set_progress(progress)
+                            self.log_message(f"寫入進度: {progress}% ({acked}/{total})")
+                    continue
+
+                # NACK或超時：回退到第一個未確認的幀
+                chunk_addr, chunk = frames[acked].address, frames[acked].data
+                reason = f"NACK 0x{response[0]:02X}" if response else "超時"
+                self.record_transaction(0x31, time.perf_counter() - sent_at[acked], len(chunk) + 8,
+                                        ack_count + len(response), classify_response(response))
+                retries += 1
+                if retries > max_retries:
+                    self.log_message(f"寫入失敗在地址 0x{chunk_addr:08X} ({reason})")
+                    return False
+
+                self.log_message(f"幀 0x{chunk_addr:08X} {reason}，回退重送 ({retries}/{max_retries})")
+                next_idx = acked  # 在途的幀已由 recover_link 清空
+                if not self.recover_link(retries - 1):
+                    self.log_message("重新同步失敗，Bootloader無回應")
+                    return False
+                if self.note_link_error():
+                    retries = 0
+                ack_count = 0
+                last_done = 0.0
+
+            return True
+
+        except Exception as e:
+            self.log_message(f"管線寫入錯誤: {str(e)}")
+            return False
+
+        finally:
+            if next_idx > acked:
+                # 清空在途幀的殘留ACK並確認Bootloader回到命令狀態
+                try:
+                    self.recover_link(0)
+                except Exception as e:
+                    self.log_message(f"管線寫入結束後重新同步失敗: {str(e)}")
+
+    def iter_read_memory(self, address, length, retries=CHUNK_RETRIES):
+        """逐塊讀取記憶體，每收到一塊就返回 (地址, 數據)
+
+        單塊失敗時重新同步後只重試該塊 (最多 retries 次)，仍失敗時拋出異常。
+        """
+        max_read_size = 256  # STM32 bootloader最大一次讀取256字節
+        remaining = length
+        current_addr = address
+
+        while remaining > 0:
+            # 計算本次讀取大小
+            read_size = min(remaining, max_read_size)
+            data = self.retry_chunk(0x11, lambda: self.read_memory_chunk(current_addr, read_size - 1),
+                                    current_addr, retries)
+            if data is None:
+                raise Exception(f"讀取失敗 @ 0x{current_addr:08X}")
+
+            yield current_addr, data
+            current_addr += read_size
+            remaining -= read_size
+
+    def iter_read_pipelined(self, frames, window=4, max_retries=CHUNK_RETRIES):
+        """管線讀取 [(地址, 長度)]：保持 window 個讀取請求在途中，每收到一塊就返回 (地址, 數據)
+
+        每個請求會收到3個ACK (命令、地址、長度) 和數據。收到NACK或數據不完整時
+        清空在途請求的殘留回應、重新同步，從失敗的塊重新請求；同一塊失敗超過
+        max_retries 次時拋出異常。提前結束 (例如比對失敗) 時清空在途請求的殘留回應。
+        """
+        done = 0
+        next_idx = 0
+        sent_at = {}
+        last_done = 0.0
+        retries = 0
+        try:
+            self.serial_port.reset_input_buffer()
+
+            while done < len(frames):
+                # 填滿窗口
+                while next_idx < len(frames) and next_idx - done < window:
+                    sent_at[next_idx] = time.perf_counter()
+                    self.serial_port.write(self.encoder.read_request(*frames[next_idx]))
+                    next_idx += 1
+
+                chunk_addr, length = frames[done]
+                self.set_timeout(length + 11, 0x11)
+                response = self.serial_port.read(3)
+                if response == bytes([ACK, ACK, ACK]):
+                    data = self.serial_port.read(length)
+                    now = time.perf_counter()
+                    result = "ack" if len(data) == length else "timeout"
+                    self.record_transaction(0x11, now - sent_at[done], 8, 3 + len(data), result,
+                                            len(data), retries, sample=False)
+                    self.note_response_time(0x11, now - max(sent_at[done], last_done), 11 + len(data), result)
+                    last_done = now
+                    if result == "ack":
+                        done += 1
+                        retries = 0
+                        yield chunk_addr, data
+                        continue
+                    reason = "數據不完整"
+                else:
+                    result = "nack" if any(b != ACK for b in response) else "timeout"
+                    self.record_transaction(0x11, time.perf_counter() - sent_at[done], 8, len(response), result)
+                    reason = "NACK" if result == "nack" else "未收到ACK"
+
+                # 從失敗的塊重新請求
+                retries += 1
+                if retries > max_retries:
+                    raise Exception(f"讀取失敗 @ 0x{chunk_addr:08X} ({reason})")
+                self.log_message(f"讀取 0x{chunk_addr:08X} {reason}，重新同步後重試 ({retries}/{max_retries})")
+                if not self.recover_link(retries - 1):
+                    raise Exception(f"重新同步失敗 @ 0x{chunk_addr:08X}")
+                self.note_link_error()
+                next_idx = done
+                last_done = 0.0
+
+        finally:
+            if next_idx > done:
+                self.drain_input()
+
+    def read_memory(self, address, length, retries=CHUNK_RETRIES):
+        """讀取記憶體 - 可重用的函數 (retries 為每塊的重試次數)"""
+        try:
+            all_data = bytearray()
+            for _, data in self.iter_read_memory(address, length, retries):
+                all_data.extend(data)
+            return all_data
+
+        except Exception as e:
+            self.log_message(f"讀取錯誤: {str(e)}")
+            return None
+
+    def dump_memory(self, address, length, path):
+        """將記憶體邊讀邊寫入文件 (.bin/.hex/.srec)，不在記憶體中累積整段數據"""
+        self.log_message(f"開始轉存 0x{address:08X} 起 {length} 字節到 {path}")
+        start_time = time.time()
+        done = 0
+        last_step = -1
+
+        try:
+            f, writer = open_writer(path, address)
+            with f:
+                for chunk_addr, data in self.iter_read_memory(address, length):
+                    writer.write(chunk_addr, data)
+                    done += len(data)
+                    progress = done * 100 // length
+                    self.set_progress(progress)
+                    if progress // 10 != last_step:
+                        last_step = progress // 10
+                        self.log_message(f"轉存進度: {progress}% ({done}/{length})")
+                writer.close()
+
+        except Exception as e:
+            self.log_message(f"轉存錯誤: {str(e)}")
+            return False
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        self.log_message(f"轉存完成，{done} 字節，耗時 {elapsed:.2f}s，速率 {done / elapsed:.0f} 字節/秒")
+        return True
+
+    def read_memory_chunk(self, address, length):
+        """讀取單個記憶體塊 (length 為 N-1 格式)，返回數據 (失敗返回None)"""
+        mark = self.begin_command()
+        result = "error"
+        try:
+            # 發送讀取命令
+            if not self.send_command(0x11):  # CMD_READ_MEMORY
+                result = classify_response(self.last_response)
+                return None
+
+            # 發送地址
+            self.serial_port.write(self.encoder.address_packet(address))
+
+            # 等待ACK
+            self.set_timeout(6)
+            response = self.serial_port.read(1)
+            if len(response) == 0 or response[0] != ACK:
+                result = classify_response(response)
+                return None
+
+            # 發送長度
+            self.serial_port.write(self.encoder.length_packet(length + 1))
+
+            # 等待ACK
+            self.set_timeout(3)
+            response = self.serial_port.read(1)
+            if len(response) == 0 or response[0] != ACK:
+                result = classify_response(response)
+                return None
+
+            # 讀取數據
+            self.set_timeout(length + 1, 0x11)
+            data = self.serial_port.read(length + 1)
+            if len(data) == length + 1:
+                result = "ack"
+                return data
+            else:
+                result = "timeout"
+                return None
+
+        except Exception as e:
+            self.log_message(f"讀取塊錯誤: {str(e)}")
+            return None
+
+        finally:
+            self.end_command(0x11, mark, result, payload=length + 1 if result == "ack" else 0)
+
+    def crc_memory(self, address, length):
+        """由Bootloader計算Flash區間的CRC (見 CMD_CRC)，返回CRC值 (失敗返回None)
+
+        尚未確認支援時Bootloader以NACK拒絕命令: NACK也可能來自雜訊或先前失步殘留的字節，
+        重新同步後再發送一次，在乾淨的鏈路上仍被NACK才記錄為不支援。
+        """
+        mark = self.begin_command()
+        result = "error"
+        try:
+            if not self.send_command(CMD_CRC):
+                result = classify_response(self.last_response)
+                if result != "nack" or self.session.supports(CMD_CRC) is not None:
+                    return None
+                if not self.recover_link(0):
+                    return None
+                if not self.send_command(CMD_CRC):
+                    result = classify_response(self.last_response)
+                    if result == "nack":
+                        self.session.commands[CMD_CRC] = False
+                    return None
+
+            self.serial_port.write(self.encoder.address_packet(address))
+
+            self.set_timeout(6)
+            response = self.serial_port.read(1)
+            if len(response) == 0 or response[0] != ACK:
+                result = classify_response(response)
+                return None
+
+            # 長度與地址的格式相同 (4字節大端序 + 校驗和)
+            self.serial_port.write(self.encoder.address_packet(length))
+
+            # Bootloader讀完整個區間才回應
+            self.set_timeout(6 + 6, CMD_CRC, length * CRC_TIME_PER_BYTE)
+            response = self.serial_port.read(1)
+            if len(response) == 0 or response[0] != ACK:
+                result = classify_response(response)
+                return None
+            payload = self.serial_port.read(5)
+            if len(payload) < 5:
+                result = "timeout"
+                return None
+            if xor_checksum(payload[:4]) != payload[4]:
+                return None
+            result = "ack"
+            self.session.commands[CMD_CRC] = True
+            return int.from_bytes(payload[:4], 'big')
+
+        except Exception as e:
+            self.log_message(f"CRC命令錯誤: {str(e)}")
+            return None
+
+        finally:
+            self.end_command(CMD_CRC, mark, result)
+
+    def verify_image(self, address, data, window=4):
+        """比對連續映像 (見 verify_segments)"""
+        return self.verify_segments([(address, data)], window)
+
+    def verify_segments(self, segments, window=4, readback=False):
+        """比對稀疏映像：Bootloader支援CRC命令時每個段只需一次往返 (見 verify_crc)，
+        舊版Bootloader或 readback 為True時回讀比對 (見 verify_readback)
+        """
+        if not readback and self.session.supports(CMD_CRC) is not False:
+            result = self.verify_crc(segments, window)
+            if result is not None:
+                return result
+            self.log_message("Bootloader不支援CRC命令，改用回讀比對")
+        return self.verify_readback(segments, window)
+
+    def verify_crc(self, segments, window=4):
+        """以Bootloader計算的CRC比對每個段，返回 True/False，None 表示Bootloader不支援CRC命令
+
+        CRC不符時以二分法縮小到 CRC_MIN_REGION 字節，再回讀找出第一個不一致的地址。
+        """
+        total_size = sum(len(data) for _, data in segments)
+        suffix = f" ({len(segments)} 個段)" if len(segments) > 1 else ""
+        self.log_message(f"開始CRC驗證 {total_size} 字節 @ 0x{segments[0][0]:08X}{suffix}")
+
+        start_time = time.time()
+        start_retries = self.metrics.total_retries()
+        done = 0
+        for address, data in segments:
+            crc = self.retry_chunk(CMD_CRC, lambda: self.crc_memory(address, len(data)), address)
+            if crc is None and self.session.supports(CMD_CRC) is False:
+                return None
+            if crc is None:
+                self.log_message(f"驗證失敗: 0x{address:08X} 的CRC命令無回應")
+                return False
+            if crc != stm32_crc32(data):
+                located = self.locate_crc_mismatch(address, data)
+                if located is not None:
+                    return located
+                # 縮小後的區塊回讀一致: 以回讀比對整個段為準
+                self.log_message(f"0x{address:08X} CRC不符但定位時回讀一致，改以回讀比對該段")
+                if not self.verify_readback([(address, data)], window):
+                    return False
+            done += len(data)
+            self.set_progress(done * 100 // total_size)
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        retries = self.metrics.total_retries() - start_retries
+        self.log_message(f"CRC驗證通過 ({len(segments)} 個區間)，耗時 {elapsed:.2f}s，"
+                         f"速率 {total_size / elapsed:.0f} 字節/秒{f'，重試 {retries} 次' if retries else ''}")
+        return True
+
+    def locate_crc_mismatch(self, address, data):
+        """二分CRC不符的區間直到不大於 CRC_MIN_REGION 字節後回讀，報告第一個不一致的地址
+
+        返回 False (已定位或通訊失敗)，None 表示回讀結果一致。
+        """
+        while len(data) > CRC_MIN_REGION:
+            half = -(-len(data) // 2 // CRC_MIN_REGION) * CRC_MIN_REGION
+            crc = self.retry_chunk(CMD_CRC, lambda: self.crc_memory(address, half), address)
+            if crc is None:
+                self.log_message(f"驗證失敗: 0x{address:08X} 的CRC命令無回應")
+                return False
+            if crc == stm32_crc32(data[:half]):
+                address, data = address + half, data[half:]
+            else:
+                data = data[:half]
+
+        actual = self.read_memory(address, len(data))
+        if actual is None:
+            self.log_message(f"驗證讀取失敗 @ 0x{address:08X}")
+            return False
+        for j, (a, b) in enumerate(zip(actual, data)):
+            if a != b:
+                self.log_message(f"驗證失敗 @ 0x{address + j:08X}: 讀到 0x{a:02X}，應為 0x{b:02X}")
+                return False
+        return None
+
+    def verify_readback(self, segments, window=4):
+        """回讀比對稀疏映像：管線讀取，邊收邊比對，在第一個不一致的地址停止
+
+        管線讀取的數據沒有校驗，回應丟失字節時缺口會被下一個請求的回應補上，
+        因此不一致的塊先以停等讀取重讀確認，確實不同才判定失敗。
+        """
+        frames = split_frames(segments)
+        total_size = sum(len(data) for _, data in segments)
+        suffix = f" ({len(segments)} 個段)" if len(segments) > 1 else ""
+        self.log_message(f"開始驗證 {total_size} 字節 @ 0x{segments[0][0]:08X}{suffix}")
+
+        start_time = time.time()
+        start_retries = self.metrics.total_retries()
+        last_step = -1
+        done = 0
+        while done < len(frames):
+            reads = self.iter_read_pipelined([(chunk_addr, len(chunk)) for chunk_addr, chunk in frames[done:]],
+                                             max(1, window))
+            try:
+                for (chunk_addr, actual), (_, expected) in zip(reads, frames[done:]):
+                    if actual != expected:
+                        break
+                    done += 1
+                    progress = done * 100 // len(frames)
+                    self.set_progress(progress)
+                    if progress // 10 != last_step:
+                        last_step = progress // 10
+                        self.log_message(f"驗證進度: {progress}% ({done}/{len(frames)})")
+
+            except Exception as e:
+                self.log_message(f"驗證讀取失敗: {str(e)}")
+                return False
+
+            finally:
+                reads.close()
+
+            if done == len(frames):
+                break
+
+            chunk_addr, expected = frames[done]
+            actual = self.read_memory(chunk_addr, len(expected))
+            if actual is None:
+                self.log_message(f"驗證讀取失敗 @ 0x{chunk_addr:08X}")
+                return False
+            if actual != expected:
+                for j, (a, b) in enumerate(zip(actual, expected)):
+                    if a != b:
+                        self.log_message(f"驗證失敗 @ 0x{chunk_addr + j:08X}: "
+                                         f"讀到 0x{a:02X}，應為 0x{b:02X}")
+                        return False
+            self.metrics.add_retry(0x11)
+            self.log_message(f"0x{chunk_addr:08X} 重讀後一致 (管線回應有誤)，繼續驗證")
+            done += 1
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        retries = self.metrics.total_retries() - start_retries
+        self.log_message(f"驗證通過，耗時 {elapsed:.2f}s，速率 {total_size / elapsed:.0f} 字節/秒"
+                         f"{f'，重試 {retries} 次' if retries else ''}")
+        return True
+
+    def jump_to_app(self, address=APP_START_ADDRESS):
+        """跳轉到應用程序"""
+        mark = self.begin_command()
+        try:
+            self.log_message("正在跳轉到APP...")
+
+            # 發送Go命令
+            if not self.send_command(0x21):  # CMD_GO
+                self.log_message("發送Go命令失敗")
+                self.end_command(0x21, mark, classify_response(self.last_response))
+                return False
+
+            # 發送APP起始地址 (大端序) 和校驗和
+            self.serial_port.write(self.encoder.address_packet(address))
+            self.end_command(0x21, mark, "ack")
+
+            self.log_message("跳轉命令發送成功！")
+            return True
+
+        except Exception as e:
+            self.log_message(f"跳轉失敗: {str(e)}")
+            return False
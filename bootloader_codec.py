@@ -0,0 +1,111 @@
+"""壓縮寫入使用的塊壓縮格式 (LZ4 block 格式，Bootloader端解壓只需幾十行C)
+
+每個序列: token (高4位字面量長度，低4位匹配長度-4)，長度為15時後接擴展字節
+(每個255累加，直到小於255的字節)，字面量，2字節小端偏移，匹配長度擴展。
+最後一個序列只有字面量；最後5個字節一定是字面量。
+"""
+
+MIN_MATCH = 4
+LAST_LITERALS = 5   # 塊尾必須保留的字面量字節數
+MATCH_LIMIT = 12    # 距塊尾小於此值不再開始匹配
+MAX_OFFSET = 0xFFFF
+
+
+def write_length(out, length):
+    """輸出長度擴展字節 (token中的4位已經是15)"""
+    while length >= 255:
+        out.append(255)
+        length -= 255
+    out.append(length)
+
+
+def compress_block(data):
+    """壓縮一個塊 (貪婪匹配，以4字節內容為鍵的雜湊表)"""
+    data = bytes(data)
+    size = len(data)
+    out = bytearray()
+    table = {}
+    anchor = 0
+    pos = 0
+
+    while pos < size - MATCH_LIMIT:
+        key = data[pos:pos + MIN_MATCH]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is None or pos - candidate > MAX_OFFSET:
+            pos += 1
+            continue
+
+        length = MIN_MATCH
+        max_length = size - LAST_LITERALS - pos
+        while length < max_length and data[candidate + length] == data[pos + length]:
+            length += 1
+
+        literal_length = pos - anchor
+        match_code = length - MIN_MATCH
+        out.append((min(literal_length, 15) << 4) | min(match_code, 15))
+        if literal_length >= 15:
+            write_length(out, literal_length - 15)
+        out += data[anchor:pos]
+        out += (pos - candidate).to_bytes(2, 'little')
+        if match_code >= 15:
+            write_length(out, match_code - 15)
+
+        pos += length
+        anchor = pos
+
+    # 最後的字面量
+    literal_length = size - anchor
+    out.append(min(literal_length, 15) << 4)
+    if literal_length >= 15:
+        write_length(out, literal_length - 15)
+    out += data[anchor:]
+    return bytes(out)
+
+
+def read_length(src, i, length):
+    """讀取長度擴展字節，返回 (長度, 新位置)"""
+    if length == 15:
+        while True:
+            b = src[i]
+            i += 1
+            length += b
+            if b != 255:
+                break
+    return length, i
+
+
+def decompress_block(src, raw_length):
+    """參考解壓器 (模擬器使用)；格式錯誤時拋出 ValueError"""
+    out = bytearray()
+    i = 0
+    try:
+        while i < len(src):
+            token = src[i]
+            i += 1
+            literal_length, i = read_length(src, i, token >> 4)
+            out += src[i:i + literal_length]
+            i += literal_length
+            if i >= len(src):
+                break
+
+            offset = src[i] | (src[i + 1] << 8)
+            i += 2
+            if offset == 0 or offset > len(out):
+                raise ValueError(f"無效的匹配偏移 {offset}")
+            match_length, i = read_length(src, i, token & 0x0F)
+            match_length += MIN_MATCH
+
+            start = len(out) - offset
+            if offset >= match_length:
+                out += out[start:start + match_length]
+            else:
+                # 重疊複製 (重複模式)
+                for k in range(match_length):
+                    out.append(out[start + k])
+    except IndexError:
+        raise ValueError("壓縮數據被截斷")
+
+    if len(out) != raw_length:
+        raise ValueError(f"解壓長度 {len(out)} 與預期 {raw_length} 不符")
+    return bytes(out)
@@ -0,0 +1,289 @@
+"""命令幀編碼與預先組裝的寫入幀 (地址包、數據包、校驗和、空白截斷長度)
+
+FrameEncoder 在一個預先分配的緩衝區中就地組裝幀，每幀一次寫出。
+同一映像重複燒錄時，以幀內容的雜湊 (包含地址) 為鍵從快取取出組裝結果，
+發送前不再逐字節計算。快取在記憶體中按LRU保留，可選保存到磁碟目錄。
+"""
+import hashlib
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+FRAME_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".f411_bootloader_frames")
+FRAME_CACHE_SIZE = 8  # 記憶體中保留的映像數
+FRAME_FILE_MAGIC = b'F411FRM1'
+FRAME_RECORD = struct.Struct('>IHH')  # 地址, 數據長度, 空白截斷長度
+FRAME_BUFFER_SIZE = 2048  # 足以容納最大的壓縮寫入數據包
+ADDRESS = struct.Struct('>I')
+COMPRESSED_HEADER = struct.Struct('>HH')
+BIT_REVERSE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))  # 每個字節的位元反轉 (bytes.translate 用)
+
+CMD_READ_MEMORY = 0x11
+CMD_WRITE_MEMORY = 0x31
+
+
+def xor_checksum(data, initial=0):
+    """XOR校驗和：整塊轉成大整數後對半折疊，不逐字節循環"""
+    x = int.from_bytes(data, 'little')
+    shift = 4 << (len(data) - 1).bit_length()
+    while shift >= 8:
+        x ^= x >> shift
+        shift >>= 1
+    return (x ^ initial) & 0xFF
+
+
+def stm32_crc32(data):
+    """STM32硬體CRC單元的CRC32: 多項式0x04C11DB7、初值0xFFFFFFFF、不反轉、無最終異或，
+    按小端32位字輸入 (長度不是4的倍數時，最後一個字以0xFF補足)
+
+    等同於把每個字的字節順序倒過來、每個字節位元反轉後計算zlib的反射CRC32，
+    結果再整體位元反轉: 以切片、translate與zlib處理整塊數據，不逐字節循環。
+    """
+    data = bytes(data) + b'\xFF' * (-len(data) % 4)
+    swapped = bytearray(len(data))
+    for i in range(4):
+        swapped[i::4] = data[3 - i::4]
+    crc = zlib.crc32(swapped.translate(BIT_REVERSE)) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def address_checksum(address):
+    """4字節地址的XOR校驗和"""
+    x = address ^ (address >> 16)
+    return (x ^ (x >> 8)) & 0xFF
+
+
+def encode_address(address):
+    """地址包: 4字節大端序地址 + XOR校驗和"""
+    return ADDRESS.pack(address) + bytes([address_checksum(address)])
+
+
+def encode_data(data):
+    """寫入數據包: N-1 + 數據 + XOR校驗和"""
+    length = len(data) - 1
+    return bytes([length]) + data + bytes([xor_checksum(data, length)])
+
+
+class FrameEncoder:
+    """在預先分配的緩衝區中就地組裝命令幀，返回指向緩衝區的 memoryview
+
+    返回的 memoryview 在下一次編碼前有效，應立即寫出；每個客戶端各用一個編碼器。
+    """
+
+    def __init__(self, size=FRAME_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def put_address(self, pos, address):
+        ADDRESS.pack_into(self.buffer, pos, address)
+        self.buffer[pos + 4] = address_checksum(address)
+        return pos + 5
+
+    def put_data(self, pos, data):
+        length = len(data)
+        self.buffer[pos] = length - 1
+        self.buffer[pos + 1:pos + 1 + length] = data
+        self.buffer[pos + 1 + length] = xor_checksum(data, length - 1)
+        return pos + length + 2
+
+    def put_bytes(self, pos, data):
+        self.buffer[pos:pos + len(data)] = data
+        return pos + len(data)
+
+    def address_packet(self, address):
+        """地址 + 校驗和"""
+        return self.view[:self.put_address(0, address)]
+
+    def data_packet(self, data):
+        """寫入命令的 N-1 + 數據 + 校驗和"""
+        return self.view[:self.put_data(0, data)]
+
+    def length_packet(self, length):
+        """讀取命令的 N-1 + 補碼"""
+        self.buffer[0] = length - 1
+        self.buffer[1] = 0xFF ^ (length - 1)
+        return self.view[:2]
+
+    def erase_packet(self, sectors, extended):
+        """擦除命令的參數: 原有格式為 N + 補碼；擴展格式為 N-1 (2字節) + 扇區號 (各2字節) + 校驗和"""
+        count = len(sectors)
+        if not extended:
+            self.buffer[0] = count
+            self.buffer[1] = 0xFF ^ count
+            return self.view[:2]
+        end = 2 * (count + 1)
+        struct.pack_into(f'>{count + 1}H', self.buffer, 0, count - 1, *sectors)
+        self.buffer[end] = xor_checksum(self.view[:end])
+        return self.view[:end + 1]
+
+    def compressed_packet(self, raw_length, payload):
+        """壓縮寫入的 原始長度-1 + 壓縮長度-1 + 壓縮數據 + 校驗和"""
+        COMPRESSED_HEADER.pack_into(self.buffer, 0, raw_length - 1, len(payload) - 1)
+        end = self.put_bytes(4, payload)
+        self.buffer[end] = xor_checksum(payload, xor_checksum(self.view[:4]))
+        return self.view[:end + 1]
+
+    def write_frame(self, frame):
+        """完整的寫入幀 (命令 + 地址包 + 數據包)，複製組裝好的幀供管線模式一次送出"""
+        self.buffer[0] = CMD_WRITE_MEMORY
+        pos = self.put_bytes(1, frame.address_packet)
+        return self.view[:self.put_bytes(pos, frame.data_packet)]
+
+    def read_request(self, address, length):
+        """完整的讀取請求 (命令 + 地址包 + 長度)，供管線模式一次送出"""
+        self.buffer[0] = CMD_READ_MEMORY
+        pos = self.put_address(1, address)
+        self.buffer[pos] = length - 1
+        self.buffer[pos + 1] = 0xFF ^ (length - 1)
+        return self.view[:pos + 2]
+
+
+def get_blank_length(data):
+    """截去尾部0xFF後的長度 (保持4字節對齊，0表示整幀空白)"""
+    return (len(data.rstrip(b'\xFF')) + 3) & ~0x3
+
+
+class PreparedFrame:
+    """一個寫入幀的組裝結果；trimmed_packet 為截去尾部0xFF後的數據包 (沒有可截部分時為None)"""
+
+    __slots__ = ("address", "data", "address_packet", "data_packet", "blank_length", "trimmed_packet")
+
+    def __init__(self, address, data, address_packet, data_packet, blank_length, trimmed_packet=None):
+        self.address = address
+        self.data = data
+        self.address_packet = address_packet
+        self.data_packet = data_packet
+        self.blank_length = blank_length
+        self.trimmed_packet = trimmed_packet
+
+    def trimmed(self):
+        """返回截去尾部0xFF的幀 (用於已擦除的扇區)"""
+        if self.trimmed_packet is None:
+            return self
+        return PreparedFrame(self.address, self.data[:self.blank_length], self.address_packet,
+                             self.trimmed_packet, self.blank_length)
+
+
+def prepare_frame(address, data):
+    """組裝一個寫入幀"""
+    data = bytes(data)
+    blank_length = get_blank_length(data)
+    trimmed_packet = encode_data(data[:blank_length]) if 0 < blank_length < len(data) else None
+    return PreparedFrame(address, data, encode_address(address), encode_data(data), blank_length, trimmed_packet)
+
+
+def image_key(frames):
+    """以各幀地址、長度與內容計算快取鍵"""
+    digest = hashlib.sha256()
+    for address, data in frames:
+        digest.update(struct.pack('>II', address, len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def pack_frames(prepared):
+    """序列化為磁碟快取格式"""
+    parts = [FRAME_FILE_MAGIC, struct.pack('>I', len(prepared))]
+    for frame in prepared:
+        parts.append(FRAME_RECORD.pack(frame.address, len(frame.data), frame.blank_length))
+        parts += [frame.address_packet, frame.data_packet, frame.trimmed_packet or b'']
+    return b''.join(parts)
+
+
+def unpack_frames(blob):
+    """從磁碟快取格式還原 (格式錯誤時拋出 ValueError)"""
+    if blob[:len(FRAME_FILE_MAGIC)] != FRAME_FILE_MAGIC:
+        raise ValueError("幀快取格式錯誤")
+    pos = len(FRAME_FILE_MAGIC)
+    count, = struct.unpack_from('>I', blob, pos)
+    pos += 4
+
+    prepared = []
+    try:
+        for _ in range(count):
+            address, length, blank_length = FRAME_RECORD.unpack_from(blob, pos)
+            pos += FRAME_RECORD.size
+            address_packet = blob[pos:pos + 5]
+            data_packet = blob[pos + 5:pos + 5 + length + 2]
+            pos += 5 + length + 2
+            trimmed_packet = None
+            if 0 < blank_length < length:
+                trimmed_packet = blob[pos:pos + blank_length + 2]
+                pos += blank_length + 2
+            prepared.append(PreparedFrame(address, data_packet[1:-1], address_packet, data_packet,
+                                          blank_length, trimmed_packet))
+    except struct.error:
+        raise ValueError("幀快取被截斷")
+    if pos != len(blob):
+        raise ValueError("幀快取長度不符")
+    return prepared
+
+
+class FrameCache:
+    """以映像雜湊為鍵的組裝結果快取 (記憶體LRU，directory 不為None時同時保存到磁碟)
+
+    可被多個客戶端 (例如批量燒錄的各線程) 共用。
+    """
+
+    def __init__(self, max_entries=FRAME_CACHE_SIZE, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f"{key}.frames")
+
+    def prepare(self, frames):
+        """返回 (組裝好的幀列表, 來源)，來源為 "memory"、"disk" 或 None (本次組裝)"""
+        key = image_key(frames)
+        with self.lock:
+            prepared = self.entries.get(key)
+            if prepared is not None:
+                self.entries.move_to_end(key)
+                return prepared, "memory"
+
+        source = None
+        prepared = self.load(key) if self.directory else None
+        if prepared is not None:
+            source = "disk"
+        else:
+            prepared = [prepare_frame(address, data) for address, data in frames]
+            if self.directory:
+                self.save(key, prepared)
+
+        with self.lock:
+            self.entries[key] = prepared
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return prepared, source
+
+    def load(self, key):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                return unpack_frames(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, prepared):
+        """寫入臨時文件後替換，避免並行寫入時讀到半個文件"""
+        path = self.get_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(pack_frames(prepared))
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# 進程內共用的快取
+FRAME_CACHE = FrameCache()
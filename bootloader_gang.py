@@ -0,0 +1,170 @@
+"""批量燒錄：在多個串口上並行執行 擦除/寫入/驗證/跳轉
+
+用法示例:
+    python bootloader_gang.py app.bin --vid-pid 0483:5740
+    python bootloader_gang.py app.bin --ports COM3 COM4 COM5 --steps write,verify
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial.tools.list_ports
+
+from bootloader_client import BootloaderClient, APP_START_ADDRESS, MAX_WRITE_WINDOW
+from bootloader_image import load_image
+from bootloader_frames import FRAME_CACHE, FRAME_CACHE_DIR
+from bootloader_metrics import save_metrics
+
+GANG_STEPS = ("erase", "write", "verify", "go")
+
+
+def parse_vid_pid(text):
+    """解析 "0483:5740" 格式的VID:PID (PID可省略)"""
+    vid, _, pid = text.partition(':')
+    return int(vid, 16), int(pid, 16) if pid else None
+
+
+def find_ports(vid_pid=None):
+    """列出符合VID:PID過濾條件的串口名稱"""
+    vid, pid = parse_vid_pid(vid_pid) if vid_pid else (None, None)
+    ports = []
+    for port in serial.tools.list_ports.comports():
+        if vid is not None and port.vid != vid:
+            continue
+        if pid is not None and port.pid != pid:
+            continue
+        ports.append(port.device)
+    return sorted(ports)
+
+
+def flash_port(port, baud, segments, steps, window=0, blank_check=True, log=None, fast=False, compress=False):
+    """在單一串口上依序執行各步驟，返回結果字典 (跳轉到最低的段地址)"""
+    client = BootloaderClient(log=(lambda message: log(f"[{port}] {message}")) if log else None)
+    result = {"port": port, "ok": False, "failed_step": None, "elapsed": 0.0, "bytes": 0, "metrics": None}
+    start_time = time.time()
+
+    try:
+        client.connect(port, baud)
+    except Exception as e:
+        client.log_message(f"連接失敗: {str(e)}")
+        result["failed_step"] = "connect"
+        return result
+    finally:
+        result["metrics"] = client.metrics
+
+    try:
+        if fast:
+            client.escalate_baud()
+        for step in steps:
+            if step == "erase":
+                ok = client.erase_segments(segments, blank_check)
+            elif step == "write":
+                ok = client.write_segments(segments, window=window, compress=compress)
+                if ok:
+                    result["bytes"] = sum(len(data) for _, data in segments)
+            elif step == "verify":
+                ok = client.verify_segments(segments, window or 4)
+            elif step == "go":
+                ok = client.jump_to_app(segments[0][0])
+            else:
+                raise ValueError(f"未知步驟: {step}")
+
+            if not ok:
+                result["failed_step"] = step
+                return result
+
+        result["ok"] = True
+        return result
+
+    except Exception as e:
+        client.log_message(f"批量燒錄錯誤: {str(e)}")
+        result["failed_step"] = result["failed_step"] or "exception"
+        return result
+
+    finally:
+        result["elapsed"] = time.time() - start_time
+        client.disconnect()
+
+
+def console_log():
+    """返回多線程共用的終端日誌函數 (加鎖避免行內交錯)"""
+    lock = threading.Lock()
+
+    def log(message):
+        with lock:
+            print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+    return log
+
+
+def run_gang(ports, baud, segments, steps=GANG_STEPS, window=0, blank_check=True, log=None, fast=False,
+             compress=False):
+    """每個串口一個工作線程並行燒錄，結束後輸出每個串口的結果與總吞吐量"""
+    if log is None:
+        log = console_log()
+
+    if not ports:
+        log("沒有可用的串口")
+        return []
+
+    log(f"批量燒錄 {len(ports)} 個串口: {', '.join(ports)} (步驟: {', '.join(steps)})")
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        futures = [pool.submit(flash_port, port, baud, segments, steps, window, blank_check, log, fast, compress)
+                   for port in ports]
+        results = [future.result() for future in futures]
+
+    wall_time = max(time.time() - start_time, 1e-6)
+    total_bytes = sum(r["bytes"] for r in results)
+    passed = sum(1 for r in results if r["ok"])
+
+    log("批量燒錄結果:")
+    for r in results:
+        status = "通過" if r["ok"] else f"失敗 ({r['failed_step']})"
+        log(f"  {r['port']}: {status}, 耗時 {r['elapsed']:.2f}s")
+    log(f"通過 {passed}/{len(results)}，總耗時 {wall_time:.2f}s，"
+        f"總寫入吞吐量 {total_bytes / wall_time:.0f} 字節/秒")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="STM32 UART Bootloader 批量燒錄")
+    parser.add_argument('file', help="要寫入的固件文件 (bin/hex/srec/elf)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--ports', nargs='+', help="串口列表")
+    target.add_argument('--vid-pid', help="依VID:PID過濾串口 (例如 0483:5740)")
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    parser.add_argument('--address', type=lambda text: int(text, 0), default=APP_START_ADDRESS,
+                        help="二進位文件的載入地址")
+    parser.add_argument('--steps', default=','.join(GANG_STEPS), help="逗號分隔的步驟 (erase,write,verify,go)")
+    parser.add_argument('--window', type=int, default=0, choices=range(MAX_WRITE_WINDOW + 1), metavar="N",
+                        help=f"管線寫入窗口 (0 = 停等模式，最大 {MAX_WRITE_WINDOW})")
+    parser.add_argument('--no-blank-check', action='store_true', help="不跳過空白扇區")
+    parser.add_argument('--compress', action='store_true', help="壓縮傳輸 (Bootloader不支援時自動回退)")
+    parser.add_argument('--frame-cache', action='store_true', help=f"把組裝好的寫入幀快取到 {FRAME_CACHE_DIR}")
+    parser.add_argument('--fast', action='store_true', help="每個串口連接後協商更高的波特率")
+    parser.add_argument('--metrics', help="保存所有串口的命令統計 (.prom 為Prometheus格式，其他為JSON)")
+    args = parser.parse_args(argv)
+
+    steps = [step.strip() for step in args.steps.split(',') if step.strip()]
+    for step in steps:
+        if step not in GANG_STEPS:
+            parser.error(f"未知步驟: {step}")
+
+    ports = args.ports or find_ports(args.vid_pid)
+    segments = load_image(args.file, args.address)
+    if args.frame_cache:
+        FRAME_CACHE.directory = FRAME_CACHE_DIR
+
+    results = run_gang(ports, args.baud, segments, steps, args.window,
+                       blank_check=not args.no_blank_check, fast=args.fast, compress=args.compress)
+    if args.metrics and results:
+        save_metrics([r["metrics"] for r in results], args.metrics)
+    return 0 if results and all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""固件映像文件格式 (二進位 / Intel HEX / Motorola S-record / ELF)"""
+import os
+import struct
+
+
+def get_format(path):
+    """根據副檔名判斷格式，返回 'bin'、'hex' 或 'srec'"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.hex', '.ihex', '.ihx'):
+        return "hex"
+    if ext in ('.srec', '.s19', '.s28', '.s37', '.mot'):
+        return "srec"
+    return "bin"
+
+
+class BinWriter:
+    """原始二進位輸出 (數據必須連續)"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, address, data):
+        self.f.write(data)
+
+    def close(self):
+        pass
+
+
+class IntelHexWriter:
+    """Intel HEX 輸出：每行16字節，高16位地址變化時輸出擴展線性地址記錄"""
+
+    def __init__(self, f, bytes_per_line=16):
+        self.f = f
+        self.bytes_per_line = bytes_per_line
+        self.upper = None
+
+    def record(self, record_type, offset, payload):
+        body = bytes([len(payload), (offset >> 8) & 0xFF, offset & 0xFF, record_type]) + payload
+        checksum = (-sum(body)) & 0xFF
+        self.f.write(f":{body.hex().upper()}{checksum:02X}\n")
+
+    def write(self, address, data):
+        pos = 0
+        while pos < len(data):
+            line_addr = address + pos
+            # 一行不可跨越64KB邊界
+            size = min(self.bytes_per_line, len(data) - pos, 0x10000 - (line_addr & 0xFFFF))
+            if line_addr >> 16 != self.upper:
+                self.upper = line_addr >> 16
+                self.record(0x04, 0, self.upper.to_bytes(2, 'big'))
+            self.record(0x00, line_addr & 0xFFFF, bytes(data[pos:pos + size]))
+            pos += size
+
+    def close(self):
+        self.record(0x01, 0, b'')
+
+
+class SrecWriter:
+    """Motorola S-record 輸出 (S3 32位地址數據記錄，S7結束記錄)"""
+
+    def __init__(self, f, bytes_per_line=16, start_address=0):
+        self.f = f
+        self.bytes_per_line = bytes_per_line
+        self.start_address = start_address
+        self.record('0', 0, b'dump', 2)
+
+    def record(self, record_type, address, payload, address_size):
+        body = bytes([address_size + len(payload) + 1]) + address.to_bytes(address_size, 'big') + payload
+        checksum = ~sum(body) & 0xFF
+        self.f.write(f"S{record_type}{body.hex().upper()}{checksum:02X}\n")
+
+    def write(self, address, data):
+        for i in range(0, len(data), self.bytes_per_line):
+            self.record('3', address + i, bytes(data[i:i + self.bytes_per_line]), 4)
+
+    def close(self):
+        self.record('7', self.start_address, b'', 4)
+
+
+def open_writer(path, start_address=0):
+    """依副檔名打開對應的輸出器，返回 (文件對象, 輸出器)"""
+    fmt = get_format(path)
+    if fmt == "bin":
+        f = open(path, 'wb')
+        return f, BinWriter(f)
+
+    f = open(path, 'w', encoding='ascii', newline='\n')
+    if fmt == "hex":
+        return f, IntelHexWriter(f)
+    return f, SrecWriter(f, start_address=start_address)
+
+
+def parse_intel_hex(text):
+    """解析Intel HEX文本，返回 [(地址, 數據)] (未合併)"""
+    segments = []
+    upper = 0
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith(':'):
+            raise ValueError(f"HEX第{line_no}行格式錯誤")
+        record = bytes.fromhex(line[1:])
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise ValueError(f"HEX第{line_no}行長度錯誤")
+        if sum(record) & 0xFF:
+            raise ValueError(f"HEX第{line_no}行校驗和錯誤")
+
+        record_type = record[3]
+        offset = (record[1] << 8) | record[2]
+        payload = record[4:-1]
+        if record_type == 0x00:
+            segments.append((upper + offset, payload))
+        elif record_type == 0x01:
+            break
+        elif record_type == 0x02:
+            upper = int.from_bytes(payload, 'big') << 4   # 擴展段地址
+        elif record_type == 0x04:
+            upper = int.from_bytes(payload, 'big') << 16  # 擴展線性地址
+        # 0x03/0x05 為起始地址記錄，燒錄時不需要
+    return segments
+
+
+def parse_srec(text):
+    """解析Motorola S-record文本，返回 [(地址, 數據)] (未合併)"""
+    address_sizes = {'1': 2, '2': 3, '3': 4}
+    segments = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) < 4 or line[0] != 'S':
+            raise ValueError(f"S-record第{line_no}行格式錯誤")
+        record = bytes.fromhex(line[2:])
+        if len(record) != record[0] + 1:
+            raise ValueError(f"S-record第{line_no}行長度錯誤")
+        if (sum(record) & 0xFF) != 0xFF:
+            raise ValueError(f"S-record第{line_no}行校驗和錯誤")
+
+        size = address_sizes.get(line[1])
+        if size:
+            address = int.from_bytes(record[1:1 + size], 'big')
+            segments.append((address, record[1 + size:-1]))
+        # S0標頭、S5/S6計數、S7/S8/S9結束記錄不含數據
+    return segments
+
+
+def parse_elf(blob):
+    """讀取ELF32程序頭，返回所有PT_LOAD段 [(物理地址, 數據)]"""
+    if blob[:4] != b'\x7fELF':
+        raise ValueError("不是ELF文件")
+    if blob[4] != 1:
+        raise ValueError("只支援32位ELF")
+    endian = '<' if blob[5] == 1 else '>'
+
+    e_phoff, = struct.unpack_from(endian + 'I', blob, 28)
+    e_phentsize, e_phnum = struct.unpack_from(endian + 'HH', blob, 42)
+
+    segments = []
+    for i in range(e_phnum):
+        p_type, p_offset, p_vaddr, p_paddr, p_filesz = struct.unpack_from(
+            endian + 'IIIII', blob, e_phoff + i * e_phentsize)
+        if p_type == 1 and p_filesz:  # PT_LOAD，燒錄位置使用載入地址 (LMA)
+            segments.append((p_paddr, blob[p_offset:p_offset + p_filesz]))
+    return segments
+
+
+def merge_segments(segments):
+    """按地址排序並合併相鄰或重疊的段 (重疊部分以後出現的數據為準)"""
+    merged = []
+    for address, data in sorted(segments, key=lambda segment: segment[0]):
+        if merged and address <= merged[-1][0] + len(merged[-1][1]):
+            last_address, last_data = merged[-1]
+            offset = address - last_address
+            buffer = bytearray(last_data)
+            buffer[offset:offset + len(data)] = data
+            merged[-1] = (last_address, buffer)
+        else:
+            merged.append((address, bytearray(data)))
+    return [(address, bytes(data)) for address, data in merged]
+
+
+def load_image(path, base_address=0):
+    """讀取固件文件，返回合併後的稀疏段列表 [(地址, 數據)]
+
+    HEX/S-record/ELF 使用文件內的地址；二進位文件放在 base_address。
+    """
+    with open(path, 'rb') as f:
+        blob = f.read()
+
+    if blob[:4] == b'\x7fELF':
+        segments = parse_elf(blob)
+    elif get_format(path) == "hex":
+        segments = parse_intel_hex(blob.decode('ascii'))
+    elif get_format(path) == "srec":
+        segments = parse_srec(blob.decode('ascii'))
+    else:
+        segments = [(base_address, blob)]
+    return merge_segments(segments)
+
+
+def split_frames(segments, frame_size=256):
+    """把每個段切成不跨越 frame_size 對齊邊界的幀，段與段之間的空隙不填充"""
+    frames = []
+    for address, data in segments:
+        pos = 0
+        while pos < len(data):
+            frame_addr = address + pos
+            size = min(frame_size - (frame_addr % frame_size), len(data) - pos)
+            frames.append((frame_addr, data[pos:pos + size]))
+            pos += size
+    return frames
+
+
+def join_frames(frames, block_size=1024):
+    """把地址連續的幀重新合併成不跨越 block_size 對齊邊界的塊"""
+    blocks = []
+    for address, data in frames:
+        if blocks:
+            last_address, last_data = blocks[-1]
+            end = last_address + len(last_data)
+            if end == address and address % block_size and len(last_data) + len(data) <= block_size:
+                blocks[-1] = (last_address, last_data + data)
+                continue
+        blocks.append((address, data))
+    return blocks
@@ -0,0 +1,315 @@
+"""每個命令的延遲與吞吐量統計，可匯出為JSON或Prometheus文字格式
+
+percentile 與 format_table 供基準測試 (bootloader_bench.py) 與錄製分析 (bootloader_trace.py) 共用。
+"""
+import json
+import math
+import time
+
+OPCODE_NAMES = {
+    0x01: "GET_VERSION",
+    0x02: "GET_ID",
+    0x11: "READ",
+    0x21: "GO",
+    0x31: "WRITE",
+    0x44: "ERASE",
+    0xA0: "SET_BAUD",
+    0xA1: "WRITE_COMPRESSED",
+    0xA2: "CRC",
+}
+
+# RTT直方圖的桶上限 (秒)，最後一個桶為 +Inf
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+METRIC_PREFIX = "f411_bootloader"
+
+ACK = 0x79
+
+# 自適應超時 (RTO = SRTT + RTO_K * RTTVAR，與TCP的RTT估計方式相同)
+RTO_INITIAL = 0.5   # 該命令還沒有測量值時的超時 (秒)，慢速USB適配器也足夠
+RTO_MIN = 0.05      # 下限 (秒)，容納USB適配器的延遲計時器與系統排程抖動
+RTO_MAX = 2.0       # 上限 (秒)，不含退避
+RTO_K = 4
+RTT_ALPHA = 0.125   # SRTT 的新樣本權重
+RTT_BETA = 0.25     # RTTVAR 的新樣本權重
+RTO_BACKOFF_LIMIT = 8  # 連續超時後的最大退避倍數
+
+
+def classify_response(response):
+    """把單字節回應分類為 ack / nack / timeout"""
+    if not response:
+        return "timeout"
+    return "ack" if response[0] == ACK else "nack"
+
+
+def percentile(samples, pct):
+    """最近秩分位數"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def format_table(results, columns=("name", "bytes", "bytes_per_s", "samples", "p50_ms", "p90_ms", "p99_ms", "max_ms")):
+    """格式化為文字表格 (延遲單位毫秒)"""
+    rows = [columns] + [tuple("-" if r[c] is None else str(r[c]) for c in columns) for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+class OpcodeStats:
+    """單一命令的累計統計"""
+
+    def __init__(self, opcode):
+        self.opcode = opcode
+        self.results = {"ack": 0, "nack": 0, "timeout": 0, "error": 0}
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.payload_bytes = 0
+        self.rtt_sum = 0.0
+        self.rtt_max = 0.0
+        self.buckets = [0] * (len(RTT_BUCKETS) + 1)
+
+    @property
+    def count(self):
+        return sum(self.results.values())
+
+    def add(self, rtt, sent, received, result, payload, retries):
+        self.results[result] += 1
+        self.retries += retries
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.payload_bytes += payload
+        self.rtt_sum += rtt
+        self.rtt_max = max(self.rtt_max, rtt)
+        for i, bound in enumerate(RTT_BUCKETS):
+            if rtt <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self):
+        count = self.count
+        return {
+            "opcode": f"0x{self.opcode:02X}",
+            "name": OPCODE_NAMES.get(self.opcode, "UNKNOWN"),
+            "count": count,
+            "results": dict(self.results),
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "payload_bytes": self.payload_bytes,
+            "rtt_avg_ms": round(self.rtt_sum * 1000 / count, 3) if count else None,
+            "rtt_max_ms": round(self.rtt_max * 1000, 3),
+            "rtt_histogram": {("+Inf" if i == len(RTT_BUCKETS) else str(RTT_BUCKETS[i])): n
+                              for i, n in enumerate(self.buckets)},
+        }
+
+
+class RttEstimator:
+    """單一命令的回應時間估計 (不含線路傳輸時間)，用來決定等待回應的超時
+
+    每次成功的交易以 add() 更新；超時後 back_off() 把超時加倍，
+    直到下一次成功為止，避免慢速鏈路被連續誤判。
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+
+    def add(self, sample):
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar += RTT_BETA * (abs(self.srtt - sample) - self.rttvar)
+            self.srtt += RTT_ALPHA * (sample - self.srtt)
+        self.backoff = 1
+
+    def back_off(self):
+        self.backoff = min(self.backoff * 2, RTO_BACKOFF_LIMIT)
+
+    def timeout(self):
+        """目前的超時 (秒)"""
+        if self.srtt is None:
+            rto = RTO_INITIAL
+        else:
+            rto = min(RTO_MAX, max(RTO_MIN, self.srtt + RTO_K * self.rttvar))
+        return rto * self.backoff
+
+
+class SessionMetrics:
+    """一次連接期間的命令統計與總計
+
+    record() 由客戶端在每個命令交易 (命令到最後一個ACK) 結束時調用；
+    線路總字節與等待回應的閒置時間由 MeteredSerial 累計。
+    """
+
+    def __init__(self, port=None, baud=None):
+        self.port = port
+        self.baud = baud
+        self.start_time = time.time()
+        self.start_clock = time.perf_counter()
+        self.opcodes = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.wait_time = 0.0  # 阻塞在讀取上等待回應的時間
+
+    def record(self, opcode, rtt, sent=0, received=0, result="ack", payload=0, retries=0):
+        stats = self.opcodes.get(opcode)
+        if stats is None:
+            stats = self.opcodes[opcode] = OpcodeStats(opcode)
+        stats.add(rtt, sent, received, result, payload, retries)
+
+    def add_retry(self, opcode, count=1):
+        """記錄未伴隨交易結果的重試 (例如管線回退重送)"""
+        stats = self.opcodes.get(opcode)
+        if stats is None:
+            stats = self.opcodes[opcode] = OpcodeStats(opcode)
+        stats.retries += count
+
+    def total_retries(self):
+        return sum(stats.retries for stats in self.opcodes.values())
+
+    def totals(self):
+        """會話總計: 有效吞吐量 (讀寫數據字節/秒) 與等待ACK的閒置時間"""
+        elapsed = max(time.perf_counter() - self.start_clock, 1e-6)
+        payload = sum(stats.payload_bytes for stats in self.opcodes.values())
+        return {
+            "elapsed": round(elapsed, 6),
+            "commands": sum(stats.count for stats in self.opcodes.values()),
+            "retries": self.total_retries(),
+            "payload_bytes": payload,
+            "effective_bytes_per_s": round(payload / elapsed, 1),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "ack_wait_time": round(self.wait_time, 6),
+            "ack_wait_share": round(self.wait_time / elapsed, 4),
+        }
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "baud": self.baud,
+            "start_time": self.start_time,
+            "totals": self.totals(),
+            "opcodes": [self.opcodes[opcode].to_dict() for opcode in sorted(self.opcodes)],
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def summary(self):
+        """單行摘要，供日誌輸出"""
+        totals = self.totals()
+        parts = [f"{OPCODE_NAMES.get(op, f'0x{op:02X}')} x{s.count}" for op, s in sorted(self.opcodes.items())]
+        retries = f", 重試 {totals['retries']} 次" if totals['retries'] else ""
+        return (f"{', '.join(parts) or '無命令'}{retries}; 有效速率 {totals['effective_bytes_per_s']:.0f} 字節/秒, "
+                f"等待ACK {totals['ack_wait_time']:.2f}s ({totals['ack_wait_share'] * 100:.0f}%)")
+
+
+def escape_label(value):
+    """Prometheus標籤值轉義"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(sessions):
+    """把一個或多個會話的統計轉成Prometheus文字格式 (以port標籤區分)"""
+    if isinstance(sessions, SessionMetrics):
+        sessions = [sessions]
+
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+    def sample(name, labels, value):
+        label_text = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+        lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+
+    def each_opcode():
+        for session in sessions:
+            for opcode in sorted(session.opcodes):
+                stats = session.opcodes[opcode]
+                yield stats, {"port": session.port or "", "opcode": f"0x{opcode:02X}",
+                              "name": OPCODE_NAMES.get(opcode, "UNKNOWN")}
+
+    header("command_rtt_seconds", "histogram", "Round-trip time from command byte to final ACK")
+    for stats, labels in each_opcode():
+        cumulative = 0
+        for i, count in enumerate(stats.buckets):
+            cumulative += count
+            le = "+Inf" if i == len(RTT_BUCKETS) else str(RTT_BUCKETS[i])
+            sample("command_rtt_seconds_bucket", dict(labels, le=le), cumulative)
+        sample("command_rtt_seconds_sum", labels, f"{stats.rtt_sum:.6f}")
+        sample("command_rtt_seconds_count", labels, stats.count)
+
+    header("commands_total", "counter", "Commands by result (ack, nack, timeout, error)")
+    for stats, labels in each_opcode():
+        for result, count in stats.results.items():
+            sample("commands_total", dict(labels, result=result), count)
+
+    for name, attribute, help_text in (
+            ("command_retries_total", "retries", "Retried commands"),
+            ("command_bytes_sent_total", "bytes_sent", "Bytes sent for the command"),
+            ("command_bytes_received_total", "bytes_received", "Bytes received for the command"),
+            ("command_payload_bytes_total", "payload_bytes", "Flash data bytes written or read")):
+        header(name, "counter", help_text)
+        for stats, labels in each_opcode():
+            sample(name, labels, getattr(stats, attribute))
+
+    for name, key, kind, help_text in (
+            ("session_effective_bytes_per_second", "effective_bytes_per_s", "gauge",
+             "Flash data bytes per second over the session"),
+            ("session_ack_wait_seconds_total", "ack_wait_time", "counter",
+             "Time spent blocked waiting for responses"),
+            ("session_seconds", "elapsed", "gauge", "Session duration")):
+        header(name, kind, help_text)
+        for session in sessions:
+            sample(name, {"port": session.port or ""}, session.totals()[key])
+
+    header("session_baud", "gauge", "Current link baud rate")
+    for session in sessions:
+        if session.baud:
+            sample("session_baud", {"port": session.port or ""}, session.baud)
+
+    return "\n".join(lines) + "\n"
+
+
+def save_metrics(sessions, path):
+    """依副檔名保存統計 (.prom 為Prometheus文字格式，其他為JSON)"""
+    if isinstance(sessions, SessionMetrics):
+        sessions = [sessions]
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.prom'):
+            f.write(to_prometheus(sessions))
+        else:
+            data = sessions[0].to_dict() if len(sessions) == 1 else [s.to_dict() for s in sessions]
+            json.dump(data, f, indent=2)
+
+
+class MeteredSerial:
+    """包裝串口對象，累計線路字節數與阻塞在讀取上的時間，其他屬性直接轉發"""
+
+    def __init__(self, port, metrics):
+        object.__setattr__(self, "port_object", port)
+        object.__setattr__(self, "metrics", metrics)
+
+    def write(self, data):
+        self.metrics.bytes_sent += len(data)
+        return self.port_object.write(data)
+
+    def read(self, size=1):
+        start = time.perf_counter()
+        data = self.port_object.read(size)
+        self.metrics.wait_time += time.perf_counter() - start
+        self.metrics.bytes_received += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.port_object, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.port_object, name, value)
@@ -0,0 +1,303 @@
+"""產線燒錄配方：以JSON文件描述一塊板要燒錄的所有映像、擦除策略、驗證與跳轉，
+在一次連接中執行 (合併擦除扇區為一個擦除命令、按地址順序寫入、設備身份只握手一次)
+
+配方格式 (文件路徑相對於配方文件所在目錄，地址可寫成 "0x..." 字串):
+    {
+        "name": "F411 主板",
+        "chip_id": "0x0431",
+        "images": [
+            {"file": "app.bin", "address": "0x08008000"},
+            {"file": "calibration.hex", "name": "校準"},
+            {"file": "config.bin", "address": "0x08060000"}
+        ],
+        "erase": "auto",
+        "erase_sectors": [6],
+        "window": 4,
+        "compress": false,
+        "verify": true,
+        "go": true
+    }
+
+erase: "auto" 擦除映像涉及的扇區 (跳過已空白的扇區)、"force" 同上但不做空白檢查、
+"all" 擦除整個應用程序區域、"none" 不擦除；erase_sectors 為另外要擦除的扇區 (例如清除舊配置)。
+go: true 跳轉到第一個映像的起始地址，也可直接指定地址；false 不跳轉。
+chip_id (可選): 芯片ID不符時不燒錄。
+
+用法示例:
+    python bootloader_recipe.py board.json --check
+    python bootloader_recipe.py board.json -p COM3
+    python bootloader_recipe.py board.json -p COM3 --repeat
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from bootloader_client import (BootloaderClient, FLASH_SECTORS, APP_FIRST_SECTOR, APP_START_ADDRESS, FLASH_END,
+                               MAX_WRITE_WINDOW)
+from bootloader_image import load_image, merge_segments
+from bootloader_metrics import save_metrics
+
+ERASE_POLICIES = ("auto", "force", "all", "none")
+RECIPE_KEYS = {"name", "chip_id", "images", "erase", "erase_sectors", "window", "compress", "verify", "go"}
+IMAGE_KEYS = {"file", "address", "name"}
+
+
+def parse_address(value, what):
+    """配方中的地址可以是整數或 "0x..." 字串"""
+    if isinstance(value, bool):
+        raise ValueError(f"{what} 格式錯誤: {value}")
+    if isinstance(value, int):
+        return value
+    try:
+        return int(str(value), 0)
+    except ValueError:
+        raise ValueError(f"{what} 格式錯誤: {value}")
+
+
+class RecipePlan:
+    """配方展開後的燒錄計劃
+
+    images 為 [(名稱, 段列表)]；segments 為合併後按地址排序的全部段；
+    erase_ranges 為要擦除的 (地址, 長度) 列表 (空列表表示不擦除)。
+    """
+
+    def __init__(self, name, images, erase_ranges, blank_check, window, compress, verify, go_address, chip_id):
+        self.name = name
+        self.images = images
+        self.segments = merge_segments([segment for _, segments in images for segment in segments])
+        self.erase_ranges = erase_ranges
+        self.blank_check = blank_check
+        self.window = window
+        self.compress = compress
+        self.verify = verify
+        self.go_address = go_address
+        self.chip_id = chip_id
+
+    @property
+    def total_bytes(self):
+        return sum(len(data) for _, data in self.segments)
+
+    def steps(self):
+        """依計劃實際要執行的步驟"""
+        return [step for step, enabled in (("erase", bool(self.erase_ranges)), ("write", True),
+                                           ("verify", self.verify), ("go", self.go_address is not None))
+                if enabled]
+
+    def describe(self):
+        """計劃的文字描述 (每行一項)"""
+        lines = [f"配方: {self.name} ({len(self.images)} 個映像，共 {self.total_bytes} 字節)"]
+        for name, segments in self.images:
+            for address, data in segments:
+                lines.append(f"  {name}: 0x{address:08X}-0x{address + len(data) - 1:08X} ({len(data)} 字節)")
+        sectors = sorted({index for address, length in self.erase_ranges
+                          for index, (start, size) in enumerate(FLASH_SECTORS)
+                          if start < address + length and address < start + size})
+        lines.append(f"  擦除扇區: {', '.join(map(str, sectors)) or '無'}"
+                     f"{' (跳過空白扇區)' if sectors and self.blank_check else ''}")
+        lines.append(f"  寫入: {len(self.segments)} 個段，{'管線窗口 ' + str(self.window) if self.window else '停等'}"
+                     f"{'，壓縮傳輸' if self.compress else ''}")
+        lines.append(f"  步驟: {', '.join(self.steps())}"
+                     f"{f' (跳轉到 0x{self.go_address:08X})' if self.go_address is not None else ''}")
+        if self.chip_id is not None:
+            lines.append(f"  芯片ID: 0x{self.chip_id:04X}")
+        return lines
+
+
+def check_overlap(images):
+    """不同映像的段不可重疊 (同一映像內的段已合併)"""
+    spans = sorted((address, address + len(data), name) for name, segments in images for address, data in segments)
+    for (_, prev_end, prev_name), (address, _, name) in zip(spans, spans[1:]):
+        if address < prev_end:
+            raise ValueError(f"映像 {prev_name} 與 {name} 在 0x{address:08X} 重疊")
+
+
+def build_plan(recipe, base_dir="."):
+    """把配方字典展開為燒錄計劃 (讀取所有映像文件)，格式錯誤時拋出 ValueError"""
+    unknown = set(recipe) - RECIPE_KEYS
+    if unknown:
+        raise ValueError(f"配方中有未知的欄位: {', '.join(sorted(unknown))}")
+    if not recipe.get("images"):
+        raise ValueError("配方沒有任何映像")
+
+    images = []
+    for i, entry in enumerate(recipe["images"]):
+        unknown = set(entry) - IMAGE_KEYS
+        if unknown or "file" not in entry:
+            raise ValueError(f"第 {i + 1} 個映像格式錯誤 (需要 file，可選 address、name)")
+        path = os.path.join(base_dir, entry["file"])
+        address = parse_address(entry.get("address", APP_START_ADDRESS), f"映像 {entry['file']} 的地址")
+        segments = load_image(path, address)
+        if not segments:
+            raise ValueError(f"映像 {entry['file']} 沒有任何數據")
+        for seg_addr, data in segments:
+            if seg_addr < APP_START_ADDRESS or seg_addr + len(data) > FLASH_END:
+                raise ValueError(f"映像 {entry['file']} 的 0x{seg_addr:08X}-0x{seg_addr + len(data) - 1:08X} "
+                                 f"超出應用程序區域")
+        images.append((entry.get("name", entry["file"]), segments))
+    check_overlap(images)
+
+    policy = recipe.get("erase", "auto")
+    if policy not in ERASE_POLICIES:
+        raise ValueError(f"未知的擦除策略: {policy} (可用: {', '.join(ERASE_POLICIES)})")
+    if policy == "all":
+        erase_ranges = [(APP_START_ADDRESS, FLASH_END - APP_START_ADDRESS)]
+    elif policy == "none":
+        erase_ranges = []
+    else:
+        erase_ranges = [(address, len(data)) for _, segments in images for address, data in segments]
+    for sector in recipe.get("erase_sectors", []):
+        if not isinstance(sector, int) or not APP_FIRST_SECTOR <= sector < len(FLASH_SECTORS):
+            raise ValueError(f"扇區 {sector} 不在應用程序區域 ({APP_FIRST_SECTOR}-{len(FLASH_SECTORS) - 1})")
+        if policy != "all":
+            erase_ranges.append(FLASH_SECTORS[sector])
+
+    go = recipe.get("go", True)
+    if go is True:
+        go_address = images[0][1][0][0]
+    elif go is False or go is None:
+        go_address = None
+    else:
+        go_address = parse_address(go, "跳轉地址")
+
+    window = recipe.get("window", 0)
+    if not isinstance(window, int) or isinstance(window, bool) or not 0 <= window <= MAX_WRITE_WINDOW:
+        raise ValueError(f"管線寫入窗口 {window!r} 不在 0-{MAX_WRITE_WINDOW} 範圍內")
+
+    chip_id = recipe.get("chip_id")
+    return RecipePlan(recipe.get("name", "未命名"), images, erase_ranges, policy == "auto",
+                      window, bool(recipe.get("compress", False)),
+                      bool(recipe.get("verify", True)), go_address,
+                      None if chip_id is None else parse_address(chip_id, "芯片ID"))
+
+
+def load_recipe(path):
+    """讀取配方文件並展開為燒錄計劃 (映像路徑相對於配方文件)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            recipe = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"配方不是有效的JSON: {e}")
+    if not isinstance(recipe, dict):
+        raise ValueError("配方頂層必須是物件")
+    return build_plan(recipe, os.path.dirname(os.path.abspath(path)))
+
+
+def run_plan(client, plan):
+    """在已連接的客戶端上執行計劃，返回結果字典 (各步驟耗時與總耗時)
+
+    設備身份只在開始時確認一次，之後各步驟沿用會話快取；所有擦除合併成一個擦除命令，
+    所有映像合併後按地址順序一次寫入與驗證。
+    """
+    result = {"ok": False, "failed_step": None, "steps": {}, "elapsed": 0.0, "bytes": 0}
+    start_time = time.perf_counter()
+
+    def timed(step, func, *args, **kwargs):
+        step_start = time.perf_counter()
+        ok = func(*args, **kwargs)
+        result["steps"][step] = time.perf_counter() - step_start
+        if not ok:
+            result["failed_step"] = step
+        return ok
+
+    try:
+        chip_id = timed("identify", client.get_chip_id)
+        if chip_id is None:
+            return result
+        if plan.chip_id is not None and chip_id != plan.chip_id:
+            client.log_message(f"芯片ID 0x{chip_id:04X} 與配方要求的 0x{plan.chip_id:04X} 不符，不燒錄")
+            result["failed_step"] = "identify"
+            return result
+
+        if plan.erase_ranges and not timed("erase", client.erase_ranges, plan.erase_ranges, plan.blank_check):
+            return result
+        if not timed("write", client.write_segments, plan.segments, window=plan.window, compress=plan.compress):
+            return result
+        result["bytes"] = plan.total_bytes
+        if plan.verify and not timed("verify", client.verify_segments, plan.segments, plan.window or 4):
+            return result
+        if plan.go_address is not None and not timed("go", client.jump_to_app, plan.go_address):
+            return result
+
+        result["ok"] = True
+        return result
+
+    except Exception as e:
+        client.log_message(f"執行配方錯誤: {str(e)}")
+        result["failed_step"] = result["failed_step"] or "exception"
+        return result
+
+    finally:
+        result["elapsed"] = time.perf_counter() - start_time
+        steps = ", ".join(f"{step} {elapsed:.2f}s" for step, elapsed in result["steps"].items())
+        status = "完成" if result["ok"] else f"失敗 ({result['failed_step']})"
+        client.log_message(f"配方 {plan.name} {status}: {steps}; 單元總耗時 {result['elapsed']:.2f}s")
+
+
+def flash_unit(port, baud, plan, log=None, fast=False):
+    """連接、執行計劃並斷開，返回 (結果字典, 命令統計)"""
+    client = BootloaderClient(log=log)
+    try:
+        client.connect(port, baud)
+    except Exception as e:
+        client.log_message(f"連接失敗: {str(e)}")
+        return {"ok": False, "failed_step": "connect", "steps": {}, "elapsed": 0.0, "bytes": 0}, client.metrics
+
+    try:
+        if fast:
+            client.escalate_baud()
+        return run_plan(client, plan), client.metrics
+    finally:
+        client.disconnect()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="STM32 UART Bootloader 產線燒錄配方")
+    parser.add_argument('recipe', help="配方文件 (JSON)")
+    parser.add_argument('-p', '--port', help="串口名稱 (例如 COM3 或 /dev/ttyUSB0)")
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    parser.add_argument('--fast', action='store_true', help="連接後協商更高的波特率")
+    parser.add_argument('--check', action='store_true', help="只檢查配方並顯示燒錄計劃，不連接設備")
+    parser.add_argument('--repeat', action='store_true', help="每塊板完成後按Enter繼續燒錄下一塊")
+    parser.add_argument('--metrics', help="保存命令統計 (.prom 為Prometheus格式，其他為JSON)")
+    args = parser.parse_args(argv)
+
+    try:
+        plan = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        print(f"配方錯誤: {e}", file=sys.stderr)
+        return 2
+    for line in plan.describe():
+        print(line)
+    if args.check:
+        return 0
+    if not args.port:
+        parser.error("需要 -p/--port (或使用 --check)")
+
+    sessions = []
+    passed = failed = 0
+    try:
+        while True:
+            result, metrics = flash_unit(args.port, args.baud, plan, fast=args.fast)
+            sessions.append(metrics)
+            if result["ok"]:
+                passed += 1
+            else:
+                failed += 1
+            if not args.repeat:
+                break
+            print(f"累計 通過 {passed} / 失敗 {failed}；按Enter燒錄下一塊板，Ctrl+C 結束", flush=True)
+            input()
+    except (KeyboardInterrupt, EOFError):
+        pass
+
+    if args.metrics and sessions:
+        save_metrics(sessions, args.metrics)
+    if args.repeat:
+        print(f"結束: 通過 {passed}，失敗 {failed}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,477 @@
+"""軟體模擬的STM32F411自定義Bootloader (無需開發板即可測試與量測傳輸性能)
+
+支援 0x01 GET_VERSION、0x02 GET_ID、0x11 讀取 (Flash與96位唯一ID)、0x31 寫入、0x44 擦除、
+0x21 GO、0xA0 變更波特率、0xA1 壓縮寫入 (以參考解壓器解碼) 以及 0xA2 區間CRC，
+使用XOR校驗和與 ACK 0x79 / NACK 0x1F 應答。
+
+兩種連接方式:
+    1. 進程內: 串口名稱使用 "sim://名稱?選項"，BootloaderClient.connect 會自動建立
+       SimulatedSerial (同一進程內同名的模擬器共用Flash內容)，例如
+       python bootloader_cli.py -p "sim://board1?erase_time=0.05" write app.bin
+    2. pty (僅限Linux/macOS): python bootloader_sim.py --byte-time 0.0001
+       啟動後打印從端路徑 (例如 /dev/pts/5)，可直接給GUI或CLI使用。
+
+選項: byte_time (每字節線路時間，預設依波特率 10/baud)、erase_time (每16KB擦除秒數)、
+program_time (每字節編程秒數)、nack_rate / drop_rate (隨機NACK與丟棄回應字節的機率)、seed、
+compressed / crc / extended_erase (0 = 模擬不支援壓縮寫入 / CRC命令 / 擴展擦除格式的舊版Bootloader)、
+uid (24位十六進位的唯一ID，預設由名稱推算，同名的模擬器視為同一塊板)。
+"""
+import argparse
+import hashlib
+import os
+import random
+import select
+import struct
+import sys
+import time
+import urllib.parse
+from collections import deque
+
+from bootloader_client import (FLASH_SECTORS, APP_FIRST_SECTOR, APP_START_ADDRESS, FLASH_END, ACK, CMD_SET_BAUD,
+                               CMD_WRITE_COMPRESSED, COMPRESSED_BLOCK_SIZE, CMD_CRC,
+                               DEVICE_UID_ADDRESS, DEVICE_UID_LENGTH)
+from bootloader_codec import decompress_block
+
+NACK = 0x1F
+FLASH_BASE = FLASH_SECTORS[0][0]
+SIM_CHIP_ID = 0x00000431  # STM32F411
+SIM_VERSION = 0x10        # v1.0
+SIM_MAX_BAUD = 2000000
+SIM_CRC_TIME = 1e-8       # CRC單元每字節的計算時間 (秒，約100MB/s)
+CRC_POLYNOMIAL = 0x04C11DB7
+
+
+def make_crc_table():
+    """高位先移入的CRC32查表 (每個字節一項)"""
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC_POLYNOMIAL if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = make_crc_table()
+
+
+def compressed_header_ok(header):
+    """壓縮寫入表頭的原始長度與壓縮長度都不超過解壓緩衝區"""
+    return (header[0] << 8 | header[1]) < COMPRESSED_BLOCK_SIZE and (header[2] << 8 | header[3]) < COMPRESSED_BLOCK_SIZE
+
+
+# 各階段還需要接收的字節數 (擦除與寫入取決於已收到的長度字節；壓縮表頭的長度超出緩衝區時立即結束並NACK)
+STAGE_LENGTHS = {
+    "address": lambda buffer: 5,
+    "read_length": lambda buffer: 2,
+    "write_data": lambda buffer: buffer[0] + 3 if buffer else 1,
+    "erase": lambda buffer: (2 if len(buffer) < 2 or buffer[0] else 2 + 2 * (buffer[1] + 1) + 1),
+    "legacy_erase": lambda buffer: 2,
+    "baud": lambda buffer: 5,
+    "crc_length": lambda buffer: 5,
+    "compressed_data": lambda buffer: (4 if len(buffer) < 4 or not compressed_header_ok(buffer)
+                                       else 4 + ((buffer[2] << 8) | buffer[3]) + 1 + 1),
+}
+
+SIM_OPTIONS = {
+    "byte_time": float,
+    "erase_time": float,
+    "program_time": float,
+    "nack_rate": float,
+    "drop_rate": float,
+    "seed": int,
+    "compressed": int,
+    "crc": int,
+    "extended_erase": int,
+    "uid": bytes.fromhex,
+}
+
+SIM_DEVICES = {}  # 進程內模擬器 (依URL名稱共用)
+
+
+class SimulatedBootloader:
+    """Bootloader狀態機與線路時序模型
+
+    receive() 記錄每個字節到達的模擬時間，回應字節依線路速度排隊，
+    take() 只取出在指定時間前已經 "傳到" 主機端的字節。
+    """
+
+    def __init__(self, baud=115200, byte_time=None, erase_time=0.25, program_time=4e-6,
+                 nack_rate=0.0, drop_rate=0.0, seed=None, compressed=1, crc=1, extended_erase=1,
+                 uid=None):
+        self.flash = bytearray(b'\xFF' * (FLASH_END - FLASH_BASE))
+        self.uid = bytes(uid) if uid else os.urandom(DEVICE_UID_LENGTH)
+        self.auto_byte_time = byte_time is None
+        self.byte_time = 10.0 / baud if byte_time is None else byte_time
+        self.erase_time = erase_time
+        self.program_time = program_time
+        self.nack_rate = nack_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.nack_addresses = set()  # 指定地址的寫入回應NACK一次
+        self.compressed = bool(compressed)
+        self.crc = bool(crc)
+        self.extended_erase = bool(extended_erase)
+
+        self.stage = None
+        self.command = None
+        self.buffer = bytearray()
+        self.address = None
+        self.jumped_to = None
+
+        self.rx_line = 0.0      # 主機->設備 線路空閒時間
+        self.tx_line = 0.0      # 設備->主機 線路空閒時間
+        self.busy_until = 0.0   # 擦除/編程中，處理延後
+        self.pending = deque()  # [(到達主機的時間, 字節)]
+        self.injected = {"nack": 0, "drop": 0}
+
+    def set_baud(self, baud):
+        """變更線路速度 (byte_time 由波特率推算時才生效)"""
+        if self.auto_byte_time:
+            self.byte_time = 10.0 / baud
+
+    def receive(self, data, now):
+        """主機寫入的字節依線路速度陸續到達並處理"""
+        for b in data:
+            self.rx_line = max(now, self.rx_line) + self.byte_time
+            self.handle_byte(b, max(self.rx_line, self.busy_until))
+
+    def respond(self, data, at):
+        """把回應字節排入設備->主機線路 (可能被錯誤注入丟棄)"""
+        for b in data:
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                self.injected["drop"] += 1
+                continue
+            self.tx_line = max(at, self.tx_line) + self.byte_time
+            self.pending.append((self.tx_line, b))
+
+    def inject_nack(self, address=None):
+        """依設定的機率或指定地址決定是否注入NACK"""
+        if address in self.nack_addresses:
+            self.nack_addresses.discard(address)
+        elif not (self.nack_rate and self.random.random() < self.nack_rate):
+            return False
+        self.injected["nack"] += 1
+        return True
+
+    def take(self, size, now):
+        """取出最多 size 個在 now 之前已到達主機的字節"""
+        out = bytearray()
+        while self.pending and len(out) < size and self.pending[0][0] <= now:
+            out.append(self.pending.popleft()[1])
+        return bytes(out)
+
+    def ready_at(self, count):
+        """第 count 個待送字節 (不足時為最後一個) 到達主機的時間，沒有待送字節時返回None"""
+        if not self.pending:
+            return None
+        return self.pending[min(count, len(self.pending)) - 1][0]
+
+    def waiting(self, now):
+        """已到達主機但尚未讀取的字節數"""
+        count = 0
+        for t, _ in self.pending:
+            if t > now:
+                break
+            count += 1
+        return count
+
+    def discard(self, now):
+        """丟棄已到達主機的字節 (reset_input_buffer)"""
+        while self.pending and self.pending[0][0] <= now:
+            self.pending.popleft()
+
+    def handle_byte(self, b, t):
+        """處理在模擬時間 t 收到的一個字節"""
+        if self.jumped_to is not None:
+            return  # 已跳轉到應用程序，Bootloader不再回應
+
+        if self.stage is None:
+            self.start_command(b, t)
+            return
+
+        self.buffer.append(b)
+        if len(self.buffer) < STAGE_LENGTHS[self.stage](self.buffer):
+            return
+
+        frame = bytes(self.buffer)
+        self.buffer.clear()
+        stage = self.stage
+        self.stage = None
+        getattr(self, f"on_{stage}")(frame, t)
+
+    def start_command(self, command, t):
+        if command == 0x01:    # GET_VERSION
+            self.respond(bytes([ACK, SIM_VERSION, ACK]), t)
+        elif command == 0x02:  # GET_ID
+            self.respond(bytes([ACK]) + struct.pack('>I', SIM_CHIP_ID) + bytes([ACK]), t)
+        elif command in (0x11, 0x31, 0x21) or (command == CMD_WRITE_COMPRESSED and self.compressed) or \
+                (command == CMD_CRC and self.crc):
+            self.command = command
+            self.stage = "address"
+            self.respond(bytes([ACK]), t)
+        elif command == 0x44:
+            # 舊版Bootloader只認識 [N, 0xFF^N]: 收到2字節即回應，擴展格式其餘的字節會被當作命令解析
+            self.stage = "erase" if self.extended_erase else "legacy_erase"
+            self.respond(bytes([ACK]), t)
+        elif command == CMD_SET_BAUD:
+            self.stage = "baud"
+            self.respond(bytes([ACK]), t)
+        else:
+            self.respond(bytes([NACK]), t)
+
+    def on_address(self, frame, t):
+        address = int.from_bytes(frame[:4], 'big')
+        in_uid = self.command == 0x11 and DEVICE_UID_ADDRESS <= address < DEVICE_UID_ADDRESS + len(self.uid)
+        if xor(frame[:4]) != frame[4] or not (FLASH_BASE <= address < FLASH_END or in_uid):
+            self.respond(bytes([NACK]), t)
+            return
+        if self.command in (0x31, CMD_WRITE_COMPRESSED) and address < APP_START_ADDRESS:
+            self.respond(bytes([NACK]), t)  # 保護Bootloader所在扇區
+            return
+
+        self.address = address
+        self.respond(bytes([ACK]), t)
+        if self.command == 0x11:
+            self.stage = "read_length"
+        elif self.command == 0x31:
+            self.stage = "write_data"
+        elif self.command == CMD_WRITE_COMPRESSED:
+            self.stage = "compressed_data"
+        elif self.command == CMD_CRC:
+            self.stage = "crc_length"
+        else:
+            self.jumped_to = address
+
+    def on_read_length(self, frame, t):
+        length = frame[0] + 1
+        if self.address >= FLASH_END:
+            memory, offset = self.uid, self.address - DEVICE_UID_ADDRESS
+        else:
+            memory, offset = self.flash, self.address - FLASH_BASE
+        if frame[0] ^ 0xFF != frame[1] or offset + length > len(memory) or self.inject_nack():
+            self.respond(bytes([NACK]), t)
+            return
+        self.respond(bytes([ACK]) + memory[offset:offset + length], t)
+
+    def on_write_data(self, frame, t):
+        data = frame[1:-1]
+        offset = self.address - FLASH_BASE
+        if xor(frame[:-1]) != frame[-1] or self.address + len(data) > FLASH_END or self.inject_nack(self.address):
+            self.respond(bytes([NACK]), t)
+            return
+
+        # Flash編程只能把1變成0
+        for i, b in enumerate(data):
+            self.flash[offset + i] &= b
+        self.busy_until = t + len(data) * self.program_time
+        self.respond(bytes([ACK]), self.busy_until)
+
+    def on_compressed_data(self, frame, t):
+        raw_length = ((frame[0] << 8) | frame[1]) + 1
+        if not compressed_header_ok(frame) or xor(frame[:-1]) != frame[-1] or \
+                self.address + raw_length > FLASH_END or self.inject_nack(self.address):
+            self.respond(bytes([NACK]), t)
+            return
+        try:
+            data = decompress_block(frame[4:-1], raw_length)
+        except ValueError:
+            self.respond(bytes([NACK]), t)
+            return
+
+        offset = self.address - FLASH_BASE
+        for i, b in enumerate(data):
+            self.flash[offset + i] &= b
+        self.busy_until = t + len(data) * self.program_time
+        self.respond(bytes([ACK]), self.busy_until)
+
+    def on_crc_length(self, frame, t):
+        length = int.from_bytes(frame[:4], 'big')
+        if xor(frame[:4]) != frame[4] or not 0 < length <= FLASH_END - self.address:
+            self.respond(bytes([NACK]), t)
+            return
+        offset = self.address - FLASH_BASE
+        crc = crc32_words(self.flash[offset:offset + length]).to_bytes(4, 'big')
+        self.busy_until = t + length * SIM_CRC_TIME
+        self.respond(bytes([ACK]) + crc + bytes([xor(crc)]), self.busy_until)
+
+    def on_erase(self, frame, t):
+        if frame[0]:
+            # 原有格式: 從扇區2開始連續擦除N個扇區
+            if frame[0] ^ 0xFF != frame[1]:
+                self.respond(bytes([NACK]), t)
+                return
+            sectors = list(range(APP_FIRST_SECTOR, APP_FIRST_SECTOR + frame[0]))
+        else:
+            # 擴展格式: N-1 (2字節) + 扇區號 (各2字節) + 校驗和
+            if len(frame) < 3 or xor(frame[:-1]) != frame[-1]:
+                self.respond(bytes([NACK]), t)
+                return
+            count = struct.unpack_from('>H', frame, 0)[0] + 1
+            sectors = list(struct.unpack_from(f'>{count}H', frame, 2))
+
+        if any(s < APP_FIRST_SECTOR or s >= len(FLASH_SECTORS) for s in sectors):
+            self.respond(bytes([NACK]), t)
+            return
+
+        duration = 0.0
+        for sector in sectors:
+            sector_start, sector_size = FLASH_SECTORS[sector]
+            offset = sector_start - FLASH_BASE
+            self.flash[offset:offset + sector_size] = b'\xFF' * sector_size
+            duration += self.erase_time * sector_size / 0x4000
+        self.busy_until = t + duration
+        self.respond(bytes([ACK]), self.busy_until)
+
+    def on_legacy_erase(self, frame, t):
+        self.on_erase(frame, t)
+
+    def on_baud(self, frame, t):
+        baud = int.from_bytes(frame[:4], 'big')
+        if xor(frame[:4]) != frame[4] or baud > SIM_MAX_BAUD:
+            self.respond(bytes([NACK]), t)
+            return
+        # ACK以舊波特率送出，之後的字節使用新波特率
+        self.respond(bytes([ACK]), t)
+        self.set_baud(baud)
+
+
+def xor(data):
+    """XOR校驗和"""
+    checksum = 0
+    for b in data:
+        checksum ^= b
+    return checksum
+
+
+def crc32_words(data):
+    """參考實現: 與STM32 CRC單元相同，逐個32位字 (小端讀取、高位先移入) 計算，
+    長度不是4的倍數時最後一個字以0xFF補足"""
+    data = bytes(data) + b'\xFF' * (-len(data) % 4)
+    crc = 0xFFFFFFFF
+    for i in range(0, len(data), 4):
+        for b in (data[i + 3], data[i + 2], data[i + 1], data[i]):
+            crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ b]
+    return crc
+
+
+class SimulatedSerial:
+    """進程內的 serial.Serial 替代品，讀寫直接連到 SimulatedBootloader"""
+
+    def __init__(self, device, port="sim://", baudrate=115200, timeout=1):
+        self.device = device
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = None
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return self.device.waiting(time.perf_counter())
+
+    def write(self, data):
+        self.device.receive(bytes(data), time.perf_counter())
+        return len(data)
+
+    def read(self, size=1):
+        deadline = time.perf_counter() + (self.timeout if self.timeout is not None else 3600)
+        out = bytearray()
+        while True:
+            now = time.perf_counter()
+            out += self.device.take(size - len(out), now)
+            if len(out) >= size or now >= deadline:
+                return bytes(out)
+
+            # 睡到湊足所需字節 (或已排隊的最後一個字節) 到達，或超時
+            ready = self.device.ready_at(size - len(out))
+            wake = deadline if ready is None else min(ready, deadline)
+            if wake > now:
+                time.sleep(wake - now)
+
+    def reset_input_buffer(self):
+        self.device.discard(time.perf_counter())
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def parse_sim_url(url):
+    """解析 "sim://名稱?選項=值&..."，返回 (名稱, 選項字典)"""
+    parts = urllib.parse.urlsplit(url)
+    options = {}
+    for key, value in urllib.parse.parse_qsl(parts.query):
+        if key not in SIM_OPTIONS:
+            raise ValueError(f"未知的模擬器選項: {key}")
+        options[key] = SIM_OPTIONS[key](value)
+    return parts.netloc or "default", options
+
+
+def open_simulator(url, baud=115200, timeout=1):
+    """依URL取得 (或建立) 進程內模擬器，返回連接它的 SimulatedSerial"""
+    name, options = parse_sim_url(url)
+    device = SIM_DEVICES.get(name)
+    if device is None:
+        options.setdefault("uid", hashlib.sha256(name.encode()).digest()[:DEVICE_UID_LENGTH])
+        device = SIM_DEVICES[name] = SimulatedBootloader(baud=baud, **options)
+    else:
+        device.set_baud(baud)
+    return SimulatedSerial(device, url, baud, timeout)
+
+
+def serve_pty(device):
+    """建立pty並持續服務，直到按 Ctrl+C"""
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print(f"模擬Bootloader已就緒: {os.ttyname(slave)}", flush=True)
+
+    try:
+        while True:
+            now = time.perf_counter()
+            ready = device.take(len(device.pending), now)
+            if ready:
+                os.write(master, ready)
+
+            next_time = device.ready_at(1)
+            wait = None if next_time is None else max(0.0, next_time - now)
+            readable, _, _ = select.select([master], [], [], wait)
+            if readable:
+                device.receive(os.read(master, 4096), time.perf_counter())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="軟體模擬的STM32 UART Bootloader (pty)")
+    parser.add_argument('-b', '--baud', type=int, default=115200, help="推算線路時間用的波特率")
+    parser.add_argument('--byte-time', type=float, help="每字節線路時間 (秒，預設 10/baud)")
+    parser.add_argument('--erase-time', type=float, default=0.25, help="每16KB擦除時間 (秒)")
+    parser.add_argument('--program-time', type=float, default=4e-6, help="每字節編程時間 (秒)")
+    parser.add_argument('--nack-rate', type=float, default=0.0, help="讀寫隨機NACK的機率")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="回應字節隨機丟失的機率")
+    parser.add_argument('--seed', type=int, help="錯誤注入的隨機種子")
+    parser.add_argument('--no-compressed', action='store_true', help="模擬不支援壓縮寫入的舊版Bootloader")
+    parser.add_argument('--no-crc', action='store_true', help="模擬不支援CRC命令的舊版Bootloader")
+    parser.add_argument('--no-extended-erase', action='store_true', help="模擬只支援原有擦除格式的舊版Bootloader")
+    args = parser.parse_args(argv)
+
+    device = SimulatedBootloader(args.baud, args.byte_time, args.erase_time, args.program_time,
+                                 args.nack_rate, args.drop_rate, args.seed, not args.no_compressed, not args.no_crc,
+                                 not args.no_extended_erase)
+    serve_pty(device)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,678 @@
+"""串口線路錄製：以緊湊的二進位格式記錄每次收發的字節塊與高精度時間戳，
+並可依協議解碼標註、離線統計延遲，或對模擬器 (或實際設備) 依原時序重放
+
+錄製: BootloaderClient.connect(..., trace="session.trace") 或 bootloader_cli.py --trace session.trace。
+每次 write/read 記錄一筆 (讀取另記錄要求的字節數與阻塞時間)，
+波特率、讀取超時的變更與 reset_input_buffer 也會記錄，重放時依原樣套用。
+
+文件格式: TRACE_MAGIC + 版本 (1字節) + 開始時間 (double，epoch秒) + 波特率 (uint32)
++ 串口名稱 (uint16長度 + UTF-8)，之後每筆記錄為
+類型 (1字節) + 與上一筆的時間差 (納秒) + 內容，整數均為LEB128變長編碼:
+    TX      長度 + 數據
+    RX      阻塞時間 (納秒) + 要求的字節數 + 長度 + 數據
+    BAUD    波特率
+    TIMEOUT 讀取超時 (微秒，0 表示無限等待)
+    FLUSH   (無內容，清空接收緩衝區)
+
+用法示例:
+    python bootloader_trace.py show session.trace
+    python bootloader_trace.py show session.trace -v
+    python bootloader_trace.py stats session.trace
+    python bootloader_trace.py replay session.trace -p "sim://replay?erase_time=0.05"
+    python bootloader_trace.py compare baseline.trace session.trace
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+from collections import deque
+
+from bootloader_client import ACK, APP_FIRST_SECTOR, CMD_CRC, CMD_SET_BAUD, CMD_WRITE_COMPRESSED, open_port
+from bootloader_metrics import OPCODE_NAMES, percentile, format_table
+from bootloader_sim import NACK, STAGE_LENGTHS, xor
+
+TRACE_MAGIC = b"F411TRC"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('>dI')  # 開始時間, 波特率
+
+REC_TX = 0x01
+REC_RX = 0x02
+REC_BAUD = 0x03
+REC_TIMEOUT = 0x04
+REC_FLUSH = 0x05
+
+FILL_BYTE = 0xFF  # 重新同步時送出的填充 (見 BootloaderClient.recover_link)
+
+# 命令字節之後主機還要送出的幀 (幀長度規則與模擬器相同，見 STAGE_LENGTHS)
+COMMAND_FRAMES = {
+    0x11: ("address", "read_length"),
+    0x31: ("address", "write_data"),
+    0x21: ("address",),
+    0x44: ("erase",),
+    CMD_SET_BAUD: ("baud",),
+    CMD_WRITE_COMPRESSED: ("address", "compressed_data"),
+    CMD_CRC: ("address", "crc_length"),
+}
+
+# 只有命令字節的命令: 回應種類與字節數 (ACK + 內容 + ACK)
+QUERY_RESPONSES = {0x01: ("version", 3), 0x02: ("chip_id", 6)}
+
+HEX_PREVIEW = 16  # -v 顯示每塊數據的前幾個字節
+
+
+def pack_varint(value):
+    """LEB128無號變長整數"""
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def unpack_varint(data, pos):
+    """返回 (值, 下一個位置)；數據不完整時拋出 IndexError"""
+    value = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+class TraceWriter:
+    """把收發記錄寫入錄製文件 (緩衝寫入，時間戳為 perf_counter_ns)"""
+
+    def __init__(self, path, port="", baud=0):
+        self.file = open(path, 'wb')
+        self.last = time.perf_counter_ns()
+        name = (port or "").encode('utf-8')
+        self.file.write(TRACE_MAGIC + bytes([TRACE_VERSION]) + TRACE_HEADER.pack(time.time(), baud or 0)
+                        + struct.pack('>H', len(name)) + name)
+
+    def record(self, kind, at, body=b''):
+        self.file.write(bytes([kind]) + pack_varint(max(0, at - self.last)) + body)
+        self.last = max(self.last, at)
+
+    def tx(self, at, data):
+        self.record(REC_TX, at, pack_varint(len(data)) + data)
+
+    def rx(self, at, wait, requested, data):
+        self.record(REC_RX, at, pack_varint(wait) + pack_varint(requested) + pack_varint(len(data)) + data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class TracingSerial:
+    """包裝串口對象，把每次讀寫與設定變更記錄到 TraceWriter，其他屬性直接轉發"""
+
+    def __init__(self, port, writer):
+        object.__setattr__(self, "port_object", port)
+        object.__setattr__(self, "writer", writer)
+
+    def write(self, data):
+        data = bytes(data)  # 幀可能在預先分配的緩衝區中，之後會被覆寫
+        self.writer.tx(time.perf_counter_ns(), data)
+        return self.port_object.write(data)
+
+    def read(self, size=1):
+        start = time.perf_counter_ns()
+        data = self.port_object.read(size)
+        self.writer.rx(start, time.perf_counter_ns() - start, size, data)
+        return data
+
+    def reset_input_buffer(self):
+        self.port_object.reset_input_buffer()
+        self.writer.record(REC_FLUSH, time.perf_counter_ns())
+
+    def close(self):
+        try:
+            self.port_object.close()
+        finally:
+            self.writer.close()
+
+    def __getattr__(self, name):
+        return getattr(self.port_object, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.port_object, name, value)
+        if name == "baudrate":
+            self.writer.record(REC_BAUD, time.perf_counter_ns(), pack_varint(value))
+        elif name == "timeout":
+            micros = 0 if value is None else max(1, round(value * 1e6))
+            self.writer.record(REC_TIMEOUT, time.perf_counter_ns(), pack_varint(micros))
+
+
+class TraceEvent:
+    """一筆記錄 (time 為相對錄製開始的秒數；RX 的 time 為開始讀取的時間，wait 為阻塞時間)"""
+
+    __slots__ = ("kind", "time", "data", "wait", "requested", "value")
+
+    def __init__(self, kind, time, data=b'', wait=0.0, requested=0, value=None):
+        self.kind = kind
+        self.time = time
+        self.data = data
+        self.wait = wait
+        self.requested = requested
+        self.value = value
+
+    @property
+    def end(self):
+        return self.time + self.wait
+
+    @property
+    def short(self):
+        """讀取超時 (沒有收齊要求的字節數)"""
+        return self.kind == REC_RX and len(self.data) < self.requested
+
+
+class Trace:
+    """讀入的錄製文件"""
+
+    def __init__(self, port, baud, start_time, events, truncated=False):
+        self.port = port
+        self.baud = baud
+        self.start_time = start_time
+        self.events = events
+        self.truncated = truncated  # 錄製中斷，最後一筆記錄不完整
+
+    @property
+    def duration(self):
+        return self.events[-1].end if self.events else 0.0
+
+    def byte_counts(self):
+        """返回 (發送字節數, 接收字節數)"""
+        sent = sum(len(e.data) for e in self.events if e.kind == REC_TX)
+        received = sum(len(e.data) for e in self.events if e.kind == REC_RX)
+        return sent, received
+
+
+def read_trace(path):
+    """讀取錄製文件 (格式錯誤時拋出 ValueError，最後一筆不完整時忽略並設定 truncated)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    pos = len(TRACE_MAGIC) + 1 + TRACE_HEADER.size + 2
+    if len(data) < pos or not data.startswith(TRACE_MAGIC):
+        raise ValueError(f"不是錄製文件: {path}")
+    if data[len(TRACE_MAGIC)] != TRACE_VERSION:
+        raise ValueError(f"不支援的錄製格式版本: {data[len(TRACE_MAGIC)]}")
+    start_time, baud = TRACE_HEADER.unpack_from(data, len(TRACE_MAGIC) + 1)
+    name_length = struct.unpack_from('>H', data, pos - 2)[0]
+    port = data[pos:pos + name_length].decode('utf-8', 'replace')
+    pos += name_length
+
+    events = []
+    clock = 0
+    truncated = False
+    try:
+        while pos < len(data):
+            kind = data[pos]
+            delta, pos = unpack_varint(data, pos + 1)
+            clock += delta
+            at = clock / 1e9
+            if kind == REC_TX:
+                length, pos = unpack_varint(data, pos)
+                event = TraceEvent(kind, at, data[pos:pos + length])
+                pos += length
+            elif kind == REC_RX:
+                wait, pos = unpack_varint(data, pos)
+                requested, pos = unpack_varint(data, pos)
+                length, pos = unpack_varint(data, pos)
+                event = TraceEvent(kind, at, data[pos:pos + length], wait / 1e9, requested)
+                pos += length
+            elif kind == REC_BAUD:
+                value, pos = unpack_varint(data, pos)
+                event = TraceEvent(kind, at, value=value)
+            elif kind == REC_TIMEOUT:
+                value, pos = unpack_varint(data, pos)
+                event = TraceEvent(kind, at, value=value / 1e6 if value else None)
+            elif kind == REC_FLUSH:
+                event = TraceEvent(kind, at)
+            else:
+                raise ValueError(f"未知的記錄類型 0x{kind:02X} (偏移 {pos})")
+            if pos > len(data):
+                raise IndexError(pos)
+            events.append(event)
+    except IndexError:
+        truncated = True
+    return Trace(port, baud, start_time, events, truncated)
+
+
+class Transaction:
+    """一個命令交易：從命令字節到最後一個回應"""
+
+    def __init__(self, opcode, start):
+        self.opcode = opcode
+        self.start = start
+        self.end = None
+        self.result = None        # ack / nack / error / timeout，填充為 fill
+        self.address = None
+        self.length = None        # 讀寫的數據字節數
+        self.detail = ""
+        self.sent = 1
+        self.received = 0
+        self.frames_left = len(COMMAND_FRAMES.get(opcode, ()))
+        self.pending = 0          # 尚未收齊的回應數
+        self.sent_at = start      # 最後一幀送出的時間
+        self.response_time = None  # 最後一幀送出到收齊回應
+
+    @property
+    def name(self):
+        if self.opcode == FILL_BYTE:
+            return "FILL"
+        return OPCODE_NAMES.get(self.opcode, f"0x{self.opcode:02X}")
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def describe(self):
+        address = "" if self.address is None else f"0x{self.address:08X}"
+        length = "" if self.length is None else str(self.length)
+        response = "" if self.response_time is None else f"回應 {self.response_time * 1000:8.3f}ms"
+        duration = "" if self.duration is None else f"總計 {self.duration * 1000:8.3f}ms"
+        return (f"{self.start:11.6f}  {self.name:<16} {address:>10} {length:>5}  {self.result or '-':<7} "
+                f"{response:<15} {duration:<15} {self.detail}").rstrip()
+
+
+class Expected:
+    """一個尚未收齊的回應"""
+
+    def __init__(self, transaction, label, kind, size, sent_at):
+        self.transaction = transaction
+        self.label = label
+        self.kind = kind  # ack / data / version / chip_id
+        self.size = size
+        self.sent_at = sent_at
+        self.got = bytearray()
+
+
+class TraceDecoder:
+    """依協議把收發記錄還原為命令交易，並逐幀標註 (notes)
+
+    主機送出的字節依Bootloader的幀格式切分，收到的字節依序對應到尚未收齊的回應；
+    NACK 結束該命令。讀取超時後主機又送出數據、或清空接收緩衝區時，
+    放棄仍在等待的回應 (標記為 timeout)，未送完的幀也一併放棄。
+    """
+
+    def __init__(self):
+        self.transactions = []
+        self.notes = []  # (時間, 方向, 說明, 原始字節)
+        self.current = None
+        self.stage = None  # 主機正在送出的幀
+        self.stages = deque()
+        self.buffer = bytearray()
+        self.expected = deque()
+        self.gave_up = False
+        self.unexpected = 0  # 沒有對應命令的回應字節 (例如填充產生的NACK)
+
+    def note(self, at, direction, text, raw=b''):
+        self.notes.append((at, direction, text, bytes(raw)))
+
+    def feed(self, event):
+        if event.kind == REC_TX:
+            if self.gave_up:
+                self.abandon(event.time)
+            self.feed_tx(event.data, event.time)
+        elif event.kind == REC_RX:
+            if event.data:
+                self.feed_rx(event.data, event.end)
+            if event.short:
+                self.gave_up = True
+        elif event.kind == REC_FLUSH:
+            self.note(event.time, "--", "清空接收緩衝區")
+            self.abandon(event.time)
+        elif event.kind == REC_BAUD:
+            self.note(event.time, "--", f"波特率 {event.value}")
+
+    def abandon(self, at):
+        for expected in self.expected:
+            if expected.transaction.result is None:
+                expected.transaction.result = "timeout"
+                expected.transaction.end = at
+                self.note(at, "--", f"放棄等待 {expected.transaction.name} 的{expected.label}回應")
+        self.expected.clear()
+        self.stage = None
+        self.stages.clear()
+        self.buffer.clear()
+        self.gave_up = False
+
+    def expect(self, transaction, label, kind, size, at):
+        transaction.pending += 1
+        self.expected.append(Expected(transaction, label, kind, size, at))
+
+    def feed_tx(self, data, at):
+        pos = 0
+        while pos < len(data):
+            if self.stage is None:
+                if data[pos] == FILL_BYTE:
+                    end = pos
+                    while end < len(data) and data[end] == FILL_BYTE:
+                        end += 1
+                    self.add_fill(end - pos, at)
+                    pos = end
+                else:
+                    self.start_command(data[pos], at)
+                    pos += 1
+                continue
+
+            need = STAGE_LENGTHS[self.stage](self.buffer) - len(self.buffer)
+            self.buffer += data[pos:pos + need]
+            pos += need
+            if len(self.buffer) >= STAGE_LENGTHS[self.stage](self.buffer):
+                self.complete_frame(at)
+
+    def add_fill(self, count, at):
+        """連續的填充字節合併為一個交易 (Bootloader以NACK回應，不逐一對應)"""
+        if self.current is None or self.current.opcode != FILL_BYTE or self.expected:
+            self.current = Transaction(FILL_BYTE, at)
+            self.current.sent = 0
+            self.current.result = "fill"
+            self.transactions.append(self.current)
+        self.current.sent += count
+        self.current.end = at
+        self.current.detail = f"{self.current.sent} 字節"
+        self.note(at, "->", f"0xFF 填充 {count} 字節")
+
+    def start_command(self, opcode, at):
+        transaction = self.current = Transaction(opcode, at)
+        self.transactions.append(transaction)
+        if opcode in QUERY_RESPONSES:
+            kind, size = QUERY_RESPONSES[opcode]
+            self.expect(transaction, "命令", kind, size, at)
+        else:
+            self.expect(transaction, "命令", "ack", 1, at)
+            self.stages.extend(COMMAND_FRAMES.get(opcode, ()))
+            self.stage = self.stages.popleft() if self.stages else None
+        self.note(at, "->", f"{transaction.name} 命令", bytes([opcode]))
+
+    def complete_frame(self, at):
+        frame = bytes(self.buffer)
+        self.buffer.clear()
+        stage = self.stage
+        self.stage = self.stages.popleft() if self.stages else None
+        transaction = self.current
+        transaction.sent += len(frame)
+        transaction.sent_at = at
+        transaction.frames_left -= 1
+
+        label, kind, size = "數據", "ack", 1
+        if stage == "address":
+            transaction.address = int.from_bytes(frame[:4], 'big')
+            text = f"地址 0x{transaction.address:08X}"
+            label = "地址"
+            if xor(frame[:4]) != frame[4]:
+                text += " (校驗和錯誤)"
+        elif stage == "read_length":
+            transaction.length = frame[0] + 1
+            text = f"讀取長度 {transaction.length}"
+            kind, size = "data", 1 + transaction.length
+        elif stage == "write_data":
+            transaction.length = frame[0] + 1
+            text = f"寫入數據 {transaction.length} 字節"
+        elif stage == "compressed_data":
+            transaction.length = (frame[0] << 8 | frame[1]) + 1
+            compressed = (frame[2] << 8 | frame[3]) + 1
+            transaction.detail = f"壓縮 {compressed} 字節"
+            text = f"壓縮數據 {transaction.length} -> {compressed} 字節"
+        elif stage == "crc_length":
+            transaction.length = int.from_bytes(frame[:4], 'big')
+            text = f"CRC長度 {transaction.length}"
+            label, kind, size = "CRC", "crc", 6
+        elif stage == "erase":
+            if frame[0]:
+                sectors = list(range(APP_FIRST_SECTOR, APP_FIRST_SECTOR + frame[0]))
+            else:
+                count = struct.unpack_from('>H', frame, 0)[0] + 1
+                sectors = list(struct.unpack_from(f'>{count}H', frame, 2))
+            transaction.detail = f"扇區 {','.join(str(s) for s in sectors)}"
+            text = f"擦除{transaction.detail}"
+        else:
+            baud = int.from_bytes(frame[:4], 'big')
+            transaction.detail = f"{baud}"
+            text = f"波特率 {baud}"
+        self.expect(transaction, label, kind, size, at)
+        self.note(at, "->", text, frame)
+
+    def feed_rx(self, data, at):
+        pos = 0
+        while pos < len(data):
+            if not self.expected and self.current is not None and self.current.opcode == FILL_BYTE:
+                self.current.received += len(data) - pos
+                self.note(at, "<-", f"填充的回應 {len(data) - pos} 字節", data[pos:])
+                return
+            if not self.expected:
+                self.unexpected += len(data) - pos
+                self.note(at, "<-", f"未對應的回應 {len(data) - pos} 字節", data[pos:])
+                return
+
+            expected = self.expected[0]
+            if not expected.got and data[pos] != ACK:
+                # NACK (或無效回應) 結束該命令，Bootloader回到等待命令的狀態
+                self.finish(expected, "nack" if data[pos] == NACK else "error", data[pos:pos + 1], at)
+                pos += 1
+                if expected.transaction is self.current and not self.buffer:
+                    self.stage = None
+                    self.stages.clear()
+                continue
+
+            take = data[pos:pos + expected.size - len(expected.got)]
+            expected.got += take
+            pos += len(take)
+            if len(expected.got) == expected.size:
+                if expected.kind == "crc":
+                    ok = xor(expected.got[1:5]) == expected.got[5]
+                else:
+                    ok = expected.got[-1] == ACK or expected.kind == "data"
+                self.finish(expected, "ack" if ok else "error", expected.got, at)
+
+    def finish(self, expected, result, raw, at):
+        self.expected.popleft()
+        transaction = expected.transaction
+        transaction.pending -= 1
+        transaction.received += len(raw)
+
+        if result != "ack":
+            text = f"{'NACK' if result == 'nack' else f'無效回應 0x{raw[-1]:02X}'} ({expected.label})"
+        elif expected.kind == "data":
+            text = f"ACK + {len(raw) - 1} 字節數據"
+        elif expected.kind == "version":
+            transaction.detail = f"v{raw[1] / 16:.1f}"
+            text = f"版本 {transaction.detail}"
+        elif expected.kind == "crc":
+            transaction.detail = f"CRC 0x{int.from_bytes(raw[1:5], 'big'):08X}"
+            text = transaction.detail
+        elif expected.kind == "chip_id":
+            transaction.detail = f"0x{int.from_bytes(raw[1:5], 'big'):08X}"
+            text = f"芯片ID {transaction.detail}"
+        else:
+            text = f"ACK ({expected.label})"
+        self.note(at, "<-", f"{text}  {(at - expected.sent_at) * 1000:.3f}ms", raw)
+
+        if transaction.result is None and (result != "ack" or (transaction.frames_left <= 0
+                                                              and not transaction.pending)):
+            transaction.result = result
+            transaction.end = at
+            transaction.response_time = at - transaction.sent_at
+
+
+def decode_trace(trace):
+    """解碼整個錄製，返回 TraceDecoder"""
+    decoder = TraceDecoder()
+    for event in trace.events:
+        decoder.feed(event)
+    return decoder
+
+
+def analyze(trace):
+    """依命令統計回應時間與交易耗時 (毫秒)，以及主機端在兩個交易之間的處理時間"""
+    decoder = decode_trace(trace)
+    groups = {}
+    host_gaps = []
+    previous = None
+    for transaction in decoder.transactions:
+        if transaction.opcode != FILL_BYTE:
+            groups.setdefault(transaction.name, []).append(transaction)
+        if previous is not None and previous.end is not None and transaction.start >= previous.end:
+            host_gaps.append(transaction.start - previous.end)
+        previous = transaction
+
+    rows = []
+    for name, transactions in sorted(groups.items()):
+        responses = [t.response_time for t in transactions if t.response_time is not None]
+        durations = [t.duration for t in transactions if t.duration is not None]
+        row = {"name": name, "count": len(transactions)}
+        for result in ("ack", "nack", "error", "timeout"):
+            row[result] = sum(1 for t in transactions if t.result == result)
+        for key, samples in (("resp", responses), ("total", durations)):
+            for pct in (50, 90, 100):
+                column = f"{key}_max_ms" if pct == 100 else f"{key}_p{pct}_ms"
+                row[column] = round(percentile(samples, pct) * 1000, 3) if samples else None
+        rows.append(row)
+
+    sent, received = trace.byte_counts()
+    duration = max(trace.duration, 1e-9)
+    totals = {
+        "duration": round(trace.duration, 6),
+        "transactions": len(decoder.transactions),
+        "bytes_sent": sent,
+        "bytes_received": received,
+        "line_usage": round((sent + received) * 10 / trace.baud / duration, 4) if trace.baud else None,
+        "host_gap_total": round(sum(host_gaps), 6),
+        "host_gap_p50_ms": round(percentile(host_gaps, 50) * 1000, 3) if host_gaps else None,
+        "unexpected_bytes": decoder.unexpected,
+    }
+    return rows, totals
+
+
+def format_totals(trace, totals):
+    usage = "-" if totals["line_usage"] is None else f"{totals['line_usage'] * 100:.0f}%"
+    return (f"{trace.port} @ {trace.baud}: {totals['duration']:.3f}s, {totals['transactions']} 個交易, "
+            f"發送 {totals['bytes_sent']} / 接收 {totals['bytes_received']} 字節 (線路使用率 {usage}), "
+            f"主機處理 {totals['host_gap_total']:.3f}s (中位數 {totals['host_gap_p50_ms']}ms)"
+            + (f", 未對應的回應 {totals['unexpected_bytes']} 字節" if totals['unexpected_bytes'] else "")
+            + (", 錄製不完整" if trace.truncated else ""))
+
+
+def compare(baseline, candidate):
+    """比較兩個錄製中每個命令的回應時間中位數與總耗時，返回表格的行"""
+    base_rows = {row["name"]: row for row in analyze(baseline)[0]}
+    rows = []
+    for row in analyze(candidate)[0]:
+        base = base_rows.get(row["name"])
+        before = base and base["resp_p50_ms"]
+        after = row["resp_p50_ms"]
+        change = f"{(after - before) / before * 100:+.1f}%" if before and after is not None else None
+        rows.append({"name": row["name"], "count": f"{base['count'] if base else 0} -> {row['count']}",
+                     "resp_p50_ms": f"{before} -> {after}", "resp_p90_ms":
+                     f"{base and base['resp_p90_ms']} -> {row['resp_p90_ms']}", "change": change})
+    rows.append({"name": "(全部)", "count": "", "resp_p50_ms": "", "resp_p90_ms": "",
+                 "change": f"{baseline.duration:.3f}s -> {candidate.duration:.3f}s"})
+    return rows
+
+
+def replay(trace, port, output, baud=None):
+    """依錄製的主機端行為重放: 依序寫入相同的數據、以相同的超時讀取相同的字節數，
+    並保持主機在上一筆記錄結束後到下一筆開始之間的處理時間 (回應延遲由目標設備決定)
+
+    重放本身錄製到 output，返回 (重放的 Trace, 回應字節數與錄製不同的讀取次數)。
+    """
+    baud = baud or trace.baud or 115200
+    traced = TracingSerial(open_port(port, baud), TraceWriter(output, port, baud))
+    mismatched = 0
+    previous_end = 0.0
+    replay_end = time.perf_counter()
+    try:
+        for event in trace.events:
+            delay = replay_end + max(0.0, event.time - previous_end) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if event.kind == REC_TX:
+                traced.write(event.data)
+            elif event.kind == REC_RX:
+                if len(traced.read(event.requested)) != len(event.data):
+                    mismatched += 1
+            elif event.kind == REC_BAUD:
+                traced.baudrate = event.value
+            elif event.kind == REC_TIMEOUT:
+                traced.timeout = event.value
+            elif event.kind == REC_FLUSH:
+                traced.reset_input_buffer()
+            previous_end = event.end
+            replay_end = time.perf_counter()
+    finally:
+        traced.close()
+    return read_trace(output), mismatched
+
+
+def print_notes(decoder):
+    for at, direction, text, raw in decoder.notes:
+        preview = raw[:HEX_PREVIEW].hex(' ').upper() + (" ..." if len(raw) > HEX_PREVIEW else "")
+        print(f"{at:11.6f} {direction} {text:<36} {preview}".rstrip())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="串口線路錄製的解碼、統計、比較與重放")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('show', help="列出命令交易 (-v 逐幀標註)")
+    p.add_argument('trace')
+    p.add_argument('-v', '--verbose', action='store_true', help="顯示每一幀與回應的內容")
+
+    p = sub.add_parser('stats', help="每個命令的回應時間分位數與主機處理時間")
+    p.add_argument('trace')
+
+    p = sub.add_parser('compare', help="比較兩個錄製的回應時間 (例如基準與變慢的燒錄站)")
+    p.add_argument('baseline')
+    p.add_argument('trace')
+
+    p = sub.add_parser('replay', help="依原時序對模擬器或實際設備重放，並與錄製比較")
+    p.add_argument('trace')
+    p.add_argument('-p', '--port', default="sim://replay", help="串口名稱或模擬器URL (預設 sim://replay)")
+    p.add_argument('-b', '--baud', type=int, help="連接波特率 (預設為錄製時的波特率)")
+    p.add_argument('-o', '--output', help="重放的錄製文件 (預設 <錄製>.replay.trace)")
+    args = parser.parse_args(argv)
+
+    try:
+        trace = read_trace(args.trace)
+        baseline = read_trace(args.baseline) if args.command == 'compare' else None
+    except (OSError, ValueError) as e:
+        print(f"讀取錄製失敗: {e}", file=sys.stderr)
+        return 2
+
+    if args.command == 'show':
+        decoder = decode_trace(trace)
+        if args.verbose:
+            print_notes(decoder)
+        else:
+            for transaction in decoder.transactions:
+                print(transaction.describe())
+    elif args.command == 'stats':
+        rows, totals = analyze(trace)
+        print(format_totals(trace, totals))
+        print(format_table(rows, ("name", "count", "ack", "nack", "error", "timeout", "resp_p50_ms", "resp_p90_ms",
+                                  "resp_max_ms", "total_p50_ms", "total_max_ms")))
+    elif args.command == 'compare':
+        print(format_table(compare(baseline, trace), ("name", "count", "resp_p50_ms", "resp_p90_ms", "change")))
+    else:
+        output = args.output or os.path.splitext(args.trace)[0] + ".replay.trace"
+        try:
+            replayed, mismatched = replay(trace, args.port, output, args.baud)
+        except Exception as e:
+            print(f"重放失敗: {e}", file=sys.stderr)
+            return 2
+        print(f"已重放到 {args.port}，錄製保存到 {output}"
+              + (f"；{mismatched} 次讀取的回應字節數與錄製不同" if mismatched else ""))
+        print(format_table(compare(trace, replayed), ("name", "count", "resp_p50_ms", "resp_p90_ms", "change")))
+        return 1 if mismatched else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""串口熱插拔監視：背景線程定期比對串口列表，串口出現/消失時觸發事件
+
+可選在符合 VID:PID 或序號的設備插入時自動連接並執行燒錄步驟，
+操作員只需要插上板子；每塊板的結果輸出一行。
+
+用法示例:
+    python bootloader_watch.py --vid-pid 0483:5740
+    python bootloader_watch.py app.bin --vid-pid 0483:5740
+    python bootloader_watch.py app.hex --serial "3473*" --steps erase,write,verify,go --window 4
+"""
+import argparse
+import fnmatch
+import os
+import sys
+import threading
+import time
+
+import serial.tools.list_ports
+
+from bootloader_client import APP_START_ADDRESS, MAX_WRITE_WINDOW
+from bootloader_gang import GANG_STEPS, parse_vid_pid, flash_port, console_log
+from bootloader_image import load_image
+
+WATCH_INTERVAL = 0.25  # 輪詢間隔 (秒)
+ARRIVE_SETTLE = 0.3    # 串口出現後等待驅動就緒再打開 (秒)
+DEV_DIR = "/dev"       # 設備節點增減時此目錄的修改時間會改變
+
+
+def port_signature(port):
+    """同一串口名稱下用來判斷是否換了設備的特徵"""
+    return port.vid, port.pid, port.serial_number
+
+
+def describe_port(port):
+    """單行描述: 串口名稱 VID:PID 序號"""
+    parts = [port.device]
+    if port.vid is not None:
+        parts.append(f"{port.vid:04X}:{port.pid or 0:04X}")
+    if port.serial_number:
+        parts.append(f"SN {port.serial_number}")
+    return " ".join(parts)
+
+
+class PortMatcher:
+    """依 VID:PID 與序號 (可用 * ? 萬用字元) 判斷串口是否為目標設備，沒有條件時全部符合"""
+
+    def __init__(self, vid_pid=None, serial_pattern=None):
+        self.vid, self.pid = parse_vid_pid(vid_pid) if vid_pid else (None, None)
+        self.serial_pattern = serial_pattern
+
+    def __call__(self, port):
+        if self.vid is not None and port.vid != self.vid:
+            return False
+        if self.pid is not None and port.pid != self.pid:
+            return False
+        if self.serial_pattern and not fnmatch.fnmatchcase(port.serial_number or "", self.serial_pattern):
+            return False
+        return True
+
+
+class PortWatcher:
+    """輪詢串口列表，變化時調用 on_arrive(串口信息) 與 on_leave(串口名稱)
+
+    有 /dev 目錄的系統上先比對其修改時間，沒有設備節點增減時不重新枚舉；
+    枚舉後只比對 {串口名稱: 特徵}，同名串口換了設備視為先移除再插入。
+    回調在監視線程中執行，不應長時間阻塞。
+    """
+
+    def __init__(self, on_arrive=None, on_leave=None, interval=WATCH_INTERVAL):
+        self.on_arrive = on_arrive
+        self.on_leave = on_leave
+        self.interval = interval
+        self.signatures = {}
+        self.dev_mtime = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def dev_changed(self):
+        try:
+            mtime = os.stat(DEV_DIR).st_mtime_ns
+        except OSError:
+            return True  # 沒有 /dev (Windows)：每次都枚舉
+        changed = mtime != self.dev_mtime
+        self.dev_mtime = mtime
+        return changed
+
+    def poll(self, force=False):
+        """比對一次並觸發事件，返回 (新出現的串口信息列表, 消失的串口名稱列表)"""
+        if not self.dev_changed() and not force:
+            return [], []
+
+        current = {port.device: port for port in serial.tools.list_ports.comports()}
+        signatures = {device: port_signature(port) for device, port in current.items()}
+        left = [device for device, signature in self.signatures.items() if signatures.get(device) != signature]
+        arrived = [port for device, port in sorted(current.items())
+                   if self.signatures.get(device) != signatures[device]]
+        self.signatures = signatures
+
+        for device in left:
+            if self.on_leave:
+                self.on_leave(device)
+        for port in arrived:
+            if self.on_arrive:
+                self.on_arrive(port)
+        return arrived, left
+
+    def baseline(self):
+        """記錄目前的串口而不觸發事件"""
+        self.dev_changed()
+        self.signatures = {port.device: port_signature(port) for port in serial.tools.list_ports.comports()}
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"串口監視錯誤: {e}", file=sys.stderr)
+
+    def start(self, include_present=False):
+        """啟動監視線程；include_present 為False時已存在的串口不觸發插入事件"""
+        if include_present:
+            self.poll(force=True)
+        else:
+            self.baseline()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+
+class AutoFlasher:
+    """符合條件的串口出現時，在工作線程中連接並執行燒錄步驟 (同一串口同時只有一個任務)
+
+    options 原樣傳給 flash_port (window、blank_check、fast、compress)；
+    on_result 在每塊板完成後以結果字典調用。
+    """
+
+    def __init__(self, segments, matcher, baud=115200, steps=GANG_STEPS, log=None, on_result=None, **options):
+        self.segments = segments
+        self.matcher = matcher
+        self.baud = baud
+        self.steps = steps
+        self.log = log or console_log()
+        self.on_result = on_result
+        self.options = options
+        self.busy = set()
+        self.lock = threading.Lock()
+        self.passed = 0
+        self.failed = 0
+
+    def on_arrive(self, port):
+        if not self.matcher(port):
+            return
+        with self.lock:
+            if port.device in self.busy:
+                return
+            self.busy.add(port.device)
+        threading.Thread(target=self.run, args=(port,), daemon=True).start()
+
+    def run(self, port):
+        try:
+            time.sleep(ARRIVE_SETTLE)
+            self.log(f"開始燒錄 {describe_port(port)}")
+            result = flash_port(port.device, self.baud, self.segments, self.steps, log=self.log, **self.options)
+            result["serial_number"] = port.serial_number
+            with self.lock:
+                if result["ok"]:
+                    self.passed += 1
+                else:
+                    self.failed += 1
+                passed, failed = self.passed, self.failed
+
+            status = "通過" if result["ok"] else f"失敗 ({result['failed_step']})"
+            self.log(f"{describe_port(port)}: {status}, 耗時 {result['elapsed']:.2f}s "
+                     f"(累計 通過 {passed} / 失敗 {failed})")
+            if self.on_result:
+                self.on_result(result)
+        finally:
+            with self.lock:
+                self.busy.discard(port.device)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="STM32 UART Bootloader 串口熱插拔監視與自動燒錄")
+    parser.add_argument('file', nargs='?', help="插入符合條件的設備時要燒錄的固件 (省略則只顯示插拔事件)")
+    parser.add_argument('--vid-pid', help="依VID:PID過濾 (例如 0483:5740)")
+    parser.add_argument('--serial', help="依USB序號過濾 (可用 * ? 萬用字元)")
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    parser.add_argument('--address', type=lambda text: int(text, 0), default=APP_START_ADDRESS,
+                        help="二進位文件的載入地址")
+    parser.add_argument('--steps', default=','.join(GANG_STEPS), help="逗號分隔的步驟 (erase,write,verify,go)")
+    parser.add_argument('--window', type=int, default=0, choices=range(MAX_WRITE_WINDOW + 1), metavar="N",
+                        help=f"管線寫入窗口 (0 = 停等模式，最大 {MAX_WRITE_WINDOW})")
+    parser.add_argument('--no-blank-check', action='store_true', help="不跳過空白扇區")
+    parser.add_argument('--fast', action='store_true', help="連接後協商更高的波特率")
+    parser.add_argument('--compress', action='store_true', help="壓縮傳輸 (Bootloader不支援時自動回退)")
+    parser.add_argument('--include-present', action='store_true', help="啟動時已連接的設備也燒錄")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help="輪詢間隔 (秒)")
+    args = parser.parse_args(argv)
+
+    steps = [step.strip() for step in args.steps.split(',') if step.strip()]
+    for step in steps:
+        if step not in GANG_STEPS:
+            parser.error(f"未知步驟: {step}")
+
+    log = console_log()
+    matcher = PortMatcher(args.vid_pid, args.serial)
+    flasher = None
+    if args.file:
+        flasher = AutoFlasher(load_image(args.file, args.address), matcher, args.baud, steps, log,
+                              window=args.window, blank_check=not args.no_blank_check,
+                              fast=args.fast, compress=args.compress)
+
+    def on_arrive(port):
+        log(f"串口插入: {describe_port(port)}{'' if matcher(port) else ' (不符合條件)'}")
+        if flasher:
+            flasher.on_arrive(port)
+
+    watcher = PortWatcher(on_arrive, lambda device: log(f"串口移除: {device}"), args.interval)
+    log(f"監視串口中{' (自動燒錄 ' + args.file + ')' if flasher else ''}，按 Ctrl+C 結束")
+    watcher.start(args.include_present)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+
+    if flasher:
+        log(f"結束: 通過 {flasher.passed}，失敗 {flasher.failed}")
+        return 0 if flasher.failed == 0 else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""測試共用設定：讓測試直接導入倉庫根目錄的模組，狀態文件寫到臨時目錄"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bootloader_client
+import bootloader_sim
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """各測試使用獨立的狀態文件與模擬器"""
+    for name in ("DELTA_CACHE_FILE", "BAUD_MEMORY_FILE", "ERASE_TIMING_FILE", "JOURNAL_FILE"):
+        monkeypatch.setattr(bootloader_client, name, str(tmp_path / f"{name.lower()}.json"))
+    monkeypatch.setattr(bootloader_sim, "SIM_DEVICES", {})
+
+
+@pytest.fixture
+def connect_sim():
+    """連接進程內模擬器，返回 (客戶端, 模擬設備, 日誌列表)"""
+    clients = []
+
+    def connect(options="", baud=921600):
+        logs = []
+        client = bootloader_client.BootloaderClient(log=logs.append)
+        client.connect(f"sim://test?erase_time=0.001{options}", baud)
+        clients.append(client)
+        return client, bootloader_sim.SIM_DEVICES["test"], logs
+
+    yield connect
+    for client in clients:
+        client.disconnect()
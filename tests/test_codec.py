@@ -0,0 +1,58 @@
+"""壓縮寫入的塊格式: 壓縮/解壓往返與格式錯誤的輸入"""
+import random
+
+import pytest
+
+from bootloader_codec import LAST_LITERALS, compress_block, decompress_block
+
+
+def sample_blocks():
+    rng = random.Random(5)
+    text = b"STM32F411 bootloader frame " * 40
+    return {
+        "empty": b"",
+        "one": b"\x42",
+        "short": b"abcdefgh",
+        "zeros": bytes(1024),
+        "blank": b"\xFF" * 1024,
+        "random": bytes(rng.getrandbits(8) for _ in range(1024)),
+        "text": text,
+        "long_literals": bytes(rng.getrandbits(8) for _ in range(600)) + bytes(400),
+        "period_3": b"\x01\x02\x03" * 300,
+        "mixed": b"".join(bytes(rng.getrandbits(8) for _ in range(rng.randrange(1, 40))) * rng.randrange(1, 5)
+                          for _ in range(40)),
+    }
+
+
+@pytest.mark.parametrize("name", sorted(sample_blocks()))
+def test_round_trip(name):
+    data = sample_blocks()[name]
+    packed = compress_block(data)
+    assert decompress_block(packed, len(data)) == data
+    if len(data) >= LAST_LITERALS:
+        assert packed.endswith(data[-LAST_LITERALS:])  # 塊尾一定是字面量
+
+
+def test_repetitive_data_shrinks():
+    assert len(compress_block(bytes(1024))) < 32
+    assert len(compress_block(b"\x01\x02\x03" * 300)) < 32
+
+
+def test_hand_built_overlapping_match():
+    # 字面量 "ab" 之後以偏移2重複10字節，再接5字節字面量
+    block = bytes([0x26]) + b"ab" + bytes([2, 0]) + bytes([0x50]) + b"tail!"
+    assert decompress_block(block, 17) == b"ab" * 6 + b"tail!"
+
+
+@pytest.mark.parametrize("block, raw_length", [
+    (bytes([0x40]) + b"abcd" + bytes([0, 0]), 8),             # 偏移為0
+    (bytes([0x40]) + b"abcd" + bytes([5, 0]), 8),             # 偏移超出已解壓數據
+    (bytes([0x40]) + b"abcd" + bytes([1]), 8),                # 偏移被截斷
+    (bytes([0xF0]), 20),                                      # 長度擴展被截斷
+    (bytes([0x4F]) + b"abcd" + bytes([4, 0, 255]), 300),      # 匹配長度擴展被截斷
+    (bytes([0x50]) + b"abc", 5),                              # 字面量不足
+    (compress_block(bytes(256)), 255),                        # 解壓長度不符
+])
+def test_malformed_input(block, raw_length):
+    with pytest.raises(ValueError):
+        decompress_block(block, raw_length)
@@ -0,0 +1,90 @@
+"""STM32 CRC32: 已知向量、參考實現對照與Bootloader CRC命令"""
+import random
+
+import pytest
+
+from bootloader_client import APP_START_ADDRESS, CMD_CRC
+from bootloader_frames import stm32_crc32
+from bootloader_sim import FLASH_BASE, NACK, crc32_words
+
+
+def bitwise_crc(data):
+    """逐位計算: 每個小端32位字高位先移入，多項式0x04C11DB7，初值0xFFFFFFFF"""
+    data = bytes(data) + b'\xFF' * (-len(data) % 4)
+    crc = 0xFFFFFFFF
+    for i in range(0, len(data), 4):
+        crc ^= int.from_bytes(data[i:i + 4], 'little')
+        for _ in range(32):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b'', 0xFFFFFFFF),
+    (bytes(4), 0xC704DD7B),
+    ((0x12345678).to_bytes(4, 'little'), 0xDF8A8A2B),
+    (b'\xFF' * 4, 0x00000000),
+])
+def test_known_vectors(data, expected):
+    assert stm32_crc32(data) == expected
+
+
+@pytest.mark.parametrize("length", [1, 2, 3, 4, 5, 63, 64, 255, 256, 1021])
+def test_matches_references(length):
+    data = bytes(random.Random(length).getrandbits(8) for _ in range(length))
+    assert stm32_crc32(data) == bitwise_crc(data) == crc32_words(data)
+
+
+def test_partial_word_padded_with_ff():
+    assert stm32_crc32(b'\x01\x02') == stm32_crc32(b'\x01\x02\xFF\xFF')
+
+
+def test_appending_crc_gives_zero_residue():
+    data = bytes(random.Random(9).getrandbits(8) for _ in range(128))
+    assert stm32_crc32(data + stm32_crc32(data).to_bytes(4, 'little')) == 0
+
+
+def fill_flash(device, address, data):
+    offset = address - FLASH_BASE
+    device.flash[offset:offset + len(data)] = data
+
+
+def test_crc_command_matches_flash(connect_sim):
+    client, device, _ = connect_sim()
+    data = bytes(random.Random(10).getrandbits(8) for _ in range(0x1000))
+    fill_flash(device, APP_START_ADDRESS, data)
+
+    assert client.crc_memory(APP_START_ADDRESS, len(data)) == stm32_crc32(data)
+    assert client.crc_memory(APP_START_ADDRESS + 1, 7) == stm32_crc32(data[1:8])
+    assert client.verify_image(APP_START_ADDRESS, data)
+    fill_flash(device, APP_START_ADDRESS + 0x800, b'\x00')
+    assert not client.verify_image(APP_START_ADDRESS, data)
+
+
+def test_stray_nack_does_not_disable_crc(connect_sim):
+    client, device, _ = connect_sim()
+    data = bytes(random.Random(11).getrandbits(8) for _ in range(0x400))
+    fill_flash(device, APP_START_ADDRESS, data)
+    start_command = device.start_command
+    rejected = []
+
+    def nack_first_crc(command, t):
+        if command == CMD_CRC and not rejected:
+            rejected.append(command)
+            device.respond(bytes([NACK]), t)
+        else:
+            start_command(command, t)
+
+    device.start_command = nack_first_crc
+    assert client.crc_memory(APP_START_ADDRESS, len(data)) == stm32_crc32(data)
+    assert rejected and client.session.supports(CMD_CRC) is True
+
+
+def test_unsupported_crc_falls_back_to_readback(connect_sim):
+    client, device, _ = connect_sim("&crc=0")
+    data = bytes(random.Random(12).getrandbits(8) for _ in range(0x400))
+    fill_flash(device, APP_START_ADDRESS, data)
+
+    assert client.crc_memory(APP_START_ADDRESS, len(data)) is None
+    assert client.session.supports(CMD_CRC) is False
+    assert client.verify_image(APP_START_ADDRESS, data)
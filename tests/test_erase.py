@@ -0,0 +1,64 @@
+"""扇區擦除: 擴展格式與舊版Bootloader的原有格式回退"""
+import pytest
+
+from bootloader_client import CMD_CRC, FLASH_SECTORS
+from bootloader_sim import FLASH_BASE
+
+
+def mark_sectors(device, sectors):
+    """在每個扇區開頭寫入非0xFF的標記"""
+    for sector in sectors:
+        offset = FLASH_SECTORS[sector][0] - FLASH_BASE
+        device.flash[offset:offset + 4] = bytes([0xA0 + sector] * 4)
+
+
+def erased(device, sector):
+    start, length = FLASH_SECTORS[sector]
+    return device.flash[start - FLASH_BASE:start - FLASH_BASE + length].count(0xFF) == length
+
+
+def test_extended_erase_only_touches_requested_sectors(connect_sim):
+    client, device, _ = connect_sim()
+    mark_sectors(device, range(2, 8))
+
+    assert client.erase_sectors([4, 6])
+
+    assert [erased(device, sector) for sector in range(2, 8)] == [False, False, True, False, True, False]
+    assert client.session.extended_erase is True
+
+
+@pytest.mark.parametrize("sectors", [[4, 5], [2, 4]])
+def test_legacy_fallback_erases_prefix_when_blank(connect_sim, sectors):
+    client, device, logs = connect_sim("&extended_erase=0")
+    mark_sectors(device, sectors + [6])
+
+    assert client.erase_sectors(sectors)
+
+    assert all(erased(device, sector) for sector in range(2, max(sectors) + 1))
+    assert not erased(device, 6)
+    assert client.session.extended_erase is False
+    assert any("改用原有格式" in line for line in logs)
+    # 擴展格式的殘留字節 (扇區號2會被當作GET_ID) 已在重新同步時清空，之後的命令不受影響
+    assert client.session.supports(CMD_CRC) is not False
+    assert client.crc_memory(*FLASH_SECTORS[2]) is not None
+    assert client.session.supports(CMD_CRC) is True
+
+
+def test_legacy_fallback_refuses_to_erase_data(connect_sim):
+    client, device, logs = connect_sim("&extended_erase=0")
+    mark_sectors(device, [3, 4, 5])
+
+    assert not client.erase_sectors([4, 5])
+
+    assert not erased(device, 3) and not erased(device, 4)
+    assert any("非空白" in line for line in logs)
+
+
+def test_legacy_fallback_with_expendable_sectors(connect_sim):
+    client, device, _ = connect_sim("&extended_erase=0")
+    mark_sectors(device, [2, 3, 5, 6])
+
+    assert client.erase_sectors([5], expendable=[2, 3])
+
+    assert [erased(device, sector) for sector in range(2, 7)] == [True, True, True, True, False]
+    assert client.erased_sectors >= {2, 3, 4, 5}
@@ -0,0 +1,94 @@
+"""命令幀編碼: xor_checksum 與 FrameEncoder 對照逐字節的參考實現"""
+import random
+import struct
+from functools import reduce
+
+import pytest
+
+from bootloader_frames import (FrameEncoder, xor_checksum, encode_address, encode_data, prepare_frame,
+                               pack_frames, unpack_frames)
+
+
+def reference_xor(data, initial=0):
+    return reduce(lambda x, b: x ^ b, data, initial)
+
+
+@pytest.mark.parametrize("length", [1, 2, 3, 4, 5, 7, 8, 9, 255, 256, 257, 1024])
+def test_xor_checksum_matches_bytewise(length):
+    rng = random.Random(length)
+    data = bytes(rng.getrandbits(8) for _ in range(length))
+    assert xor_checksum(data) == reference_xor(data)
+    assert xor_checksum(data, 0x5A) == reference_xor(data, 0x5A)
+    assert xor_checksum(memoryview(data)) == reference_xor(data)
+
+
+def test_xor_checksum_empty():
+    assert xor_checksum(b'') == 0
+    assert xor_checksum(b'', 0x12) == 0x12
+
+
+@pytest.mark.parametrize("address", [0x08000000, 0x08008000, 0x0807FFFC, 0x1FFF7A10, 0x000E1000])
+def test_address_packet(address):
+    packet = struct.pack('>I', address)
+    expected = packet + bytes([reference_xor(packet)])
+    assert bytes(FrameEncoder().address_packet(address)) == expected
+    assert encode_address(address) == expected
+
+
+@pytest.mark.parametrize("length", [1, 4, 255, 256])
+def test_data_packet(length):
+    data = bytes(random.Random(length).getrandbits(8) for _ in range(length))
+    expected = bytes([length - 1]) + data + bytes([reference_xor(data, length - 1)])
+    assert bytes(FrameEncoder().data_packet(data)) == expected
+    assert encode_data(data) == expected
+
+
+@pytest.mark.parametrize("length", [1, 16, 256])
+def test_length_packet(length):
+    assert bytes(FrameEncoder().length_packet(length)) == bytes([length - 1, 0xFF ^ (length - 1)])
+
+
+def test_erase_packet_legacy():
+    assert bytes(FrameEncoder().erase_packet([2, 3, 4], False)) == bytes([3, 0xFC])
+
+
+@pytest.mark.parametrize("sectors", [[0], [4, 5], [2, 3, 4, 5, 6, 7], [7, 3]])
+def test_erase_packet_extended(sectors):
+    body = struct.pack(f'>{len(sectors) + 1}H', len(sectors) - 1, *sectors)
+    assert bytes(FrameEncoder().erase_packet(sectors, True)) == body + bytes([reference_xor(body)])
+
+
+def test_compressed_packet():
+    payload = bytes(random.Random(3).getrandbits(8) for _ in range(100))
+    header = struct.pack('>HH', 255, len(payload) - 1)
+    expected = header + payload + bytes([reference_xor(header + payload)])
+    assert bytes(FrameEncoder().compressed_packet(256, payload)) == expected
+
+
+def test_write_frame_and_read_request():
+    encoder = FrameEncoder()
+    frame = prepare_frame(0x08008100, bytes(range(256)))
+    expected = bytes([0x31]) + encode_address(0x08008100) + encode_data(bytes(range(256)))
+    assert bytes(encoder.write_frame(frame)) == expected
+    assert bytes(encoder.read_request(0x08008000, 256)) == bytes([0x11]) + encode_address(0x08008000) + b'\xFF\x00'
+
+
+def test_prepared_frame_trims_blank_tail():
+    data = bytes(range(1, 11)) + b'\xFF' * 246
+    frame = prepare_frame(0x08008000, data)
+    assert frame.blank_length == 12
+    trimmed = frame.trimmed()
+    assert trimmed.data == data[:12]
+    assert trimmed.data_packet == encode_data(data[:12])
+    assert prepare_frame(0x08008000, b'\xFF' * 256).blank_length == 0
+
+
+def test_pack_frames_round_trip():
+    rng = random.Random(4)
+    frames = [prepare_frame(0x08008000 + 256 * i, bytes(rng.getrandbits(8) for _ in range(200)) + b'\xFF' * 56)
+              for i in range(4)]
+    restored = unpack_frames(pack_frames(frames))
+    assert [(f.address, f.data, f.data_packet, f.trimmed_packet) for f in restored] == \
+           [(f.address, f.data, f.data_packet, f.trimmed_packet) for f in frames]
+    with pytest.raises(ValueError):
+        unpack_frames(b'NOTFRAME' + bytes(8))
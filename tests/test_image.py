@@ -0,0 +1,115 @@
+"""固件映像: HEX/S-record/ELF 解析、段合併與切幀"""
+import io
+import random
+import struct
+
+import pytest
+
+from bootloader_image import (IntelHexWriter, SrecWriter, parse_intel_hex, parse_srec, parse_elf, merge_segments,
+                              load_image, split_frames, join_frames)
+
+
+def random_bytes(size, seed):
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+SEGMENTS = [(0x08008000, random_bytes(300, 1)), (0x0800FFF0, random_bytes(40, 2)), (0x08020000, random_bytes(5, 3))]
+
+
+def write_text(writer_class, segments, **kwargs):
+    f = io.StringIO()
+    writer = writer_class(f, **kwargs)
+    for address, data in segments:
+        writer.write(address, data)
+    writer.close()
+    return f.getvalue()
+
+
+def build_elf(program_headers, endian='<'):
+    """最小的ELF32: 文件頭 + 程序頭 [(p_type, p_paddr, 數據, p_memsz)]，數據依序放在程序頭之後"""
+    phoff = 52
+    offset = phoff + 32 * len(program_headers)
+    header = bytearray(b'\x7fELF' + bytes([1, 1 if endian == '<' else 2, 1]) + bytes(9))
+    header += struct.pack(endian + 'HHIIIIIHHHHHH', 2, 40, 1, 0, phoff, 0, 0, 52, 32, len(program_headers), 0, 0, 0)
+    table, payload = bytearray(), bytearray()
+    for p_type, p_paddr, data, p_memsz in program_headers:
+        table += struct.pack(endian + 'IIIIIIII', p_type, offset + len(payload), p_paddr + 0x10000000, p_paddr,
+                             len(data), p_memsz, 5, 4)
+        payload += data
+    return bytes(header + table + payload)
+
+
+def test_intel_hex_known_records():
+    text = ":020000040800F2\n:0400000001020304F2\n:020000021000EC\n:02000400AABB95\n:00000001FF\n:0100000055AA\n"
+    assert parse_intel_hex(text) == [(0x08000000, b'\x01\x02\x03\x04'), (0x10004, b'\xAA\xBB')]
+
+
+def test_intel_hex_writer_round_trip():
+    text = write_text(IntelHexWriter, SEGMENTS)
+    assert merge_segments(parse_intel_hex(text)) == SEGMENTS
+    assert ":020000040801F1\n" in text  # 跨越64KB邊界時輸出擴展線性地址記錄
+
+
+@pytest.mark.parametrize("line", ["0400000001020304F2", ":0500000001020304F2", ":0400000001020304F3"])
+def test_intel_hex_rejects_bad_lines(line):
+    with pytest.raises(ValueError, match="第2行"):
+        parse_intel_hex(":020000040800F2\n" + line)
+
+
+def test_srec_known_records():
+    text = "S00600004844521B\nS10510000102E7\nS2060100000A0BE3\nS5030001FB\nS9030000FC\n"
+    assert parse_srec(text) == [(0x1000, b'\x01\x02'), (0x010000, b'\x0A\x0B')]
+
+
+def test_srec_writer_round_trip():
+    text = write_text(SrecWriter, SEGMENTS, start_address=0x08008000)
+    assert text.startswith("S0") and text.rstrip().endswith("S70508008000" + "72")
+    assert merge_segments(parse_srec(text)) == SEGMENTS
+
+
+@pytest.mark.parametrize("line", ["X10510000102E7", "S10610000102E7", "S10510000102E8"])
+def test_srec_rejects_bad_lines(line):
+    with pytest.raises(ValueError, match="第1行"):
+        parse_srec(line)
+
+
+@pytest.mark.parametrize("endian", ['<', '>'])
+def test_elf_load_segments(endian):
+    code, data = random_bytes(64, 4), random_bytes(16, 5)
+    blob = build_elf([(1, 0x08008000, code, 64), (4, 0, b'note', 4), (1, 0x20000000, b'', 256),
+                      (1, 0x08008040, data, 32)], endian)
+    assert parse_elf(blob) == [(0x08008000, code), (0x08008040, data)]  # 使用載入地址，略過非LOAD與BSS段
+
+
+def test_elf_rejects_other_files():
+    with pytest.raises(ValueError):
+        parse_elf(b'MZ' + bytes(60))
+    with pytest.raises(ValueError):
+        parse_elf(b'\x7fELF\x02\x01' + bytes(58))
+
+
+def test_merge_segments():
+    segments = [(0x300, b'C' * 4), (0x100, b'A' * 16), (0x110, b'B' * 8), (0x104, b'x' * 4), (0x300, b'D' * 2)]
+    assert merge_segments(segments) == [(0x100, b'AAAA' + b'xxxx' + b'A' * 8 + b'B' * 8), (0x300, b'DDCC')]
+    assert merge_segments([]) == []
+
+
+def test_load_image_formats(tmp_path):
+    (tmp_path / "a.hex").write_text(write_text(IntelHexWriter, SEGMENTS))
+    (tmp_path / "a.s19").write_text(write_text(SrecWriter, SEGMENTS))
+    (tmp_path / "a.elf").write_bytes(build_elf([(1, address, data, len(data)) for address, data in SEGMENTS]))
+    (tmp_path / "a.bin").write_bytes(SEGMENTS[0][1])
+    for name in ("a.hex", "a.s19", "a.elf"):
+        assert load_image(str(tmp_path / name)) == SEGMENTS
+    assert load_image(str(tmp_path / "a.bin"), 0x08008000) == SEGMENTS[:1]
+
+
+def test_split_and_join_frames():
+    frames = split_frames(SEGMENTS)
+    assert all(address // 256 == (address + len(data) - 1) // 256 for address, data in frames)
+    assert [address for address, _ in frames[:3]] == [0x08008000, 0x08008100, 0x0800FFF0]
+    assert merge_segments(frames) == SEGMENTS
+    blocks = join_frames(frames)
+    assert all(address // 1024 == (address + len(data) - 1) // 1024 for address, data in blocks)
+    assert merge_segments(blocks) == SEGMENTS
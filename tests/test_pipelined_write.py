@@ -0,0 +1,55 @@
+"""管線寫入: 窗口上限與NACK/丟失回應後的恢復"""
+import random
+import struct
+
+from bootloader_client import APP_START_ADDRESS, MAX_WRITE_WINDOW
+from bootloader_sim import FLASH_BASE, xor
+
+
+def command_like_image(size):
+    """內容含有擦除 (0x44) 與跳轉 (0x21) 命令序列的映像：被當作命令解析時會全片擦除或跳轉"""
+    go = bytes([0x21, 0xDE]) + struct.pack('>I', APP_START_ADDRESS)
+    go += bytes([xor(go[2:])])
+    mass_erase = bytes([0x44, 0xBB, 0xFF, 0xFF, 0x00])
+    pattern = go + mass_erase
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def image_in_flash(device, address, size):
+    offset = address - FLASH_BASE
+    return bytes(device.flash[offset:offset + size])
+
+
+def test_nack_inside_window_executes_nothing(connect_sim):
+    client, device, _ = connect_sim()
+    data = command_like_image(0x2000)
+    device.flash[:16] = b'\x5A' * 16  # Bootloader扇區的標記，全片擦除會清掉
+    device.nack_addresses = {APP_START_ADDRESS + 0x100, APP_START_ADDRESS + 0x800, APP_START_ADDRESS + 0x1F00}
+
+    assert client.write_image(APP_START_ADDRESS, data, MAX_WRITE_WINDOW)
+
+    assert device.injected["nack"] == 3
+    assert device.jumped_to is None
+    assert bytes(device.flash[:16]) == b'\x5A' * 16
+    assert image_in_flash(device, APP_START_ADDRESS, len(data)) == data
+
+
+def test_dropped_responses_recover(connect_sim):
+    client, device, _ = connect_sim("&drop_rate=0.05&nack_rate=0.1&seed=7")
+    data = command_like_image(0x1000)[:0x800] + bytes(random.Random(1).getrandbits(8) for _ in range(0x800))
+
+    assert client.write_image(APP_START_ADDRESS, data, MAX_WRITE_WINDOW)
+
+    assert device.injected["drop"] > 0 and device.injected["nack"] > 0
+    assert device.jumped_to is None
+    assert image_in_flash(device, APP_START_ADDRESS, len(data)) == data
+
+
+def test_window_is_capped(connect_sim):
+    client, device, logs = connect_sim()
+    data = bytes(random.Random(2).getrandbits(8) for _ in range(0x400))
+
+    assert client.write_image(APP_START_ADDRESS, data, MAX_WRITE_WINDOW * 4)
+
+    assert any("超過上限" in line for line in logs)
+    assert image_in_flash(device, APP_START_ADDRESS, len(data)) == data
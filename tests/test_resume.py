@@ -0,0 +1,82 @@
+"""寫入日誌與續傳: 中斷後從第一個未確認的幀繼續"""
+import json
+import random
+
+import pytest
+
+import bootloader_client
+from bootloader_client import APP_START_ADDRESS, BootloaderClient
+from bootloader_sim import FLASH_BASE
+
+DATA = bytes(random.Random(3).getrandbits(8) for _ in range(0x14000))
+SEGMENTS = [(APP_START_ADDRESS, DATA)]
+FAIL_ADDRESS = APP_START_ADDRESS + 0x8000
+
+
+@pytest.fixture
+def interrupted(connect_sim):
+    """寫到 FAIL_ADDRESS 時失敗 (不重試) 的第一次寫入，返回模擬設備"""
+    client, device, _ = connect_sim()
+    client.retry_chunk = lambda opcode, attempt, address, retries=0: \
+        BootloaderClient.retry_chunk(client, opcode, attempt, address, 0)
+    assert client.erase_segments(SEGMENTS)
+    device.nack_addresses.add(FAIL_ADDRESS)
+    assert not client.write_segments(SEGMENTS)
+    client.disconnect()
+    return device
+
+
+def journal_entries():
+    with open(bootloader_client.JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        return list(json.load(f).values())
+
+
+def record_writes(device):
+    addresses = []
+    on_write_data = device.on_write_data
+
+    def recording(frame, t):
+        addresses.append(device.address)
+        on_write_data(frame, t)
+
+    device.on_write_data = recording
+    return addresses
+
+
+def test_failed_write_is_journaled(interrupted):
+    entries = journal_entries()
+    assert len(entries) == 1
+    assert APP_START_ADDRESS < entries[0]["written_end"] <= FAIL_ADDRESS
+
+
+def test_resume_writes_only_the_rest(interrupted, connect_sim):
+    written_end = journal_entries()[0]["written_end"]
+    client, device, logs = connect_sim()
+    writes = record_writes(device)
+
+    assert client.write_segments(SEGMENTS, resume=True)
+
+    assert min(writes) == written_end
+    assert any("繼續寫入" in line for line in logs)
+    assert client.verify_segments(SEGMENTS)
+    assert journal_entries() == []
+
+
+def test_resume_refuses_mismatched_flash(interrupted, connect_sim):
+    offset = APP_START_ADDRESS + 0x7F00 - FLASH_BASE
+    interrupted.flash[offset:offset + 4] = bytes(4)
+    client, _, logs = connect_sim()
+
+    assert not client.write_segments(SEGMENTS, resume=True)
+    assert "無法續傳" in logs[-1]
+
+
+def test_resume_without_journal_writes_everything(connect_sim):
+    client, device, _ = connect_sim()
+    assert client.erase_segments(SEGMENTS)
+    writes = record_writes(device)
+
+    assert client.write_segments(SEGMENTS, resume=True)
+
+    assert min(writes) == APP_START_ADDRESS
+    assert client.verify_segments(SEGMENTS)